@@ -1,10 +1,24 @@
 # crypto_assistant/__init__.py
 
 from .audio_processing import convert_audio_to_text
-from .assistant_manager import initialize_client, add_message_to_thread
+from .assistant_manager import initialize_client, add_message_to_thread, AssistantSession, assistant_session
+from .transcription import TranscriptionService, transcription_service
+from .intent_parser import parse_payment_command, parse_confirmation, amount_error, InvalidAmountError
+from .batching import MicroBatcher, transcription_batcher, transcribe_voice
 
 __all__ = [
     "convert_audio_to_text",
     "initialize_client",
     "add_message_to_thread",
+    "AssistantSession",
+    "assistant_session",
+    "TranscriptionService",
+    "transcription_service",
+    "MicroBatcher",
+    "transcription_batcher",
+    "transcribe_voice",
+    "parse_payment_command",
+    "parse_confirmation",
+    "amount_error",
+    "InvalidAmountError",
 ]
@@ -1,25 +1,58 @@
+import asyncio
+import contextvars
 import json
 import re
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 import os
 from dotenv import load_dotenv
+from .config import (
+    ASSISTANT_STREAMING,
+    RUN_TIMEOUT_SECONDS,
+    RUN_POLL_INITIAL_MS,
+    RUN_POLL_MAX_MS,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_KEEPALIVE_SECONDS,
+    THREAD_MAX_MESSAGES,
+    THREAD_MAX_TOKENS,
+    THREAD_SUMMARY_MESSAGES,
+)
+from .thread_registry import thread_registry
 
 # Load environment variables from the .env file
 load_dotenv()
 
-def initialize_client():
+# Run states after which the run will make no further progress on its own.
+# 'requires_action' keeps the thread locked, so run_assistant cancels it.
+TERMINAL_RUN_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+
+
+class AssistantRunError(Exception):
+    """Raised when an assistant run ends in a state other than completed."""
+
+    def __init__(self, status, detail=None):
+        self.status = status
+        self.detail = detail
+        super().__init__(f"Assistant run {status}" + (f": {detail}" if detail else ""))
+
+
+# API calls made while handling the current message, see AssistantSession.send
+_message_api_calls = contextvars.ContextVar("message_api_calls", default=None)
+
+
+async def initialize_client(create_thread=False):
     """
-    Interacts with the OpenAI assistant to extract payment information,
-    prompt for missing details, and generate the final JSON.
+    Returns the process-wide OpenAI client and assistant id.
 
     Parameters:
-    transcribed_text (str): The text transcribed from the audio.
+    create_thread (bool): Also create a new thread. Per-user threads are
+        normally created lazily by AssistantSession instead.
 
     Returns:
-    str: A JSON string representing the payment information.
+    tuple: (client, assistant_id, thread), where thread is None unless
+           create_thread is set.
     """
-    # Load OpenAI API key from environment variable
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = assistant_session.client
 
     try:
         # # Initial conversation loop
@@ -43,17 +76,245 @@ def initialize_client():
         #     model="gpt-4o-mini",
         #     instructions=instructions,
         # )
-        assistant_id = os.getenv("ASSISTANT_ID")
-        
-        thread = client.beta.threads.create()
+        assistant_id = assistant_session.assistant_id
+
+        thread = await client.beta.threads.create() if create_thread else None
         return client, assistant_id, thread
     except Exception as e:
         print(f"Error initializing client: {e}")
         return None, None, None
     
-def add_message_to_thread(client, thread, message):
-    client.beta.threads.messages.create(
+async def add_message_to_thread(client, thread, message):
+    await client.beta.threads.messages.create(
         thread_id=thread.id,
         role="user",
         content=message
     )
+
+async def run_assistant(client, thread_id, assistant_id, timeout=RUN_TIMEOUT_SECONDS, return_run=False):
+    """
+    Runs the assistant on a thread and returns its reply without blocking the
+    event loop.
+
+    The run is streamed when ASSISTANT_STREAMING is enabled, otherwise it is
+    polled with adaptive backoff. Runs that exceed the timeout or stop at
+    requires_action (the bot has no tools to answer with) are cancelled so
+    the thread accepts new messages.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client.
+    thread_id (str): The thread to run on.
+    assistant_id (str): The assistant to run.
+    timeout (float): Seconds to wait for the run to finish.
+    return_run (bool): Also return the completed run, e.g. for its usage.
+
+    Returns:
+    str: The assistant's reply, or (reply, run) with return_run.
+
+    Raises:
+    AssistantRunError: If the run fails, is cancelled, expires or times out.
+    """
+    run_id = None
+    try:
+        async with asyncio.timeout(timeout):
+            if ASSISTANT_STREAMING:
+                async with client.beta.threads.runs.stream(thread_id=thread_id, assistant_id=assistant_id) as stream:
+                    async for event in stream:
+                        if event.event == "thread.run.created":
+                            run_id = event.data.id
+                    run = stream.current_run
+            else:
+                run = await client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+                run_id = run.id
+                run = await wait_for_run(client, thread_id, run.id)
+    except TimeoutError:
+        if run_id:
+            await cancel_run(client, thread_id, run_id)
+        raise AssistantRunError("timed out", f"no result after {timeout}s")
+
+    if run is not None and run.status == "requires_action":
+        await cancel_run(client, thread_id, run.id)
+    if run is None or run.status != "completed":
+        status = run.status if run else "missing"
+        detail = run.last_error.message if run is not None and run.last_error else None
+        raise AssistantRunError(status, detail)
+
+    messages = await client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id, order="desc", limit=1)
+    reply = messages.data[0].content[0].text.value if messages.data else None
+    return (reply, run) if return_run else reply
+
+async def cancel_run(client, thread_id, run_id):
+    """
+    Cancels a run that is still active, releasing its thread.
+    """
+    try:
+        await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"Error cancelling run {run_id}: {e}")
+
+async def wait_for_run(client, thread_id, run_id):
+    """
+    Polls a run until it reaches a terminal state, starting at
+    RUN_POLL_INITIAL_MS and backing off towards RUN_POLL_MAX_MS.
+    """
+    delay = RUN_POLL_INITIAL_MS / 1000
+    while True:
+        run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+        if run.status in TERMINAL_RUN_STATUSES:
+            return run
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, RUN_POLL_MAX_MS / 1000)
+
+
+
+class AssistantSession:
+    """
+    Process-wide assistant session.
+
+    Holds one OpenAI client whose keep-alive HTTP connection pool is reused by
+    every message, and resolves each user's thread through the thread
+    registry, creating it only the first time a user talks to the assistant.
+    Every HTTP request the client makes is counted so the API calls per
+    message can be monitored.
+
+    Threads are bounded: once a thread holds `max_messages` messages or its
+    last run's prompt reached `max_tokens`, the user moves to a fresh thread
+    seeded with a short summary and any pending payment intent, so runs don't
+    re-process an ever-growing history.
+    """
+
+    def __init__(self, api_key=None, assistant_id=None, registry=thread_registry,
+                 max_messages=THREAD_MAX_MESSAGES, max_tokens=THREAD_MAX_TOKENS):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.assistant_id = assistant_id or os.getenv("ASSISTANT_ID")
+        self.registry = registry
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._client = None
+        self.stats = {"messages": 0, "api_calls": 0, "threads_created": 0, "threads_rotated": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_SECONDS,
+                ),
+                event_hooks={"request": [self._count_request]},
+            )
+            self._client = AsyncOpenAI(api_key=self.api_key, http_client=http_client)
+        return self._client
+
+    async def _count_request(self, request):
+        self.stats["api_calls"] += 1
+        counter = _message_api_calls.get()
+        if counter is not None:
+            counter[0] += 1
+
+    async def get_thread_id(self, user_id, username, pending_intent=None):
+        """
+        Returns the user's thread id, creating the thread on first use and
+        rotating it once it has grown past the configured limits.
+        """
+        entry = await self.registry.get_async(user_id)
+        if not entry:
+            thread = await self.client.beta.threads.create()
+            self.stats["threads_created"] += 1
+            self.registry.set(user_id, thread.id, username, messages=0, prompt_tokens=0)
+            return thread.id
+
+        if (entry.get("messages", 0) >= self.max_messages
+                or entry.get("prompt_tokens", 0) >= self.max_tokens):
+            return await self.rotate_thread(user_id, username, entry, pending_intent)
+        return entry["thread_id"]
+
+    async def rotate_thread(self, user_id, username, entry, pending_intent=None):
+        """
+        Moves a user to a fresh thread seeded with a compact summary of the
+        old one and, if set, the payment waiting for confirmation.
+        """
+        seed = []
+        summary = await self._summarize_thread(entry["thread_id"])
+        if summary:
+            seed.append({"role": "assistant", "content": f"Summary of our earlier conversation:\n{summary}"})
+        if pending_intent:
+            seed.append({
+                "role": "assistant",
+                "content": f"Payment awaiting the user's confirmation: {json.dumps(pending_intent)}",
+            })
+
+        thread = await self.client.beta.threads.create(messages=seed)
+        self.stats["threads_rotated"] += 1
+        self.registry.set(
+            user_id, thread.id, username,
+            messages=len(seed),
+            prompt_tokens=0,
+            rotations=entry.get("rotations", 0) + 1,
+            previous_thread_id=entry["thread_id"],
+        )
+        print(f"Rotated thread for user {user_id} after {entry.get('messages', 0)} messages")
+        return thread.id
+
+    async def _summarize_thread(self, thread_id, limit=THREAD_SUMMARY_MESSAGES):
+        try:
+            messages = await self.client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=limit)
+        except Exception as e:
+            print(f"Error summarizing thread {thread_id}: {e}")
+            return None
+
+        lines = []
+        for message in reversed(messages.data):
+            text = " ".join(part.text.value for part in message.content if part.type == "text")
+            text = " ".join(text.split())
+            if text:
+                lines.append(f"{message.role.capitalize()}: {text[:300]}")
+        return "\n".join(lines)
+
+    async def send(self, user_id, username, text, pending_intent=None):
+        """
+        Adds a user's message to their thread and runs the assistant on it.
+
+        Parameters:
+        pending_intent (dict): Payment awaiting confirmation, carried over if
+            the thread has to be rotated.
+
+        Returns:
+        str: The assistant's reply.
+
+        Raises:
+        AssistantRunError: If the run does not complete.
+        """
+        counter = [0]
+        token = _message_api_calls.set(counter)
+        self.stats["messages"] += 1
+        try:
+            thread_id = await self.get_thread_id(user_id, username, pending_intent)
+            await self.client.beta.threads.messages.create(thread_id=thread_id, role="user", content=text)
+            reply, run = await run_assistant(self.client, thread_id, self.assistant_id, return_run=True)
+
+            entry = await self.registry.get_async(user_id)
+            self.registry.update(
+                user_id,
+                messages=entry.get("messages", 0) + 2,
+                prompt_tokens=run.usage.prompt_tokens if run.usage else entry.get("prompt_tokens", 0),
+            )
+            return reply
+        finally:
+            _message_api_calls.reset(token)
+            print(f"Assistant reply took {counter[0]} API call(s)")
+
+    @property
+    def api_calls_per_message(self):
+        if not self.stats["messages"]:
+            return 0.0
+        return self.stats["api_calls"] / self.stats["messages"]
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+assistant_session = AssistantSession()
@@ -1,16 +1,195 @@
 from dotenv import load_dotenv
+import asyncio
+import subprocess
+import numpy as np
 import whisper
+from .backends import create_backend
+from .config import (
+    SILENCE_THRESHOLD_DB,
+    MIN_SILENCE_MS,
+    SPEECH_PAD_MS,
+    MAX_CHUNK_SECONDS,
+)
 
 
 # Load environment variables from the .env file
 load_dotenv()
 
+_backend = None
+
+def get_transcription_backend():
+    """
+    Returns the process-wide transcription backend, loading it on first use.
+    """
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+def decode_audio(data, sample_rate=whisper.audio.SAMPLE_RATE):
+    """
+    Decodes an in-memory audio file (e.g. an OGG/Opus voice note) to mono
+    float32 samples at the given rate.
+
+    The bytes are piped through ffmpeg's stdin and the PCM read back from its
+    stdout, the same decoding Whisper does for files but without touching disk.
+
+    Parameters:
+    data (bytes): The encoded audio file contents.
+    sample_rate (int): The output sample rate.
+
+    Returns:
+    numpy.ndarray: The decoded samples in [-1.0, 1.0].
+    """
+    try:
+        out = subprocess.run(_ffmpeg_decode_command(sample_rate), input=bytes(data),
+                             capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to decode audio: {e.stderr.decode()}") from e
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+async def decode_audio_async(data, sample_rate=whisper.audio.SAMPLE_RATE):
+    """
+    Same as decode_audio, but awaits the ffmpeg subprocess instead of
+    blocking the event loop.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *_ffmpeg_decode_command(sample_rate),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    out, err = await proc.communicate(bytes(data))
+    if proc.returncode != 0:
+        raise RuntimeError(f"Failed to decode audio: {err.decode()}")
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+def _ffmpeg_decode_command(sample_rate):
+    return [
+        "ffmpeg",
+        "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sample_rate),
+        "pipe:1",
+    ]
+
+def load_audio(audio):
+    """
+    Returns 16 kHz float samples for a file path, encoded bytes or an
+    already decoded array.
+    """
+    if isinstance(audio, str):
+        return whisper.load_audio(audio)
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return decode_audio(audio)
+    return audio
+
+def detect_speech(samples, sample_rate=whisper.audio.SAMPLE_RATE, threshold_db=SILENCE_THRESHOLD_DB,
+                  min_silence_ms=MIN_SILENCE_MS, pad_ms=SPEECH_PAD_MS, frame_ms=30, floor_db=-50.0):
+    """
+    Finds the speech regions of a clip using frame energy.
+
+    A frame counts as speech when its RMS level is within `threshold_db` of
+    the loudest frame, so quiet recordings are not trimmed away entirely,
+    and above the absolute `floor_db` level, so background hiss is not.
+    Pauses shorter than `min_silence_ms` are kept, and each region is padded
+    by `pad_ms` on both sides so word onsets are not clipped.
+
+    Returns:
+    list: (start, end) sample offsets of each speech region, in order.
+    """
+    frame = int(sample_rate * frame_ms / 1000)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return [(0, len(samples))] if len(samples) else []
+
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    level = 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+    voiced = (level > level.max() + threshold_db) & (level > floor_db)
+
+    # Edges of each voiced run, as frame indices
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_gap = max(1, int(min_silence_ms / frame_ms))
+    pad = int(pad_ms / frame_ms)
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    return [
+        (int(max(0, start - pad) * frame), int(min(len(samples), (end + pad) * frame)))
+        for start, end in regions
+    ]
+
+def preprocess_audio(samples, sample_rate=whisper.audio.SAMPLE_RATE, max_chunk_seconds=MAX_CHUNK_SECONDS):
+    """
+    Trims silence from a clip and splits long speech into chunks at pauses.
+
+    Consecutive speech regions are packed into chunks of at most
+    `max_chunk_seconds`, so each chunk fits one Whisper window and the chunks
+    can be transcribed in parallel. A single region longer than the limit
+    is cut at fixed points. If no speech is detected the clip is passed
+    through untouched.
+
+    Parameters:
+    samples (numpy.ndarray): 16 kHz float samples.
+
+    Returns:
+    dict: 'chunks' as a list of sample arrays in order, plus
+          'original_seconds', 'speech_seconds' and 'saved_seconds'.
+    """
+    original_seconds = len(samples) / sample_rate
+    regions = detect_speech(samples, sample_rate)
+    if not regions:
+        return {
+            "chunks": [samples],
+            "original_seconds": original_seconds,
+            "speech_seconds": original_seconds,
+            "saved_seconds": 0.0,
+        }
+
+    max_len = int(max_chunk_seconds * sample_rate)
+    chunks = []
+    current = []
+    current_len = 0
+    for start, end in regions:
+        segment = samples[start:end]
+        if current and current_len + len(segment) > max_len:
+            chunks.append(np.concatenate(current))
+            current, current_len = [], 0
+        while len(segment) > max_len:
+            chunks.append(segment[:max_len])
+            segment = segment[max_len:]
+        current.append(segment)
+        current_len += len(segment)
+    if current:
+        chunks.append(np.concatenate(current))
+
+    speech_seconds = sum(len(chunk) for chunk in chunks) / sample_rate
+    return {
+        "chunks": chunks,
+        "original_seconds": original_seconds,
+        "speech_seconds": speech_seconds,
+        "saved_seconds": original_seconds - speech_seconds,
+    }
+
 def convert_audio_to_text(audio_file_path):
     """
     Converts an audio file to text using OpenAI's Whisper API.
+
+    This runs inference on the calling thread. Async handlers should await
+    `transcription_service.transcribe` instead so the event loop stays free.
     
     Parameters:
-    audio_file_path (str): The path to the audio file.
+    audio_file_path (str | bytes): The path to the audio file, or its contents.
     
     Returns:
     str: The transcribed text from the audio file.
@@ -23,10 +202,12 @@ def convert_audio_to_text(audio_file_path):
 
     try:
         print("Processing audio...")
-        model = whisper.load_model("base.en")
-        result = model.transcribe(audio_file_path)
-        print("Transcription: " + result["text"])
-        return result["text"]
+        backend = get_transcription_backend()
+        prepared = preprocess_audio(load_audio(audio_file_path))
+        texts = [text.strip() for text in backend.transcribe_batch(prepared["chunks"])]
+        text = " ".join(text for text in texts if text)
+        print("Transcription: " + text)
+        return text
 
     except Exception as e:
         print(f"An error occurred during audio processing: {e}")
@@ -0,0 +1,155 @@
+from .config import WHISPER_MODEL, TRANSCRIPTION_BACKEND, TRANSCRIPTION_COMPUTE_TYPE
+
+
+class TranscriptionBackend:
+    """
+    Interface for speech-to-text engines.
+
+    Backends take 16 kHz mono float32 samples and return plain text. They are
+    created once per process (see TranscriptionService) and must be safe to
+    reuse across calls.
+    """
+
+    name = None
+
+    def __init__(self, model_size=WHISPER_MODEL, compute_type=TRANSCRIPTION_COMPUTE_TYPE):
+        self.model_size = model_size
+        self.compute_type = compute_type
+
+    def transcribe(self, samples):
+        raise NotImplementedError
+
+    def transcribe_batch(self, clips):
+        """
+        Transcribes several clips. Backends that can't batch fall back to one
+        call per clip.
+        """
+        return [self.transcribe(clip) for clip in clips]
+
+
+def quantize_linear_layers(model):
+    """
+    Applies int8 dynamic quantization to every linear layer of a model.
+
+    quantize_dynamic only swaps modules whose type is exactly nn.Linear, and
+    whisper's layers are its own nn.Linear subclass, so they are first
+    replaced by plain nn.Linear modules sharing the same weights.
+
+    Parameters:
+    model (torch.nn.Module): The fp32 model, on the CPU.
+
+    Returns:
+    torch.nn.Module: The quantized model.
+    """
+    import torch
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+                plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None, device="meta")
+                plain.weight = child.weight
+                if child.bias is not None:
+                    plain.bias = child.bias
+                setattr(parent, name, plain)
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class WhisperBackend(TranscriptionBackend):
+    """
+    openai-whisper on PyTorch. Runs in fp32, or with int8 dynamic
+    quantization of the linear layers when compute_type is 'int8'.
+    """
+
+    name = "whisper"
+
+    def __init__(self, model_size=WHISPER_MODEL, compute_type=TRANSCRIPTION_COMPUTE_TYPE):
+        super().__init__(model_size, compute_type)
+        import torch
+        import whisper
+
+        model = whisper.load_model(model_size, device="cpu" if compute_type == "int8" else None)
+        if compute_type == "int8":
+            model = quantize_linear_layers(model)
+        elif compute_type not in ("float32", "default"):
+            raise ValueError(f"Unsupported compute type for whisper backend: {compute_type}")
+        self.model = model
+
+    def transcribe(self, samples):
+        return self.model.transcribe(samples, fp16=False)["text"]
+
+    def transcribe_batch(self, clips):
+        """
+        Transcribes several clips with one batched encoder/decoder pass.
+
+        Clips that fit in a single 30 s Whisper window are padded to the same
+        length and decoded together; longer clips fall back to the regular
+        sliding-window transcription.
+        """
+        import torch
+        import whisper
+
+        texts = [None] * len(clips)
+        short = [i for i, clip in enumerate(clips) if len(clip) <= whisper.audio.N_SAMPLES]
+
+        if short:
+            mels = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(clips[i]), self.model.dims.n_mels)
+                for i in short
+            ]).to(self.model.device)
+            options = whisper.DecodingOptions(
+                language=None if self.model.is_multilingual else "en",
+                fp16=False,
+                without_timestamps=True,
+            )
+            results = whisper.decode(self.model, mels, options)
+            for i, result in zip(short, results):
+                texts[i] = result.text.strip()
+
+        for i, clip in enumerate(clips):
+            if texts[i] is None:
+                texts[i] = self.transcribe(clip)
+        return texts
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """
+    CTranslate2 engine from the optional faster-whisper package. Its int8
+    CPU kernels are usually several times faster than fp32 PyTorch.
+    """
+
+    name = "faster-whisper"
+
+    def __init__(self, model_size=WHISPER_MODEL, compute_type=TRANSCRIPTION_COMPUTE_TYPE):
+        super().__init__(model_size, "int8" if compute_type == "default" else compute_type)
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise RuntimeError("The faster-whisper backend requires `pip install faster-whisper`") from e
+        self.model = WhisperModel(model_size, device="cpu", compute_type=self.compute_type)
+
+    def transcribe(self, samples):
+        segments, _ = self.model.transcribe(samples, beam_size=1)
+        return "".join(segment.text for segment in segments)
+
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def create_backend(name=TRANSCRIPTION_BACKEND, model_size=WHISPER_MODEL, compute_type=TRANSCRIPTION_COMPUTE_TYPE):
+    """
+    Creates a transcription backend by name.
+
+    Parameters:
+    name (str): One of BACKENDS ('whisper', 'faster-whisper').
+    model_size (str): Model name such as 'tiny.en', 'base.en' or 'small'.
+    compute_type (str): 'default', 'float32' or 'int8'.
+
+    Returns:
+    TranscriptionBackend: The loaded backend.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](model_size, compute_type)
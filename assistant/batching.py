@@ -0,0 +1,131 @@
+import asyncio
+from .audio_processing import decode_audio_async, load_audio, preprocess_audio
+from .config import TRANSCRIPTION_BATCH_WINDOW_MS, TRANSCRIPTION_MAX_BATCH
+from .transcription import transcription_service
+
+
+class MicroBatcher:
+    """
+    Collects concurrent transcription requests into batches.
+
+    A batch is dispatched once `max_batch` clips are pending or `window_ms`
+    has passed since the first clip arrived, whichever comes first. Each
+    caller gets back only the text for its own clip.
+    """
+
+    def __init__(self, service=transcription_service, window_ms=TRANSCRIPTION_BATCH_WINDOW_MS,
+                 max_batch=TRANSCRIPTION_MAX_BATCH):
+        self.service = service
+        self.window = max(0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._pending = []
+        self._flush_handle = None
+        self._in_flight = set()
+        self.batches = 0
+        self.clips = 0
+
+    async def transcribe(self, audio):
+        """
+        Queues a clip for the next batch and waits for its text.
+
+        Returns:
+        str: The transcribed text.
+        None: If the transcription fails.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((audio, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        try:
+            print("Processing audio...")
+            text = await future
+            print("Transcription: " + text)
+            return text
+        except Exception as e:
+            print(f"An error occurred during audio processing: {e}")
+            return None
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _run_batch(self, batch):
+        self.batches += 1
+        self.clips += len(batch)
+        try:
+            texts = await self.service.submit_batch([audio for audio, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), text in zip(batch, texts):
+            if not future.done():
+                future.set_result(text)
+
+    @property
+    def average_batch_size(self):
+        return self.clips / self.batches if self.batches else 0.0
+
+
+transcription_batcher = MicroBatcher()
+
+
+# Running totals of audio seconds received and removed by silence trimming
+preprocessing_stats = {"clips": 0, "audio_seconds": 0.0, "saved_seconds": 0.0}
+
+
+async def transcribe_voice(audio, batcher=transcription_batcher):
+    """
+    Transcribes a voice note with silence trimming and chunking.
+
+    The clip is decoded, trimmed and split at pauses, and the chunks go
+    through the batcher concurrently so they share batched passes or run on
+    separate workers. The chunk texts are joined back in order.
+
+    Parameters:
+    audio (str | bytes | numpy.ndarray): A file path, the encoded file
+        contents, or 16 kHz float samples.
+
+    Returns:
+    str: The transcribed text.
+    None: If decoding or any chunk's transcription fails.
+    """
+    try:
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            samples = await decode_audio_async(audio)
+        else:
+            samples = await asyncio.get_running_loop().run_in_executor(None, load_audio, audio)
+    except Exception as e:
+        print(f"An error occurred during audio processing: {e}")
+        return None
+
+    # Silence detection is numpy work over the whole clip, kept off the event loop
+    prepared = await asyncio.to_thread(preprocess_audio, samples)
+    preprocessing_stats["clips"] += 1
+    preprocessing_stats["audio_seconds"] += prepared["original_seconds"]
+    preprocessing_stats["saved_seconds"] += prepared["saved_seconds"]
+    print(
+        f"Trimmed {prepared['saved_seconds']:.1f}s of silence "
+        f"({prepared['original_seconds']:.1f}s -> {prepared['speech_seconds']:.1f}s "
+        f"in {len(prepared['chunks'])} chunk(s))"
+    )
+
+    texts = await asyncio.gather(*(batcher.transcribe(chunk) for chunk in prepared["chunks"]))
+    if any(text is None for text in texts):
+        return None
+    return " ".join(text.strip() for text in texts if text.strip())
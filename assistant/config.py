@@ -0,0 +1,54 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Transcription
+# Backend is 'whisper' (openai-whisper) or 'faster-whisper'; compute type is
+# 'default', 'float32' or 'int8'. WHISPER_MODEL sets the model size.
+TRANSCRIPTION_BACKEND = os.getenv('TRANSCRIPTION_BACKEND', 'whisper')
+TRANSCRIPTION_COMPUTE_TYPE = os.getenv('TRANSCRIPTION_COMPUTE_TYPE', 'default')
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'base.en')
+TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', '2'))
+TRANSCRIPTION_BATCH_WINDOW_MS = int(os.getenv('TRANSCRIPTION_BATCH_WINDOW_MS', '50'))
+TRANSCRIPTION_MAX_BATCH = int(os.getenv('TRANSCRIPTION_MAX_BATCH', '8'))
+# Voice notes larger than this many bytes are spooled to disk instead of
+# memory. 0 keeps every voice note in memory.
+VOICE_DISK_FALLBACK_BYTES = int(os.getenv('VOICE_DISK_FALLBACK_BYTES', '0'))
+
+# Silence trimming and chunking
+SILENCE_THRESHOLD_DB = float(os.getenv('SILENCE_THRESHOLD_DB', '-35'))
+MIN_SILENCE_MS = int(os.getenv('MIN_SILENCE_MS', '300'))
+SPEECH_PAD_MS = int(os.getenv('SPEECH_PAD_MS', '150'))
+MAX_CHUNK_SECONDS = float(os.getenv('MAX_CHUNK_SECONDS', '25'))
+
+# Largest amount a single payment command may ask for, in XRP
+MAX_PAYMENT_XRP = float(os.getenv('MAX_PAYMENT_XRP', '1000000'))
+
+# Assistant runs
+ASSISTANT_STREAMING = os.getenv('ASSISTANT_STREAMING', 'true').lower() == 'true'
+RUN_TIMEOUT_SECONDS = float(os.getenv('RUN_TIMEOUT_SECONDS', '60'))
+RUN_POLL_INITIAL_MS = int(os.getenv('RUN_POLL_INITIAL_MS', '50'))
+RUN_POLL_MAX_MS = int(os.getenv('RUN_POLL_MAX_MS', '1000'))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv('OPENAI_KEEPALIVE_SECONDS', '60'))
+
+# Thread registry: 'json' (thread_id.json) or 'sqlite' for large user counts
+THREAD_REGISTRY_BACKEND = os.getenv('THREAD_REGISTRY_BACKEND', 'json')
+THREAD_REGISTRY_PATH = os.getenv(
+    'THREAD_REGISTRY_PATH', 'thread_registry.db' if THREAD_REGISTRY_BACKEND == 'sqlite' else 'thread_id.json'
+)
+THREAD_REGISTRY_FLUSH_SECONDS = float(os.getenv('THREAD_REGISTRY_FLUSH_SECONDS', '1'))
+# With THREAD_REGISTRY_BACKEND=mongo (or sqlite on a shared disk) several
+# server processes share one registry; entries are then re-read after this
+# many seconds so a thread rotated elsewhere is picked up. 0 caches forever.
+THREAD_REGISTRY_CACHE_SECONDS = float(os.getenv('THREAD_REGISTRY_CACHE_SECONDS', '0'))
+MONGO_URI = os.getenv('MONGO_URI')
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'user_wallets_db')
+
+# Thread rotation: start a fresh thread after this many messages or once a
+# run's prompt reaches this many tokens, seeded with the last few messages
+THREAD_MAX_MESSAGES = int(os.getenv('THREAD_MAX_MESSAGES', '40'))
+THREAD_MAX_TOKENS = int(os.getenv('THREAD_MAX_TOKENS', '8000'))
+THREAD_SUMMARY_MESSAGES = int(os.getenv('THREAD_SUMMARY_MESSAGES', '6'))
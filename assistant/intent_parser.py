@@ -0,0 +1,295 @@
+import re
+from decimal import Decimal, InvalidOperation
+from .config import MAX_PAYMENT_XRP
+
+# XRP amounts are whole drops, a millionth of an XRP
+XRP_DECIMALS = 6
+
+
+class InvalidAmountError(ValueError):
+    """Raised for a payment command whose amount can't be sent in XRP."""
+
+
+# Counts of messages tried against the local parser and how many it resolved
+intent_parser_stats = {"parsed": 0, "hits": 0}
+
+UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+    "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+TENS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+}
+SCALES = {"hundred": 100, "thousand": 1000}
+
+FILLERS = re.compile(
+    r"(?<![@\w])(?:please|pls|kindly|just|um+|uh+|hey|ok(?:ay)?|"
+    r"can you|could you|would you|will you|i want to|i wanna|i'd like to|i would like to|"
+    r"go ahead and|paypaladin)(?!\w)",
+    re.IGNORECASE,
+)
+
+AMOUNT = r"(?P<amount>\d+(?:\.\d+)?)"
+CURRENCY = r"(?P<currency>xrp|x r p)"
+RECIPIENT = r"(?P<recipient>@?[a-z][a-z0-9_]{0,31})"
+# Two or more handles, as left by normalize_command for "@a, @b and @c"
+RECIPIENT_LIST = r"(?P<recipients>@?[a-z][a-z0-9_]{0,31}(?: (?:and )?@?[a-z][a-z0-9_]{0,31})+)"
+
+PATTERNS = [
+    ("send", re.compile(rf"(?:send|pay|transfer|give) {AMOUNT} {CURRENCY} to {RECIPIENT}", re.IGNORECASE)),
+    ("send", re.compile(rf"(?:send|pay|transfer|give) {RECIPIENT} {AMOUNT} {CURRENCY}", re.IGNORECASE)),
+    ("request", re.compile(rf"(?:request|charge) {AMOUNT} {CURRENCY} from {RECIPIENT}", re.IGNORECASE)),
+    ("request", re.compile(rf"(?:request|charge) {RECIPIENT} {AMOUNT} {CURRENCY}", re.IGNORECASE)),
+    ("request", re.compile(rf"(?:request from|ask|ask for payment from) {RECIPIENT} (?:for )?{AMOUNT} {CURRENCY}", re.IGNORECASE)),
+]
+
+# Multi-recipient sends need an explicit "each", otherwise the amount could be a total to split
+BATCH_PATTERNS = [
+    ("send", re.compile(rf"(?:send|pay|transfer|give) {AMOUNT} {CURRENCY} each to {RECIPIENT_LIST}", re.IGNORECASE)),
+    ("send", re.compile(rf"(?:send|pay|transfer|give) {AMOUNT} {CURRENCY} to {RECIPIENT_LIST} each", re.IGNORECASE)),
+    ("send", re.compile(rf"(?:send|pay|transfer|give) {RECIPIENT_LIST} {AMOUNT} {CURRENCY} each", re.IGNORECASE)),
+]
+
+# Words that fit the recipient slot but are never a Telegram handle
+NOT_RECIPIENTS = {"me", "him", "her", "them", "us", "it", "my", "his", "their", "the", "someone", "everyone", "each", "and"}
+
+# Whole replies to a confirmation prompt; anything else is neither a yes nor a no
+CONFIRM_REPLIES = {
+    "yes", "y", "yeah", "yep", "yup", "sure", "ok", "okay", "correct", "confirm", "confirmed",
+    "go ahead", "do it", "send it", "yes correct", "yes that's correct", "that's correct", "that's right",
+}
+DECLINE_REPLIES = {"no", "n", "nope", "nah", "cancel", "stop", "wrong", "incorrect", "don't", "no cancel", "no that's wrong"}
+POLITE_WORDS = {"please", "pls", "thanks", "thank", "you", "paypaladin"}
+
+
+def _number_value(words):
+    """
+    Converts a run of number words to a number, or None if the run is not a
+    well-formed number ('twenty five', 'one hundred and fifty', 'two point five',
+    'one and a half').
+    """
+    total = current = 0
+    fraction = None
+    seen_number = False
+    # Kind of the previous number word since the last scale: 'unit' (1-9), 'teen' (10-19) or 'ten'
+    last = None
+    i = 0
+    while i < len(words):
+        word = words[i]
+        if fraction is not None:
+            if word not in UNITS or UNITS[word] > 9:
+                return None
+            fraction += str(UNITS[word])
+        elif word in UNITS:
+            kind = "unit" if UNITS[word] <= 9 else "teen"
+            # 'one two' or 'nineteen five' are not one number; only 'twenty five' combines
+            if last is not None and not (kind == "unit" and last == "ten"):
+                return None
+            current += UNITS[word]
+            last = kind
+            seen_number = True
+        elif word in TENS:
+            # 'nineteen ninety' or 'twenty thirty' are years or lists, not amounts
+            if last is not None:
+                return None
+            current += TENS[word]
+            last = "ten"
+            seen_number = True
+        elif word in SCALES:
+            if SCALES[word] == 100:
+                current = max(current, 1) * 100
+            else:
+                total += max(current, 1) * 1000
+                current = 0
+            last = None
+            seen_number = True
+        elif word == "point":
+            fraction = ""
+        elif word == "half":
+            current += 0.5
+            seen_number = True
+        elif word not in ("a", "and"):
+            return None
+        i += 1
+
+    if not seen_number or fraction == "":
+        return None
+    value = total + current
+    if fraction:
+        value = float(f"{int(value)}.{fraction}")
+    return value
+
+
+def _replace_number_words(text):
+    number_words = set(UNITS) | set(TENS) | set(SCALES) | {"point", "half"}
+    joiners = {"a", "and"}
+    tokens = text.replace("-", " ").split()
+    out = []
+    i = 0
+    while i < len(tokens):
+        j = i
+        while j < len(tokens):
+            word = tokens[j].lower()
+            if word in number_words:
+                j += 1
+                continue
+            # 'a' and 'and' only count inside a number: 'a hundred', 'one and a half'
+            k = j
+            while k < len(tokens) and tokens[k].lower() in joiners:
+                k += 1
+            if k == j or k == len(tokens) or tokens[k].lower() not in number_words:
+                break
+            if j == i and word != "a":
+                break
+            j = k
+        value = _number_value([token.lower() for token in tokens[i:j]]) if j > i else None
+        if value is None:
+            out.append(tokens[i])
+            i += 1
+        else:
+            out.append(f"{value:g}")
+            i = j
+    return " ".join(out)
+
+
+def normalize_command(text):
+    """
+    Strips fillers and punctuation and turns number words into digits, keeping
+    the case of handles since usernames are looked up as written.
+    """
+    text = FILLERS.sub(" ", text)
+    text = re.sub(r"(?<=\d),(?=\d{3})", "", text)
+    text = re.sub(r"(?<!\d)\.|\.(?!\d)|[^\w\s@.']", " ", text)
+    return _replace_number_words(" ".join(text.split()))
+
+
+def amount_error(amount):
+    """
+    Checks that an amount can be sent in XRP.
+
+    Parameters:
+    amount (int | float | str): The amount in XRP.
+
+    Returns:
+    str: Why the amount can't be sent, for showing to the user.
+    None: If the amount is fine.
+    """
+    try:
+        value = Decimal(str(amount))
+    except (InvalidOperation, ValueError):
+        return f"{amount} is not a valid amount of XRP."
+    if not value.is_finite() or value <= 0:
+        return "The amount must be more than 0 XRP."
+    if value.normalize().as_tuple().exponent < -XRP_DECIMALS:
+        return f"XRP amounts can have at most {XRP_DECIMALS} decimal places."
+    if value > Decimal(str(MAX_PAYMENT_XRP)):
+        return f"The amount can't be more than {MAX_PAYMENT_XRP:,.0f} XRP."
+    return None
+
+
+def _parse_amount(text):
+    error = amount_error(text)
+    if error:
+        # Still resolved locally: the user is told why without an assistant run
+        intent_parser_stats["hits"] += 1
+        raise InvalidAmountError(error)
+    amount = float(text)
+    return int(amount) if amount.is_integer() else amount
+
+
+def parse_payment_command(text):
+    """
+    Parses formulaic payment commands locally, without the assistant.
+
+    Recognises phrasings such as "send 5 XRP to @bob", "pay @bob five xrp",
+    "request twenty xrp from @alice" or "ask @alice for 20 XRP", and sends
+    to several people such as "send 5 XRP each to @a, @b and @c". Anything
+    else, including other currencies or extra clauses, is left for the
+    assistant.
+
+    Parameters:
+    text (str): The user's message or transcription.
+
+    Returns:
+    dict: The payment information in the same shape the assistant produces
+          ('action', 'amount', 'currency', 'recipient'). Sends to several
+          people have 'recipients', a list of handles, instead of 'recipient'.
+    None: If the message is not an unambiguous payment command.
+
+    Raises:
+    InvalidAmountError: If the message is a payment command but its amount
+        is zero, has more than 6 decimals or is implausibly large.
+    """
+    intent_parser_stats["parsed"] += 1
+    if not text:
+        return None
+
+    normalized = normalize_command(text)
+    for action, pattern in BATCH_PATTERNS:
+        match = pattern.fullmatch(normalized)
+        if not match:
+            continue
+        names = [name.lstrip("@") for name in match.group("recipients").split() if name.lower() != "and"]
+        if any(name.lower() in NOT_RECIPIENTS for name in names):
+            return None
+        amount = _parse_amount(match.group("amount"))
+
+        intent_parser_stats["hits"] += 1
+        return {
+            "action": action,
+            "amount": amount,
+            "currency": "XRP",
+            "recipients": [f"@{name}" for name in dict.fromkeys(names)],
+        }
+
+    for action, pattern in PATTERNS:
+        match = pattern.fullmatch(normalized)
+        if not match:
+            continue
+        recipient = match.group("recipient").lstrip("@")
+        if recipient.lower() in NOT_RECIPIENTS:
+            return None
+        amount = _parse_amount(match.group("amount"))
+
+        intent_parser_stats["hits"] += 1
+        return {
+            "action": action,
+            "amount": amount,
+            "currency": "XRP",
+            "recipient": f"@{recipient}",
+        }
+    return None
+
+
+def parse_confirmation(text):
+    """
+    Reads the user's answer to a payment confirmation prompt.
+
+    Parameters:
+    text (str): The user's message or transcription.
+
+    Returns:
+    bool: True for a yes ("Yes", "yes please", "ok"), False for a no ("No", "cancel").
+    None: If the message is neither, e.g. a new or corrected command.
+    """
+    if not text:
+        return None
+    words = re.sub(r"[^\w\s']", " ", text.lower().replace("’", "'")).split()
+    reply = " ".join(word for word in words if word not in POLITE_WORDS)
+    if reply in CONFIRM_REPLIES:
+        return True
+    if reply in DECLINE_REPLIES:
+        return False
+    return None
+
+
+def get_hit_rate():
+    """
+    Returns the share of messages resolved by the local parser.
+    """
+    if not intent_parser_stats["parsed"]:
+        return 0.0
+    return intent_parser_stats["hits"] / intent_parser_stats["parsed"]
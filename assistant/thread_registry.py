@@ -0,0 +1,293 @@
+import asyncio
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from .config import (
+    THREAD_REGISTRY_BACKEND,
+    THREAD_REGISTRY_PATH,
+    THREAD_REGISTRY_FLUSH_SECONDS,
+    THREAD_REGISTRY_CACHE_SECONDS,
+    MONGO_URI,
+    MONGO_DB_NAME,
+)
+
+
+class ThreadRegistry:
+    """
+    Maps Telegram user ids to their assistant thread.
+
+    Lookups are served from memory. Changes are marked dirty and written
+    behind in one batch, at most every `flush_interval` seconds, instead of
+    rewriting the store on every message. When the store is shared between
+    processes, `cache_ttl` makes clean entries be re-read after that many
+    seconds. A failed flush keeps its changes and is retried with a
+    backoff of up to `max_retry_delay` seconds. Subclasses implement
+    `_load_entry` and `_write`.
+    """
+
+    max_retry_delay = 60
+
+    def __init__(self, flush_interval=THREAD_REGISTRY_FLUSH_SECONDS, cache_ttl=THREAD_REGISTRY_CACHE_SECONDS):
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self._entries = {}
+        self._loaded_at = {}
+        self._dirty = set()
+        self._flush_handle = None
+        self._retry_delay = 0
+        self._write_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def get(self, user_id):
+        """
+        Returns the registry entry ('thread_id', 'username', ...) for a user,
+        or None if the user has no thread yet.
+        """
+        key = str(user_id)
+        entry = self._entries.get(key)
+        if entry is None or self._stale(key):
+            entry = self._loaded(key, self._load_entry(key))
+        return entry
+
+    async def get_async(self, user_id):
+        """
+        Like `get`, but a read from the store runs on a worker thread, so a
+        cache miss doesn't block every other user on the event loop.
+        """
+        key = str(user_id)
+        entry = self._entries.get(key)
+        if entry is None or self._stale(key):
+            entry = self._loaded(key, await asyncio.to_thread(self._load_entry, key))
+        return entry
+
+    def _loaded(self, key, loaded):
+        if key in self._dirty:
+            # Changed locally while the read was in flight; the local entry is newer
+            return self._entries.get(key)
+        self._loaded_at[key] = time.monotonic()
+        if loaded is not None:
+            self._entries[key] = loaded
+        return self._entries.get(key)
+
+    def _stale(self, key):
+        # Unflushed local changes are newer than the store
+        return (
+            self.cache_ttl > 0
+            and key not in self._dirty
+            and time.monotonic() - self._loaded_at.get(key, 0) > self.cache_ttl
+        )
+
+    def set(self, user_id, thread_id, username, **metadata):
+        """
+        Records a user's thread and schedules a write-behind flush.
+        """
+        key = str(user_id)
+        entry = dict(self._entries.get(key) or {})
+        entry.update(metadata, thread_id=thread_id, username=username)
+        self._entries[key] = entry
+        self._loaded_at[key] = time.monotonic()
+        self._dirty.add(key)
+        self._schedule_flush()
+
+    def update(self, user_id, **metadata):
+        """
+        Updates metadata on an existing entry and schedules a flush. Only
+        entries already in memory are updated, so this never blocks on the
+        store.
+        """
+        entry = self._entries.get(str(user_id))
+        if entry is None:
+            return
+        entry.update(metadata)
+        self._dirty.add(str(user_id))
+        self._schedule_flush()
+
+    def _schedule_flush(self, delay=None):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on an event loop, so there is nothing to batch behind
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(
+            self.flush_interval if delay is None else delay, lambda: asyncio.ensure_future(self.flush_async())
+        )
+
+    def _take_dirty(self):
+        self._flush_handle = None
+        dirty, self._dirty = self._dirty, set()
+        return {key: dict(self._entries[key]) for key in dirty}
+
+    async def flush_async(self):
+        """
+        Writes pending changes on a worker thread so the event loop isn't
+        blocked by disk I/O.
+        """
+        changes = self._take_dirty()
+        if not changes:
+            return
+        if await asyncio.to_thread(self._locked_write, changes):
+            self._retry_delay = 0
+        else:
+            # Retried on its own, backing off so a store that is down isn't hit every interval
+            self._retry_delay = min(max(self._retry_delay * 2, self.flush_interval, 1), self.max_retry_delay)
+            self._schedule_flush(self._retry_delay)
+
+    def flush(self):
+        """
+        Writes pending changes synchronously.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        changes = self._take_dirty()
+        if changes:
+            self._locked_write(changes)
+
+    def _locked_write(self, changes):
+        """
+        Returns whether the changes were written.
+        """
+        with self._write_lock:
+            try:
+                self._write(changes)
+                return True
+            except Exception as e:
+                print(f"Error while saving thread registry: {e}")
+                # Keep the changes so the next flush retries them
+                for key in changes:
+                    self._dirty.add(key)
+                return False
+
+    def _load_entry(self, key):
+        raise NotImplementedError
+
+    def _write(self, changes):
+        raise NotImplementedError
+
+
+class JsonThreadRegistry(ThreadRegistry):
+    """
+    Registry persisted to a JSON file, loaded once at startup. Flushes write
+    the whole file to a temporary path and rename it over the original, so a
+    crash mid-write never leaves a truncated file.
+    """
+
+    def __init__(self, path=THREAD_REGISTRY_PATH, flush_interval=THREAD_REGISTRY_FLUSH_SECONDS,
+                 cache_ttl=THREAD_REGISTRY_CACHE_SECONDS):
+        super().__init__(flush_interval, cache_ttl)
+        self.path = path
+        # Top-level keys that aren't user entries are kept as they are
+        self._extra = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                data = json.load(file)
+            for key, value in data.items():
+                if isinstance(value, dict):
+                    self._entries[key] = value
+                else:
+                    self._extra[key] = value
+
+    def _load_entry(self, key):
+        return None
+
+    def _write(self, changes):
+        data = dict(self._extra)
+        data.update({key: dict(entry) for key, entry in list(self._entries.items())})
+        data.update(changes)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class SQLiteThreadRegistry(ThreadRegistry):
+    """
+    Registry persisted to SQLite for large user counts. Entries are loaded
+    lazily by primary key rather than all at startup, and each flush upserts
+    only the changed rows in a single transaction.
+    """
+
+    def __init__(self, path=THREAD_REGISTRY_PATH, flush_interval=THREAD_REGISTRY_FLUSH_SECONDS,
+                 cache_ttl=THREAD_REGISTRY_CACHE_SECONDS):
+        super().__init__(flush_interval, cache_ttl)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            "user_id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, username TEXT, metadata TEXT)"
+        )
+        self._conn.commit()
+
+    def _load_entry(self, key):
+        with self._write_lock:
+            row = self._conn.execute(
+                "SELECT thread_id, username, metadata FROM threads WHERE user_id = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = json.loads(row[2]) if row[2] else {}
+        entry.update(thread_id=row[0], username=row[1])
+        return entry
+
+    def _write(self, changes):
+        rows = []
+        for key, entry in changes.items():
+            metadata = {k: v for k, v in entry.items() if k not in ("thread_id", "username")}
+            rows.append((key, entry["thread_id"], entry.get("username"), json.dumps(metadata)))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO threads (user_id, thread_id, username, metadata) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET thread_id = excluded.thread_id, "
+                "username = excluded.username, metadata = excluded.metadata",
+                rows,
+            )
+
+
+class MongoThreadRegistry(ThreadRegistry):
+    """
+    Registry in a `threads` collection of the wallet database, shared by
+    server processes on several machines. Uses the synchronous driver like
+    the other backends: lookups on a cache miss are single primary-key
+    reads, run on a worker thread through `get_async`, and flushes run on a
+    worker thread as one bulk write.
+    """
+
+    def __init__(self, uri=MONGO_URI, database=MONGO_DB_NAME, flush_interval=THREAD_REGISTRY_FLUSH_SECONDS,
+                 cache_ttl=THREAD_REGISTRY_CACHE_SECONDS):
+        super().__init__(flush_interval, cache_ttl)
+        from pymongo import MongoClient
+        self._collection = MongoClient(uri, serverSelectionTimeoutMS=5000)[database]["threads"]
+
+    def _load_entry(self, key):
+        record = self._collection.find_one({"_id": key})
+        if record is None:
+            return None
+        record.pop("_id")
+        return record
+
+    def _write(self, changes):
+        from pymongo import ReplaceOne
+        self._collection.bulk_write(
+            [ReplaceOne({"_id": key}, entry, upsert=True) for key, entry in changes.items()], ordered=False
+        )
+
+
+def create_thread_registry(backend=THREAD_REGISTRY_BACKEND, path=THREAD_REGISTRY_PATH):
+    if backend == "sqlite":
+        return SQLiteThreadRegistry(path)
+    if backend == "json":
+        return JsonThreadRegistry(path)
+    if backend == "mongo":
+        return MongoThreadRegistry()
+    raise ValueError(f"Unknown thread registry backend '{backend}', expected 'json', 'sqlite' or 'mongo'")
+
+
+thread_registry = create_thread_registry()
@@ -0,0 +1,119 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .audio_processing import load_audio
+from .backends import create_backend
+from .config import WHISPER_MODEL, TRANSCRIPTION_WORKERS, TRANSCRIPTION_BACKEND, TRANSCRIPTION_COMPUTE_TYPE
+
+# Backend held by each worker process, loaded once by the pool initializer
+_worker_backend = None
+
+
+def _load_worker_backend(backend_name, model_size, compute_type):
+    global _worker_backend
+    _worker_backend = create_backend(backend_name, model_size, compute_type)
+
+
+def _warm_up_worker():
+    return _worker_backend is not None
+
+
+def _transcribe_in_worker(audio):
+    return _worker_backend.transcribe(load_audio(audio))
+
+
+def _transcribe_batch_in_worker(audios):
+    return _worker_backend.transcribe_batch([load_audio(audio) for audio in audios])
+
+
+class TranscriptionService:
+    """
+    Long-lived transcription service backed by a pool of worker processes.
+
+    Each worker loads the configured backend once when it starts and then serves
+    transcription jobs from the pool's queue, so CPU-bound inference runs
+    off the asyncio event loop and no message pays for loading the model.
+    """
+
+    def __init__(self, model_name=WHISPER_MODEL, workers=TRANSCRIPTION_WORKERS,
+                 backend=TRANSCRIPTION_BACKEND, compute_type=TRANSCRIPTION_COMPUTE_TYPE):
+        self.model_name = model_name
+        self.backend = backend
+        self.compute_type = compute_type
+        self.workers = max(1, workers)
+        self._executor = None
+
+    def start(self, warm_up=True):
+        """
+        Starts the worker pool. With warm_up, blocks until every worker has
+        loaded its model so the first voice note does not pay for it.
+        """
+        if self._executor is not None:
+            return
+        # Spawn rather than fork so workers don't inherit the parent's threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_worker_backend,
+            initargs=(self.backend, self.model_name, self.compute_type),
+        )
+        if warm_up:
+            futures = [self._executor.submit(_warm_up_worker) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+        print(
+            f"Transcription service started with {self.workers} worker(s) using "
+            f"{self.backend} '{self.model_name}' ({self.compute_type})"
+        )
+
+    def submit(self, audio):
+        """
+        Queues a transcription job and returns an asyncio future for its text.
+
+        Parameters:
+        audio (str | bytes | numpy.ndarray): A file path, the encoded file
+            contents, or 16 kHz float samples. Encoded bytes are decoded in
+            the worker process.
+
+        Returns:
+        asyncio.Future: Resolves to the transcribed text.
+        """
+        if self._executor is None:
+            self.start(warm_up=False)
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, _transcribe_in_worker, audio)
+
+    def submit_batch(self, audios):
+        """
+        Queues a batch of clips as a single job and returns an asyncio future
+        for the list of texts, in the same order as the clips.
+        """
+        if self._executor is None:
+            self.start(warm_up=False)
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, _transcribe_batch_in_worker, list(audios))
+
+    async def transcribe(self, audio):
+        """
+        Transcribes an audio clip on the worker pool.
+
+        Returns:
+        str: The transcribed text.
+        None: If the transcription fails.
+        """
+        try:
+            print("Processing audio...")
+            text = await self.submit(audio)
+            print("Transcription: " + text)
+            return text
+        except Exception as e:
+            print(f"An error occurred during audio processing: {e}")
+            return None
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+transcription_service = TranscriptionService()
@@ -0,0 +1,463 @@
+"""
+In-process stand-ins for the services the bot talks to, for benchmarks.
+
+The Telegram Bot API, OpenAI assistants API and rippled JSON-RPC fakes are
+small HTTP servers on background threads, so the bot's own HTTP clients,
+connection pools and retries run as they do in production. Each speaks
+just enough of its API for the message pipeline and adds a configurable
+latency to every request. The wallet store wraps the in-memory database
+(MONGO_URI=memory://) and the transcription service replaces the Whisper
+worker pool with a fixed delay.
+
+Nothing here imports the bot at module level, so the environment can be
+pointed at the fakes before bot.config is read.
+"""
+import asyncio
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import wave
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeService:
+    """
+    HTTP server on a background thread that delays each request by
+    `latency` seconds, +/- `jitter` as a fraction of it, before answering
+    through `handle`. Requests are counted per route in `calls`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self._server = None
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so client connection pools behave as against the real service
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                service._dispatch(self, "GET")
+
+            def do_POST(self):
+                service._dispatch(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def delay(self, seconds=None):
+        seconds = self.latency if seconds is None else seconds
+        if seconds > 0:
+            time.sleep(seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _dispatch(self, request, method):
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        self.delay()
+        try:
+            status, content_type, payload = self.handle(method, urlsplit(request.path), request.headers, body)
+        except Exception as e:
+            status, content_type, payload = 500, "application/json", json.dumps({"error": str(e)}).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def handle(self, method, url, headers, body):
+        """
+        Returns:
+        tuple: (status, content type, response body bytes).
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def json_response(data, status=200):
+        return status, "application/json", json.dumps(data).encode()
+
+
+def voice_clip(seconds=2.0, sample_rate=16000):
+    """
+    Returns a WAV clip of a tone between short silences, which decodes and
+    survives silence trimming like a real voice note.
+    """
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        speaking = 0.3 <= t < seconds - 0.3
+        value = int(12000 * math.sin(2 * math.pi * 220 * t)) if speaking else 0
+        frames += value.to_bytes(2, "little", signed=True)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as clip:
+        clip.setnchannels(1)
+        clip.setsampwidth(2)
+        clip.setframerate(sample_rate)
+        clip.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+class FakeTelegram(FakeService):
+    """
+    Bot API with getMe, sendMessage and getFile, plus file downloads, which
+    all return `clip`. Every sendMessage is passed to `on_message(chat_id,
+    text)`. Point TELEGRAM_API_URL at `api_url` and TELEGRAM_FILE_URL at
+    `file_url`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, clip=None, on_message=None):
+        super().__init__(latency, jitter)
+        self.clip = clip if clip is not None else voice_clip()
+        self.on_message = on_message
+        self._message_ids = itertools.count(1)
+
+    @property
+    def api_url(self):
+        return f"{self.url}/bot"
+
+    @property
+    def file_url(self):
+        return f"{self.url}/file/bot"
+
+    def handle(self, method, url, headers, body):
+        if url.path.startswith("/file/"):
+            self.calls["download"] += 1
+            return 200, "application/octet-stream", self.clip
+
+        api_method = url.path.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = self._parameters(headers, body)
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "PayPaladin", "username": "paypaladin_bench_bot"}
+        elif api_method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+            if self.on_message is not None:
+                self.on_message(chat_id, result["text"])
+        elif api_method == "getFile":
+            file_id = params.get("file_id", "voice")
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self.clip),
+                "file_path": f"voice/{file_id}.wav",
+            }
+        else:
+            result = True
+        return self.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _parameters(headers, body):
+        if not body:
+            return {}
+        if headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body)
+        # python-telegram-bot sends form fields, JSON-encoding the non-string ones
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+class FakeOpenAI(FakeService):
+    """
+    Assistants API (threads, messages, runs, streamed or polled) whose runs
+    take `run_seconds` and reply with fixed text. Point OPENAI_BASE_URL at
+    `base_url`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, run_seconds=1.0, prompt_tokens=400):
+        super().__init__(latency, jitter)
+        self.run_seconds = run_seconds
+        self.prompt_tokens = prompt_tokens
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # thread id -> messages, oldest first
+        self._threads = {}
+        self._runs = {}
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def _id(self, prefix):
+        return f"{prefix}_{next(self._ids):08d}"
+
+    def _message(self, thread_id, role, text, run_id=None):
+        return {
+            "id": self._id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "assistant_id": None,
+            "run_id": run_id,
+            "attachments": [],
+            "metadata": {},
+            "status": "completed",
+        }
+
+    def _run(self, run, status):
+        usage = None
+        if status == "completed":
+            usage = {"prompt_tokens": self.prompt_tokens, "completion_tokens": 20, "total_tokens": self.prompt_tokens + 20}
+        return dict(run, status=status, usage=usage)
+
+    @staticmethod
+    def reply_to(text):
+        if text.strip().lower() in ("yes", "y", "yeah", "correct"):
+            return "Great, I'll send it now."
+        return "I can help you send or request XRP. Who would you like to pay?"
+
+    def handle(self, method, url, headers, body):
+        parts = url.path.strip("/").split("/")[1:]
+        params = json.loads(body) if body else {}
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        route = "/".join(part if i % 2 == 0 else "{id}" for i, part in enumerate(parts))
+        self.calls[f"{method} {route}"] += 1
+
+        with self._lock:
+            if parts == ["threads"]:
+                thread_id = self._id("thread")
+                self._threads[thread_id] = [
+                    self._message(thread_id, m["role"], m["content"]) for m in params.get("messages", [])
+                ]
+                return self.json_response({"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+            thread_id = parts[1]
+            messages = self._threads.setdefault(thread_id, [])
+            if parts[2:] == ["messages"] and method == "POST":
+                message = self._message(thread_id, params.get("role", "user"), params.get("content", ""))
+                messages.append(message)
+                return self.json_response(message)
+
+            if parts[2:] == ["messages"]:
+                data = [m for m in messages if "run_id" not in query or m["run_id"] == query["run_id"]]
+                if query.get("order", "desc") == "desc":
+                    data = data[::-1]
+                data = data[:int(query.get("limit", 20))]
+                return self.json_response({
+                    "object": "list", "data": data, "has_more": False,
+                    "first_id": data[0]["id"] if data else None, "last_id": data[-1]["id"] if data else None,
+                })
+
+            if parts[2:] == ["runs"]:
+                last_user = next((m for m in reversed(messages) if m["role"] == "user"), None)
+                text = last_user["content"][0]["text"]["value"] if last_user else ""
+                run = {
+                    "id": self._id("run"), "object": "thread.run", "created_at": int(time.time()),
+                    "thread_id": thread_id, "assistant_id": params.get("assistant_id"),
+                    "last_error": None, "instructions": "", "model": "fake", "tools": [],
+                }
+                messages.append(self._message(thread_id, "assistant", self.reply_to(text), run["id"]))
+                self._runs[run["id"]] = (run, time.monotonic() + self.run_seconds)
+                if not params.get("stream"):
+                    return self.json_response(self._run(run, "queued"))
+
+            elif len(parts) >= 4 and parts[2] == "runs":
+                run, done_at = self._runs[parts[3]]
+                if parts[4:] == ["cancel"]:
+                    self._runs[parts[3]] = (dict(run, cancelled=True), done_at)
+                    return self.json_response(self._run(run, "cancelling"))
+                status = "cancelled" if run.get("cancelled") else "completed" if time.monotonic() >= done_at else "in_progress"
+                return self.json_response(self._run(run, status))
+            else:
+                return self.json_response({"error": {"message": f"Unknown route {url.path}"}}, 404)
+
+        # Streamed run: the events arrive once the run has finished
+        self.delay(self.run_seconds)
+        events = [
+            ("thread.run.created", self._run(run, "queued")),
+            ("thread.run.in_progress", self._run(run, "in_progress")),
+            ("thread.run.completed", self._run(run, "completed")),
+        ]
+        stream = "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events)
+        stream += "event: done\ndata: [DONE]\n\n"
+        return 200, "text/event-stream", stream.encode()
+
+
+class FakeRippled(FakeService):
+    """
+    rippled JSON-RPC with account_info, fee, ledger, submit and tx. A ledger
+    closes every `ledger_seconds`, and every submitted transaction succeeds
+    in the first ledger that closes after it. Point JSON_RPC_URL at `url`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, ledger_seconds=3.5, first_ledger=1000):
+        super().__init__(latency, jitter)
+        self.ledger_seconds = ledger_seconds
+        self.first_ledger = first_ledger
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        # tx hash -> ledger it is validated in
+        self._transactions = {}
+
+    @property
+    def validated_ledger(self):
+        return self.first_ledger + int((time.monotonic() - self._started) / self.ledger_seconds)
+
+    def handle(self, method, url, headers, body):
+        request = json.loads(body)
+        rpc_method = request["method"]
+        params = (request.get("params") or [{}])[0]
+        self.calls[rpc_method] += 1
+        validated = self.validated_ledger
+
+        if rpc_method == "account_info":
+            result = {
+                "account_data": {"Account": params["account"], "Balance": "1000000000", "Sequence": 1},
+                "ledger_current_index": validated + 1,
+            }
+        elif rpc_method == "fee":
+            result = {
+                "current_queue_size": "0",
+                "max_queue_size": "2000",
+                "drops": {"base_fee": "10", "median_fee": "5000", "minimum_fee": "10", "open_ledger_fee": "10"},
+                "ledger_current_index": validated + 1,
+            }
+        elif rpc_method == "account_objects":
+            # Tickets aren't modelled; batches create the ones they need
+            result = {"account": params["account"], "account_objects": [], "ledger_index": validated, "validated": True}
+        elif rpc_method == "ledger":
+            result = {"ledger_index": validated, "ledger_hash": f"{validated:064X}", "validated": True}
+        elif rpc_method == "submit":
+            # Same hash xrpl-py computes locally: SHA-512Half of the 'TXN\0' prefix and the blob
+            tx_hash = hashlib.sha512(bytes.fromhex("54584E00" + params["tx_blob"])).hexdigest()[:64].upper()
+            with self._lock:
+                self._transactions[tx_hash] = validated + 1
+            result = {
+                "engine_result": "tesSUCCESS",
+                "engine_result_code": 0,
+                "engine_result_message": "The transaction was applied. Only final in a validated ledger.",
+                "tx_blob": params["tx_blob"],
+                "tx_json": {"hash": tx_hash},
+                "accepted": True,
+            }
+        elif rpc_method == "tx":
+            with self._lock:
+                ledger_index = self._transactions.get(params["transaction"])
+            if ledger_index is None:
+                return self.json_response({"result": {"error": "txnNotFound", "status": "error", "request": params}})
+            result = {"hash": params["transaction"], "validated": ledger_index <= validated}
+            if result["validated"]:
+                result.update(ledger_index=ledger_index, meta={"TransactionResult": "tesSUCCESS"})
+        else:
+            return self.json_response({"result": {"error": "unknownCmd", "status": "error", "request": params}})
+
+        result["status"] = "success"
+        return self.json_response({"result": result})
+
+
+class FakeWalletStore:
+    """
+    The in-memory wallet database with `latency` seconds added to every
+    awaited collection operation, standing in for a MongoDB round-trip.
+    Assign it to the repository's database before the first query.
+    """
+
+    def __init__(self, latency=0.0):
+        from bot.memory_store import InMemoryDatabase
+
+        self.latency = latency
+        self.database = InMemoryDatabase()
+        self.calls = Counter()
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = _LatentCollection(self, self.database[name])
+        return self._collections[name]
+
+
+class _LatentCollection:
+    def __init__(self, store, collection):
+        self._store = store
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+        store = self._store
+
+        async def call(*args, **kwargs):
+            store.calls[name] += 1
+            if store.latency > 0:
+                await asyncio.sleep(store.latency)
+            return await attribute(*args, **kwargs)
+        return call
+
+
+class FakeTranscriptionService:
+    """
+    Drop-in for TranscriptionService that spends `latency` seconds per job
+    on one of `workers` threads and returns `text` for every clip.
+    """
+
+    def __init__(self, latency=0.5, workers=2, text="what can you do"):
+        self.latency = latency
+        self.workers = workers
+        self.text = text
+        self._executor = None
+        self.jobs = 0
+
+    def start(self, warm_up=True):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fake-transcription")
+
+    def _job(self, count):
+        self.jobs += 1
+        time.sleep(self.latency)
+        return [self.text] * count
+
+    def submit(self, audio):
+        self.start()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._job, 1)
+        return asyncio.ensure_future(self._first(future))
+
+    @staticmethod
+    async def _first(future):
+        return (await future)[0]
+
+    def submit_batch(self, audios):
+        self.start()
+        return asyncio.get_running_loop().run_in_executor(self._executor, self._job, len(audios))
+
+    async def transcribe(self, audio):
+        return await self.submit(audio)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
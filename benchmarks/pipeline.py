@@ -0,0 +1,339 @@
+"""
+End-to-end load benchmark of the webhook message pipeline.
+
+Runs server.py against the in-process fakes in fakes.py (Telegram Bot API,
+OpenAI assistants API, wallet store, rippled JSON-RPC), replays a mix of
+text, voice and payment updates through POST /webhook with Poisson
+arrivals, and reports throughput and p50/p95/p99 latency per stage:
+
+    ack         webhook POST until its HTTP response
+    queue       webhook POST until the update's handler starts
+    handler     processing of the update, replies included
+    transcribe  voice note transcription (ffmpeg decode, trimming, fake model)
+    assistant   assistant round-trip (thread, message, run, reply)
+    payment     payment submission until it validates
+    reply       webhook POST until the bot's first message to that chat
+
+A payment is two updates from the same user: a "send 1 xrp to @payee"
+command, answered with a confirmation prompt, and a "yes". Voice notes
+are decoded with ffmpeg as in production; only the model is faked.
+
+Usage:
+    python -m benchmarks.pipeline --rate 20 --updates 500 --mix text=0.5,voice=0.2,payment=0.3 \
+        --telegram-ms 40 --openai-ms 150 --run-ms 1200 --rippled-ms 30 --store-ms 2
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .fakes import FakeTelegram, FakeOpenAI, FakeRippled, FakeWalletStore, FakeTranscriptionService
+from .stats import percentile, print_table
+
+STAGES = ["ack", "queue", "handler", "transcribe", "assistant", "payment", "reply"]
+FIRST_USER_ID = 10000
+FIRST_PAYEE_ID = 90000
+
+
+class StageTimer:
+    """
+    Collects per-stage durations from the load generator, the fakes and
+    wrapped server functions, which run on different threads.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage, func):
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+    def rows(self):
+        rows = []
+        for stage in STAGES:
+            samples = self.samples.get(stage)
+            if not samples:
+                continue
+            rows.append([stage, len(samples)] + [
+                f"{percentile(samples, pct) * 1000:.1f}" for pct in (50, 95, 99)
+            ] + [f"{max(samples) * 1000:.1f}"])
+        return rows
+
+
+class LoadGenerator:
+    """
+    Posts updates to the webhook over keep-alive connections and matches
+    each update to the next bot message sent to its chat.
+    """
+
+    def __init__(self, port, timer, connections):
+        self.port = port
+        self.timer = timer
+        self.posted_at = {}
+        self.rejected = 0
+        self.accepted = 0
+        self._update_ids = itertools.count(1)
+        self._awaiting_reply = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="load")
+
+    def _connection(self):
+        if not hasattr(self._local, "connection"):
+            self._local.connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        return self._local.connection
+
+    def on_message(self, chat_id, text):
+        now = time.perf_counter()
+        with self._lock:
+            pending = self._awaiting_reply.get(chat_id)
+            posted = pending.popleft() if pending else None
+        if posted is not None:
+            self.timer.record("reply", now - posted)
+
+    def message_update(self, user, text=None, voice=None):
+        update_id = next(self._update_ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private", "username": user["username"]},
+            "from": {"id": user["id"], "is_bot": False, "first_name": user["username"], "username": user["username"]},
+        }
+        if text is not None:
+            message["text"] = text
+        if voice is not None:
+            message["voice"] = {
+                "file_id": f"voice-{update_id}", "file_unique_id": f"voice-{update_id}",
+                "duration": 2, "mime_type": "audio/ogg", "file_size": voice,
+            }
+        return {"update_id": update_id, "message": message}
+
+    def _post(self, payload):
+        body = json.dumps(payload).encode()
+        chat_id = payload["message"]["chat"]["id"]
+        posted = time.perf_counter()
+        with self._lock:
+            self.posted_at[payload["update_id"]] = posted
+            self._awaiting_reply[chat_id].append(posted)
+
+        connection = self._connection()
+        connection.request("POST", "/webhook", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        self.timer.record("ack", time.perf_counter() - posted)
+
+        with self._lock:
+            if response.status == 200:
+                self.accepted += 1
+            else:
+                # Telegram would redeliver later; the benchmark only counts it
+                self.rejected += 1
+                self._awaiting_reply[chat_id].remove(posted)
+
+    def _post_all(self, payloads):
+        for payload in payloads:
+            self._post(payload)
+
+    def submit(self, payloads):
+        """
+        Posts a job's updates in order on one connection.
+        """
+        return self._pool.submit(self._post_all, payloads)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        kind, share = part.split("=")
+        if kind not in ("text", "voice", "payment"):
+            raise argparse.ArgumentTypeError(f"Unknown traffic kind '{kind}', expected text, voice or payment")
+        mix[kind] = float(share)
+    return mix
+
+
+def configure_environment(telegram, openai, rippled, workdir):
+    """
+    Points the bot at the fakes. Must run before server or bot is imported,
+    since their configuration is read at import time. Settings that don't
+    name an endpoint keep any value already in the environment.
+    """
+    os.environ.update({
+        "TELEGRAM_API_URL": telegram.api_url,
+        "TELEGRAM_FILE_URL": telegram.file_url,
+        "OPENAI_BASE_URL": openai.base_url,
+        "JSON_RPC_URL": f"{rippled.url}/",
+        "XRPL_WS_URL": "",
+        "MONGO_URI": "memory://",
+        "WALLET_POOL_SIZE": "0",
+    })
+    defaults = {
+        "TELEGRAM_BOT_TOKEN": "123456:benchmark",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "ASSISTANT_ID": "asst_benchmark",
+        "SESSION_STORE_BACKEND": "memory",
+        "UPDATE_DEDUP_BACKEND": "memory",
+        "THREAD_REGISTRY_BACKEND": "json",
+        "THREAD_REGISTRY_PATH": os.path.join(workdir, "threads.json"),
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def run(args):
+    timer = StageTimer()
+    generator = None
+    telegram = FakeTelegram(args.telegram_ms / 1000, args.jitter, on_message=lambda *a: generator.on_message(*a)).start()
+    openai = FakeOpenAI(args.openai_ms / 1000, args.jitter, run_seconds=args.run_ms / 1000).start()
+    rippled = FakeRippled(args.rippled_ms / 1000, args.jitter, ledger_seconds=args.ledger_seconds).start()
+    workdir = tempfile.mkdtemp(prefix="paypaladin-bench-")
+    configure_environment(telegram, openai, rippled, workdir)
+
+    # Imported only now, so bot.config and the clients see the fake endpoints
+    import server
+    from werkzeug.serving import make_server
+    from assistant.batching import transcription_batcher
+    from bot import wallet_repository
+    from xrpl.wallet import Wallet
+
+    store = FakeWalletStore(args.store_ms / 1000)
+    wallet_repository._database = store
+    transcription = FakeTranscriptionService(args.transcribe_ms / 1000, workers=args.transcription_workers)
+    server.transcription_service = transcription
+    transcription_batcher.service = transcription
+
+    server.transcribe_voice = timer.wrap("transcribe", server.transcribe_voice)
+    server.assistant_session.send = timer.wrap("assistant", server.assistant_session.send)
+    server.submission_engine.send_payment = timer.wrap("payment", server.submission_engine.send_payment)
+
+    handled = [0]
+    finished = [0.0]
+    process_update = server.dispatcher.handler
+
+    async def timed_update(payload):
+        started = time.perf_counter()
+        posted = generator.posted_at.get(payload.get("update_id"))
+        if posted is not None:
+            timer.record("queue", started - posted)
+        try:
+            await process_update(payload)
+        finally:
+            finished[0] = time.perf_counter()
+            timer.record("handler", finished[0] - started)
+            handled[0] += 1
+
+    server.dispatcher.handler = timed_update
+    server.start_services()
+
+    users = [{"id": FIRST_USER_ID + i, "username": f"bench_user_{i}"} for i in range(args.users)]
+    payees = [{"id": FIRST_PAYEE_ID + i, "username": f"bench_payee_{i}"} for i in range(args.payees)]
+
+    async def seed():
+        for user in users + payees:
+            wallet = Wallet.create()
+            await wallet_repository.save_user_wallet(user["id"], user["username"], wallet.seed, wallet.classic_address)
+    server.dispatcher.run(seed())
+
+    http_server = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, name="webhook", daemon=True).start()
+    generator = LoadGenerator(http_server.server_port, timer, args.connections)
+
+    kinds, weights = zip(*args.mix.items())
+    clip_size = len(telegram.clip)
+    random.seed(args.seed)
+    jobs = []
+    updates = 0
+    started = time.perf_counter()
+    next_arrival = started
+    for job in itertools.count():
+        if updates >= args.updates:
+            break
+        # Round robin keeps one job per user in flight as long as users outnumber concurrent jobs
+        user = users[job % len(users)]
+        kind = random.choices(kinds, weights)[0]
+        if kind == "text":
+            payloads = [generator.message_update(user, text="hi, what can you do?")]
+        elif kind == "voice":
+            payloads = [generator.message_update(user, voice=clip_size)]
+        else:
+            payee = random.choice(payees)
+            payloads = [
+                generator.message_update(user, text=f"send 1 xrp to @{payee['username']}"),
+                generator.message_update(user, text="yes"),
+            ]
+        updates += len(payloads)
+
+        next_arrival += random.expovariate(args.rate)
+        time.sleep(max(0.0, next_arrival - time.perf_counter()))
+        jobs.append(generator.submit(payloads))
+
+    for job in jobs:
+        job.result()
+    deadline = time.perf_counter() + args.drain_seconds
+    while handled[0] < generator.accepted and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    elapsed = (finished[0] or time.perf_counter()) - started
+
+    try:
+        metrics = server.dispatcher.metrics()
+        print(
+            f"\n{handled[0]} of {updates} updates handled in {elapsed:.1f}s "
+            f"({handled[0] / elapsed:.1f} updates/s), {generator.rejected} refused with 503, "
+            f"{metrics['failed']} failed"
+        )
+        print_table(["stage", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms"], timer.rows())
+
+        print()
+        rows = []
+        for service, calls in (("telegram", telegram.calls), ("openai", openai.calls),
+                               ("rippled", rippled.calls), ("store", store.calls)):
+            for call, count in sorted(calls.items()):
+                rows.append([service, call, count, f"{count / max(1, handled[0]):.2f}"])
+        print_table(["service", "call", "count", "per_update"], rows)
+    finally:
+        generator.shutdown()
+        http_server.shutdown()
+        server.stop_services()
+        for fake in (telegram, openai, rippled):
+            fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rate", type=float, default=20.0, help="Job arrivals per second")
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--mix", type=parse_mix, default="text=0.5,voice=0.2,payment=0.3",
+                        help="Share of text, voice and payment jobs")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--payees", type=int, default=20)
+    parser.add_argument("--connections", type=int, default=16, help="Concurrent webhook connections")
+    parser.add_argument("--telegram-ms", type=float, default=40.0)
+    parser.add_argument("--openai-ms", type=float, default=150.0, help="Latency of each assistants API call")
+    parser.add_argument("--run-ms", type=float, default=1200.0, help="Duration of an assistant run")
+    parser.add_argument("--rippled-ms", type=float, default=30.0)
+    parser.add_argument("--ledger-seconds", type=float, default=3.5)
+    parser.add_argument("--store-ms", type=float, default=2.0)
+    parser.add_argument("--transcribe-ms", type=float, default=400.0)
+    parser.add_argument("--transcription-workers", type=int, default=2)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter as a fraction of each latency")
+    parser.add_argument("--drain-seconds", type=float, default=60.0, help="How long to wait for queued updates")
+    parser.add_argument("--seed", type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,144 @@
+"""
+Accuracy/latency comparison of transcription backends.
+
+Transcribes the recorded sample commands listed in samples/commands.json
+with each backend configuration and reports word error rate, exact-match
+command accuracy, latency and real-time factor. The repository ships
+only the manifest: record the clips as Telegram voice notes (.ogg) and
+place them next to it, or point --samples at another directory with its
+own commands.json. Clips that are missing or can't be decoded are skipped
+and listed, and the results say how many samples they cover.
+
+Usage:
+    python -m benchmarks.transcription_accuracy \
+        --configs whisper:base.en:float32,whisper:base.en:int8,faster-whisper:tiny.en:int8
+"""
+import argparse
+import json
+import os
+import re
+import time
+from assistant.audio_processing import load_audio, preprocess_audio
+from assistant.backends import create_backend
+from .stats import percentile, print_table
+
+NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+    "eleven": "11", "twelve": "12", "fifteen": "15", "twenty": "20",
+    "fifty": "50", "hundred": "100", "half": "0.5",
+}
+
+
+def normalize(text):
+    """
+    Lowercases, drops punctuation and '@', and maps number words to digits so
+    'Send five XRP to Bob.' and 'send 5 xrp to @bob' compare equal.
+    """
+    words = re.sub(r"[^\w\s.]", " ", text.lower().replace("@", "")).split()
+    return [NUMBER_WORDS.get(word.strip("."), word.strip(".")) for word in words if word.strip(".")]
+
+
+def word_errors(reference, hypothesis):
+    """
+    Returns the word-level edit distance between two token lists.
+    """
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def run_config(config, samples):
+    backend_name, model_size, compute_type = (config.split(":") + ["default"])[:3]
+    started = time.perf_counter()
+    backend = create_backend(backend_name, model_size, compute_type)
+    load_seconds = time.perf_counter() - started
+
+    errors = words = exact = 0
+    latencies = []
+    audio_seconds = 0.0
+    for sample in samples:
+        prepared = preprocess_audio(sample["audio"])
+        audio_seconds += prepared["original_seconds"]
+
+        started = time.perf_counter()
+        text = " ".join(backend.transcribe_batch(prepared["chunks"]))
+        latencies.append(time.perf_counter() - started)
+
+        reference, hypothesis = normalize(sample["text"]), normalize(text)
+        errors += word_errors(reference, hypothesis)
+        words += len(reference)
+        exact += reference == hypothesis
+
+    return [
+        backend_name,
+        model_size,
+        compute_type,
+        f"{load_seconds:.1f}",
+        f"{100 * errors / max(1, words):.1f}",
+        f"{100 * exact / len(samples):.0f}",
+        f"{sum(latencies) / len(latencies) * 1000:.0f}",
+        f"{percentile(latencies, 95) * 1000:.0f}",
+        f"{sum(latencies) / max(audio_seconds, 1e-9):.3f}",
+    ]
+
+
+def load_samples(directory):
+    with open(os.path.join(directory, "commands.json")) as file:
+        manifest = json.load(file)
+
+    samples = []
+    skipped = []
+    for entry in manifest:
+        path = os.path.join(directory, entry["file"])
+        if not os.path.exists(path):
+            skipped.append(f"{entry['file']} (not recorded)")
+            continue
+        try:
+            audio = load_audio(path)
+        except Exception as e:
+            skipped.append(f"{entry['file']} (can't decode: {e})")
+            continue
+        samples.append({"text": entry["text"], "audio": audio})
+
+    if skipped:
+        print(f"Skipping {len(skipped)} of {len(manifest)} samples listed in {directory}/commands.json:")
+        for line in skipped:
+            print(f"  {line}")
+    return samples, len(manifest)
+
+
+def main(args):
+    samples, listed = load_samples(args.samples)
+    if not samples:
+        raise SystemExit(
+            f"None of the {listed} samples in {args.samples}/commands.json have been recorded; "
+            "add the .ogg clips next to the manifest or pass --samples"
+        )
+    print(f"Transcribing {len(samples)} of {listed} samples")
+
+    rows = [run_config(config, samples) for config in args.configs]
+    print_table(
+        ["backend", "model", "compute", "load_s", "wer_%", "exact_%", "mean_ms", "p95_ms", "rtf"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", default=os.path.join(os.path.dirname(__file__), "samples"))
+    parser.add_argument(
+        "--configs",
+        type=lambda v: v.split(","),
+        default=["whisper:base.en:float32", "whisper:base.en:int8", "whisper:tiny.en:int8"],
+        help="Comma-separated backend:model:compute_type entries",
+    )
+    main(parser.parse_args())
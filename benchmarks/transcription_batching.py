@@ -0,0 +1,75 @@
+"""
+Throughput vs. latency of the transcription micro-batcher.
+
+Replays voice clips against the worker pool with Poisson arrivals at a
+fixed request rate and reports throughput and p50/p99 latency for each
+batching window. A window of 0 ms with a max batch of 1 is the unbatched
+baseline.
+
+Usage:
+    python -m benchmarks.transcription_batching path/to/clips --rate 8 --requests 200
+"""
+import argparse
+import asyncio
+import glob
+import os
+import random
+import time
+from assistant.batching import MicroBatcher
+from assistant.transcription import TranscriptionService
+from .stats import percentile, print_table
+
+
+async def run_window(service, clips, window_ms, max_batch, rate, requests):
+    batcher = MicroBatcher(service, window_ms=window_ms, max_batch=max_batch)
+    latencies = []
+
+    async def one(clip):
+        started = time.perf_counter()
+        await batcher.transcribe(clip)
+        latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        tasks.append(asyncio.create_task(one(random.choice(clips))))
+        await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    return [
+        window_ms,
+        max_batch,
+        f"{batcher.average_batch_size:.2f}",
+        f"{requests / elapsed:.2f}",
+        f"{percentile(latencies, 50) * 1000:.0f}",
+        f"{percentile(latencies, 99) * 1000:.0f}",
+    ]
+
+
+async def main(args):
+    clips = sorted(glob.glob(os.path.join(args.clips, "*.ogg")) + glob.glob(os.path.join(args.clips, "*.wav")))
+    if not clips:
+        raise SystemExit(f"No .ogg or .wav clips found in {args.clips}")
+
+    service = TranscriptionService(workers=args.workers)
+    service.start()
+    try:
+        rows = [await run_window(service, clips, 0, 1, args.rate, args.requests)]
+        for window_ms in args.windows:
+            rows.append(await run_window(service, clips, window_ms, args.max_batch, args.rate, args.requests))
+    finally:
+        service.shutdown()
+
+    print_table(["window_ms", "max_batch", "avg_batch", "clips/s", "p50_ms", "p99_ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("clips", help="Directory of .ogg/.wav voice clips")
+    parser.add_argument("--rate", type=float, default=8.0, help="Arrival rate in requests per second")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--windows", type=lambda v: [int(w) for w in v.split(",")], default=[10, 25, 50, 100, 200])
+    asyncio.run(main(parser.parse_args()))
@@ -1,8 +1,37 @@
 # bot/__init__.py
 
 # Import key components for easier access at the package level
-from .config import MONGO_URI, TELEGRAM_BOT_TOKEN, JSON_RPC_URL
-from .database import create_mongo_connection, save_user_wallet, get_user_wallet, get_user_wallet_by_username
-from .wallet import generate_faucet_wallet_sync, send_xrp
-from .handlers import start, echo, status, send, handle_voice
+from .config import MONGO_URI, TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL, JSON_RPC_URL
+from .database import (
+    create_mongo_connection,
+    WalletRepository,
+    CachedWalletRepository,
+    wallet_repository,
+    ensure_indexes,
+    save_user_wallet,
+    get_user_wallet,
+    get_user_wallet_by_username,
+    get_user_wallets,
+    ensure_wallet_address,
+)
+from .cache import WalletCache
+from .wallet import generate_faucet_wallet_sync, send_xrp, get_wallet, derive_address
+from .submission import SubmissionEngine, SubmissionError, FailedSubmission, submission_engine
+from .ledger_stream import LedgerStream, ledger_stream
+from .wallet_pool import WalletPool, wallet_pool
+from .dedupe import UpdateDeduplicator, SQLiteUpdateDeduplicator, create_update_deduplicator
+from .dispatcher import UpdateDispatcher
+from .metrics import MetricsRegistry, metrics, span, traced, correlation, current_correlation_id, METRICS_CONTENT_TYPE
+from .outbox import MessageOutbox, TokenBucket, outbox, TRANSACTIONAL, NOTIFICATION
+from .idempotency import IdempotentPayments, idempotent_payments, payment_idempotency_key
+from .session_store import (
+    SessionStore,
+    SQLiteSessionStore,
+    MongoSessionStore,
+    SessionPersistence,
+    create_session_store,
+    create_persistence,
+)
+from .migrations import backfill_wallet_addresses
+from .handlers import start, echo, status, send, pay_many, payout, handle_voice, send_confirmation_message, clear_confirmation
 # from .telegram_bot import initialize_and_run, application, bot
@@ -0,0 +1,124 @@
+import time
+from collections import OrderedDict, deque
+from .config import WALLET_CACHE_SIZE, WALLET_CACHE_TTL_SECONDS, WALLET_CACHE_SECRET_TTL_SECONDS
+
+
+class WalletCache:
+    """
+    LRU cache of wallet records with a TTL, indexed by user_id and username.
+
+    Private keys are held for at most `secret_ttl` seconds: after that the
+    key is scrubbed from the cached record while the rest of the profile
+    stays cached until `ttl`. Lookups that need the key then count as a miss
+    and go back to the database. A `secret_ttl` of 0 never caches keys.
+    """
+
+    def __init__(self, maxsize=WALLET_CACHE_SIZE, ttl=WALLET_CACHE_TTL_SECONDS,
+                 secret_ttl=WALLET_CACHE_SECRET_TTL_SECONDS, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.secret_ttl = min(secret_ttl, ttl)
+        self.clock = clock
+        # user_id -> [record, expires_at, secret_expires_at]
+        self._entries = OrderedDict()
+        self._usernames = {}
+        # (secret_expires_at, user_id) in expiry order, since secret_ttl is fixed
+        self._secrets = deque()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, user_id, need_secret=False):
+        """
+        Returns a copy of the cached record for user_id, or None on a miss.
+        """
+        self._scrub_expired_secrets()
+        return self._lookup(user_id, need_secret)
+
+    def get_by_username(self, username, need_secret=False):
+        self._scrub_expired_secrets()
+        user_id = self._usernames.get(username)
+        if user_id is None:
+            self.stats["misses"] += 1
+            return None
+        return self._lookup(user_id, need_secret)
+
+    def _lookup(self, user_id, need_secret):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if self.clock() >= entry[1]:
+            self._remove(user_id)
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+        if need_secret and "private_key" not in entry[0]:
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(user_id)
+        self.stats["hits"] += 1
+        return dict(entry[0])
+
+    def put(self, record):
+        if not record or self.maxsize <= 0 or "user_id" not in record:
+            return
+        self._scrub_expired_secrets()
+
+        user_id = record["user_id"]
+        self._remove(user_id)
+        now = self.clock()
+        cached = dict(record)
+        if self.secret_ttl <= 0:
+            cached.pop("private_key", None)
+        elif "private_key" in cached:
+            self._secrets.append((now + self.secret_ttl, user_id))
+
+        self._entries[user_id] = [cached, now + self.ttl, now + self.secret_ttl]
+        if cached.get("username"):
+            self._usernames[cached["username"]] = user_id
+
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, user_id=None, username=None):
+        """
+        Drops the entries for a user_id and/or username.
+        """
+        if username is not None and username in self._usernames:
+            self._remove(self._usernames[username])
+            self.stats["invalidations"] += 1
+        if user_id is not None and user_id in self._entries:
+            self._remove(user_id)
+            self.stats["invalidations"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._usernames.clear()
+        self._secrets.clear()
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        entry[0].pop("private_key", None)
+        username = entry[0].get("username")
+        if username and self._usernames.get(username) == user_id:
+            del self._usernames[username]
+
+    def _scrub_expired_secrets(self):
+        now = self.clock()
+        while self._secrets and self._secrets[0][0] <= now:
+            _, user_id = self._secrets.popleft()
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[2] <= now:
+                entry[0].pop("private_key", None)
+
+    @property
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
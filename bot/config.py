@@ -6,5 +6,89 @@ load_dotenv()
 
 # Configuration
 MONGO_URI = os.getenv('MONGO_URI')
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'user_wallets_db')
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', '5000'))
+
+# Wallet cache; private keys are scrubbed from cached records after the
+# secret TTL. WALLET_CACHE_SIZE=0 disables the cache.
+WALLET_CACHE_SIZE = int(os.getenv('WALLET_CACHE_SIZE', '1000'))
+WALLET_CACHE_TTL_SECONDS = float(os.getenv('WALLET_CACHE_TTL_SECONDS', '300'))
+WALLET_CACHE_SECRET_TTL_SECONDS = float(os.getenv('WALLET_CACHE_SECRET_TTL_SECONDS', '30'))
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-JSON_RPC_URL = "https://s.altnet.rippletest.net:51234/"
+# Bot API endpoints; point them elsewhere for a local Bot API server or the benchmark fakes
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL', 'https://api.telegram.org/file/bot')
+JSON_RPC_URL = os.getenv('JSON_RPC_URL', "https://s.altnet.rippletest.net:51234/")
+
+# Transaction submission: LastLedgerSequence is set this many ledgers past
+# the latest validated one; pending transactions are checked every poll
+XRPL_LEDGER_OFFSET = int(os.getenv('XRPL_LEDGER_OFFSET', '20'))
+XRPL_VALIDATION_POLL_SECONDS = float(os.getenv('XRPL_VALIDATION_POLL_SECONDS', '1'))
+XRPL_FEE_REFRESH_SECONDS = float(os.getenv('XRPL_FEE_REFRESH_SECONDS', '60'))
+
+# Derived signing wallets kept in memory, so each seed is derived once
+WALLET_DERIVATION_CACHE_SIZE = int(os.getenv('WALLET_DERIVATION_CACHE_SIZE', '256'))
+
+# Ledger subscription: validated transactions for our accounts arrive over
+# one WebSocket. An empty XRPL_WS_URL disables it and falls back to polling.
+XRPL_WS_URL = os.getenv('XRPL_WS_URL', "wss://s.altnet.rippletest.net:51233/")
+XRPL_STREAM_IDLE_SECONDS = float(os.getenv('XRPL_STREAM_IDLE_SECONDS', '30'))
+XRPL_STREAM_RECONNECT_MAX_SECONDS = float(os.getenv('XRPL_STREAM_RECONNECT_MAX_SECONDS', '60'))
+XRPL_STREAM_SUBSCRIBE_BATCH = int(os.getenv('XRPL_STREAM_SUBSCRIBE_BATCH', '500'))
+
+# Pre-funded wallets kept ready for /register. The replenisher tops the pool
+# up to WALLET_POOL_SIZE at no more than WALLET_POOL_FAUCET_PER_MINUTE faucet
+# calls and warns below the low watermark. WALLET_POOL_SIZE=0 disables it.
+WALLET_POOL_SIZE = int(os.getenv('WALLET_POOL_SIZE', '20'))
+WALLET_POOL_LOW_WATERMARK = int(os.getenv('WALLET_POOL_LOW_WATERMARK', '5'))
+WALLET_POOL_FAUCET_PER_MINUTE = float(os.getenv('WALLET_POOL_FAUCET_PER_MINUTE', '6'))
+
+# An account can hold at most 250 Tickets; larger batches are sent in chunks
+XRPL_MAX_TICKETS = int(os.getenv('XRPL_MAX_TICKETS', '250'))
+
+# Webhook updates are acknowledged at once and processed on one long-lived
+# event loop, in order per user and at most WEBHOOK_WORKERS at a time across
+# users. When WEBHOOK_QUEUE_SIZE updates are waiting the webhook answers 503
+# so Telegram redelivers later.
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '32'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_DRAIN_SECONDS = float(os.getenv('WEBHOOK_DRAIN_SECONDS', '30'))
+
+# Redelivered webhook updates are dropped by update_id. The last
+# UPDATE_DEDUP_WINDOW ids are kept in memory; UPDATE_DEDUP_BACKEND=sqlite
+# also records them in UPDATE_DEDUP_PATH so the window survives restarts.
+UPDATE_DEDUP_WINDOW = int(os.getenv('UPDATE_DEDUP_WINDOW', '10000'))
+UPDATE_DEDUP_BACKEND = os.getenv('UPDATE_DEDUP_BACKEND', 'memory')
+UPDATE_DEDUP_PATH = os.getenv('UPDATE_DEDUP_PATH', 'seen_updates.db')
+
+# Results of confirmed payments are kept this long under their idempotency
+# key, so a repeated confirmation returns the earlier result
+PAYMENT_IDEMPOTENCY_TTL_SECONDS = int(os.getenv('PAYMENT_IDEMPOTENCY_TTL_SECONDS', '86400'))
+
+# Conversation state (pending confirmations) shared between server processes:
+# 'sqlite' for several processes on one machine, 'mongo' for several
+# machines, 'memory' to keep it in-process only. Entries expire after
+# SESSION_TTL_SECONDS without an update.
+SESSION_STORE_BACKEND = os.getenv('SESSION_STORE_BACKEND', 'sqlite')
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', 'sessions.db')
+SESSION_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', '1800'))
+
+# Outgoing Telegram messages are rate limited to stay under Telegram's flood
+# limits: OUTBOX_GLOBAL_PER_SECOND across all chats and OUTBOX_CHAT_PER_SECOND
+# per chat, with bursts of up to OUTBOX_CHAT_BURST. Sends that fail with a
+# network error or RetryAfter are tried up to OUTBOX_MAX_RETRIES times.
+OUTBOX_GLOBAL_PER_SECOND = float(os.getenv('OUTBOX_GLOBAL_PER_SECOND', '25'))
+OUTBOX_CHAT_PER_SECOND = float(os.getenv('OUTBOX_CHAT_PER_SECOND', '1'))
+OUTBOX_CHAT_BURST = int(os.getenv('OUTBOX_CHAT_BURST', '3'))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '8'))
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', '5'))
+OUTBOX_DRAIN_SECONDS = float(os.getenv('OUTBOX_DRAIN_SECONDS', '10'))
+
+# Per-stage latency histograms served on /metrics. METRICS_ENABLED=false
+# turns the stage timers into no-ops; gauges and component counts are still
+# read at scrape time. TRACE_SPANS=true also logs every span as a JSON line
+# with the update's correlation id.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+TRACE_SPANS = os.getenv('TRACE_SPANS', 'false').lower() == 'true'
@@ -1,39 +1,301 @@
-from pymongo import MongoClient, errors
-from .config import MONGO_URI
-
-def create_mongo_connection():
-    try:
-        client = MongoClient(MONGO_URI)
-        db = client['user_wallets_db']
-        client.admin.command('ping')
-        print("Connected to MongoDB")
-        return db['user_wallets']
-    except errors.ConnectionFailure as e:
-        print(f"Could not connect to MongoDB: {e}")
-        return None
-
-user_wallets_collection = create_mongo_connection()
-
-def save_user_wallet(user_id, username, private_key):
-    try:
-        user_wallets_collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"username": username, "private_key": private_key}},
-            upsert=True
-        )
-    except Exception as e:
-        print(f"Error while saving user wallet: {e}")
-
-def get_user_wallet(user_id):
-    try:
-        return user_wallets_collection.find_one({"user_id": user_id})
-    except Exception as e:
-        print(f"Error while retrieving user wallet: {e}")
-        return None
-
-def get_user_wallet_by_username(user_name):
-    try:
-        return user_wallets_collection.find_one({"username": user_name})
-    except Exception as e:
-        print(f"Error while retrieving user wallet: {e}")
-        return None
+from pymongo import ASCENDING, errors
+from .cache import WalletCache
+from .wallet import derive_address
+from .metrics import traced
+from .config import WALLET_CACHE_SIZE, MONGO_URI, MONGO_DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_TIMEOUT_MS
+
+
+def create_mongo_connection(uri=MONGO_URI):
+    """
+    Returns the wallet database without connecting yet.
+
+    Motor connects lazily on the first operation, so importing this module
+    no longer blocks on a ping. MONGO_URI=memory:// selects the in-process
+    stand-in instead of a server.
+    """
+    if uri and uri.startswith("memory://"):
+        from .memory_store import InMemoryDatabase
+        return InMemoryDatabase()
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+    )
+    return client[MONGO_DB_NAME]
+
+
+class WalletRepository:
+    """
+    Async access to user wallet records.
+
+    Records look like {'user_id', 'username', 'private_key', 'address'}, the
+    address being the wallet's classic address so it never has to be
+    re-derived from the seed. The database
+    is created on first use; call `ensure_indexes` once at startup.
+    """
+
+    def __init__(self, database=None, collection_name="user_wallets"):
+        self._database = database
+        self.collection_name = collection_name
+
+    @property
+    def database(self):
+        if self._database is None:
+            self._database = create_mongo_connection()
+        return self._database
+
+    @property
+    def collection(self):
+        return self.database[self.collection_name]
+
+    async def ensure_indexes(self):
+        """
+        Creates the unique indexes lookups rely on. Usernames are optional on
+        Telegram, so that index only covers records that have one.
+        """
+        try:
+            await self.collection.create_index([("user_id", ASCENDING)], unique=True, name="user_id_unique")
+            await self.collection.create_index(
+                [("username", ASCENDING)],
+                unique=True,
+                name="username_unique",
+                partialFilterExpression={"username": {"$type": "string"}},
+            )
+            print("Wallet indexes ready")
+        except errors.PyMongoError as e:
+            print(f"Could not create wallet indexes: {e}")
+
+    async def save_user_wallet(self, user_id, username, private_key, address=None):
+        """
+        Stores a user's wallet, replacing any previous one.
+
+        Telegram usernames can be reassigned, so a stale record still holding
+        `username` loses it first; otherwise the unique index would refuse
+        the new owner's wallet.
+
+        Returns:
+        bool: Whether the wallet was saved.
+        """
+        if address is None:
+            address = derive_address(private_key)
+        try:
+            if username:
+                await self.collection.update_many(
+                    {"username": username, "user_id": {"$ne": user_id}}, {"$unset": {"username": ""}}
+                )
+            await self.collection.update_one(
+                {"user_id": user_id},
+                {"$set": {"username": username, "private_key": private_key, "address": address}},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            print(f"Error while saving user wallet: {e}")
+            return False
+
+    @staticmethod
+    def _without_secret(record, need_secret):
+        if record is not None and not need_secret:
+            record = {k: v for k, v in record.items() if k != "private_key"}
+        return record
+
+    async def get_user_wallet(self, user_id, need_secret=True):
+        try:
+            # Callers that don't need the key never get it back
+            return await self.collection.find_one({"user_id": user_id}, None if need_secret else {"private_key": 0})
+        except Exception as e:
+            print(f"Error while retrieving user wallet: {e}")
+            return None
+
+    async def get_user_wallet_by_username(self, user_name, need_secret=True):
+        try:
+            return await self.collection.find_one({"username": user_name}, None if need_secret else {"private_key": 0})
+        except Exception as e:
+            print(f"Error while retrieving user wallet: {e}")
+            return None
+
+    async def get_user_wallets(self, user_id=None, usernames=(), need_secret=True):
+        """
+        Resolves a user and any number of usernames in a single query.
+
+        Parameters:
+        user_id (int): The Telegram user id to look up, e.g. the sender.
+        usernames (iterable): Usernames to look up, e.g. the recipients.
+        need_secret (bool): Whether the caller needs 'private_key' in the
+            user_id record.
+
+        Returns:
+        tuple: (record for user_id or None, {username: record} for the
+               usernames that were found). Username records never include
+               'private_key'; use their 'address' to pay them.
+        """
+        usernames = list(dict.fromkeys(usernames))
+        clauses = []
+        if user_id is not None:
+            clauses.append({"user_id": user_id})
+        if usernames:
+            clauses.append({"username": {"$in": usernames}})
+        if not clauses:
+            return None, {}
+
+        try:
+            records = await self.collection.find({"$or": clauses}).to_list(length=None)
+        except Exception as e:
+            print(f"Error while retrieving user wallets: {e}")
+            return None, {}
+
+        user = next((record for record in records if user_id is not None and record.get("user_id") == user_id), None)
+        by_username = {
+            record["username"]: {k: v for k, v in record.items() if k != "private_key"}
+            for record in records if record.get("username") in usernames
+        }
+        return self._without_secret(user, need_secret), by_username
+
+    async def ensure_address(self, record):
+        """
+        Returns a wallet record's classic address, deriving it from the seed
+        and storing it for records saved before addresses were kept. The
+        stored key is never touched.
+
+        Parameters:
+        record (dict): A wallet record, with or without 'private_key'.
+
+        Returns:
+        str: The address, also set on `record`.
+        None: If the seed is missing or can't be derived.
+        """
+        if record.get("address"):
+            return record["address"]
+        private_key = record.get("private_key")
+        if not private_key:
+            stored = await WalletRepository.get_user_wallet(self, record["user_id"])
+            private_key = stored and stored.get("private_key")
+        if not private_key:
+            return None
+        try:
+            address = derive_address(private_key)
+        except Exception as e:
+            print(f"Could not derive the address of user {record['user_id']}'s wallet: {e}")
+            return None
+        try:
+            await self.collection.update_one({"user_id": record["user_id"]}, {"$set": {"address": address}})
+        except Exception as e:
+            print(f"Error while storing wallet address: {e}")
+        record["address"] = address
+        return address
+
+    async def get_wallet_addresses(self):
+        """
+        Returns every stored wallet's address with its owner, without keys.
+
+        Returns:
+        list: Records with 'user_id', 'username' and 'address'.
+        """
+        try:
+            return await self.collection.find(
+                {"address": {"$exists": True}}, {"_id": 0, "user_id": 1, "username": 1, "address": 1}
+            ).to_list(length=None)
+        except Exception as e:
+            print(f"Error while retrieving wallet addresses: {e}")
+            return []
+
+
+class CachedWalletRepository(WalletRepository):
+    """
+    WalletRepository with a read-through WalletCache in front of it.
+
+    Lookups that don't need the private key (`need_secret=False`) can be
+    served from the cached profile after the key has been scrubbed, and
+    never get 'private_key' back, whether the record came from the cache
+    or the database. Saving a wallet invalidates its user_id and username
+    entries.
+    """
+
+    def __init__(self, database=None, collection_name="user_wallets", cache=None):
+        super().__init__(database, collection_name)
+        self.cache = cache if cache is not None else WalletCache()
+
+    async def save_user_wallet(self, user_id, username, private_key, address=None):
+        # Dropping the user_id entry also drops its previous username mapping
+        self.cache.invalidate(user_id=user_id, username=username)
+        saved = await super().save_user_wallet(user_id, username, private_key, address)
+        # Again after the write, in case a concurrent read cached the old record in between
+        self.cache.invalidate(user_id=user_id, username=username)
+        return saved
+
+    async def ensure_address(self, record):
+        if record.get("address"):
+            return record["address"]
+        address = await super().ensure_address(record)
+        # The cached record predates the stored address
+        self.cache.invalidate(user_id=record["user_id"])
+        return address
+
+    async def get_user_wallet(self, user_id, need_secret=True):
+        record = self.cache.get(user_id, need_secret)
+        if record is None:
+            record = await super().get_user_wallet(user_id)
+            self.cache.put(record)
+        # Only the caller's copy is stripped; the cache keeps the key until secret_ttl
+        return self._without_secret(record, need_secret)
+
+    async def get_user_wallet_by_username(self, user_name, need_secret=True):
+        record = self.cache.get_by_username(user_name, need_secret)
+        if record is None:
+            record = await super().get_user_wallet_by_username(user_name)
+            self.cache.put(record)
+        return self._without_secret(record, need_secret)
+
+    async def get_user_wallets(self, user_id=None, usernames=(), need_secret=True):
+        usernames = list(dict.fromkeys(usernames))
+        user = self.cache.get(user_id, need_secret) if user_id is not None else None
+        found = {}
+        for username in usernames:
+            record = self.cache.get_by_username(username)
+            if record is not None:
+                record.pop("private_key", None)
+                found[username] = record
+
+        missing = [username for username in usernames if username not in found]
+        if (user is None and user_id is not None) or missing:
+            fetched_user, fetched = await super().get_user_wallets(
+                user_id if user is None else None, missing, need_secret
+            )
+            if user is None:
+                user = fetched_user
+                self.cache.put(fetched_user)
+            for username, record in fetched.items():
+                found[username] = record
+                self.cache.put(record)
+        return self._without_secret(user, need_secret), found
+
+
+wallet_repository = CachedWalletRepository() if WALLET_CACHE_SIZE > 0 else WalletRepository()
+
+
+@traced("db_ensure_indexes")
+async def ensure_indexes():
+    await wallet_repository.ensure_indexes()
+
+@traced("db_save_user_wallet")
+async def save_user_wallet(user_id, username, private_key, address=None):
+    return await wallet_repository.save_user_wallet(user_id, username, private_key, address)
+
+@traced("db_get_user_wallet")
+async def get_user_wallet(user_id, need_secret=True):
+    return await wallet_repository.get_user_wallet(user_id, need_secret)
+
+@traced("db_get_user_wallet_by_username")
+async def get_user_wallet_by_username(user_name, need_secret=True):
+    return await wallet_repository.get_user_wallet_by_username(user_name, need_secret)
+
+@traced("db_ensure_wallet_address")
+async def ensure_wallet_address(record):
+    return await wallet_repository.ensure_address(record)
+
+@traced("db_get_user_wallets")
+async def get_user_wallets(user_id=None, usernames=(), need_secret=True):
+    return await wallet_repository.get_user_wallets(user_id, usernames, need_secret)
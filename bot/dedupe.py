@@ -0,0 +1,82 @@
+import sqlite3
+from collections import OrderedDict
+from .config import UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_BACKEND, UPDATE_DEDUP_PATH
+
+
+class UpdateDeduplicator:
+    """
+    Remembers the last `window` update ids so Telegram redeliveries are
+    dropped instead of running the whole pipeline again. Each check is a
+    single dict lookup; subclasses may also persist the ids.
+    """
+
+    def __init__(self, window=UPDATE_DEDUP_WINDOW):
+        self.window = window
+        self._seen = OrderedDict()
+        self.stats = {"checked": 0, "duplicates": 0}
+
+    def is_duplicate(self, update_id):
+        """
+        Records an update id.
+
+        Returns:
+        bool: True if the id was already seen within the window.
+        """
+        self.stats["checked"] += 1
+        if update_id is None:
+            return False
+        if update_id in self._seen or self._persisted(update_id):
+            self.stats["duplicates"] += 1
+            return True
+
+        self._seen[update_id] = None
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+        self._record(update_id)
+        return False
+
+    def _persisted(self, update_id):
+        return False
+
+    def _record(self, update_id):
+        pass
+
+
+class SQLiteUpdateDeduplicator(UpdateDeduplicator):
+    """
+    Deduplicator that also keeps the window in SQLite, so updates redelivered
+    across a restart are still recognised.
+    """
+
+    def __init__(self, path=UPDATE_DEDUP_PATH, window=UPDATE_DEDUP_WINDOW):
+        super().__init__(window)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY)")
+        self._conn.commit()
+        self._recorded = 0
+
+    def _persisted(self, update_id):
+        return self._conn.execute(
+            "SELECT 1 FROM seen_updates WHERE update_id = ?", (update_id,)
+        ).fetchone() is not None
+
+    def _record(self, update_id):
+        with self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO seen_updates (update_id) VALUES (?)", (update_id,))
+            self._recorded += 1
+            # Update ids increase, so trimming to the newest `window` keeps the table bounded
+            if self._recorded % 1000 == 0:
+                self._conn.execute(
+                    "DELETE FROM seen_updates WHERE update_id <= (SELECT MAX(update_id) FROM seen_updates) - ?",
+                    (self.window,),
+                )
+
+
+def create_update_deduplicator(backend=UPDATE_DEDUP_BACKEND, path=UPDATE_DEDUP_PATH):
+    if backend == "sqlite":
+        return SQLiteUpdateDeduplicator(path)
+    if backend == "memory":
+        return UpdateDeduplicator()
+    raise ValueError(f"Unknown update dedup backend '{backend}', expected 'memory' or 'sqlite'")
@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from .dedupe import create_update_deduplicator
+from .config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_SECONDS
+
+# Recent queue waits kept for the wait-time percentiles
+WAIT_SAMPLES = 1000
+
+
+def update_user_key(payload):
+    """
+    Returns the id of the user an update comes from, found in the 'from'
+    field of its message, callback query, inline query, etc. Updates without
+    a sender get a lane of their own.
+    """
+    for value in payload.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"].get("id")
+    return ("update", payload.get("update_id"))
+
+
+class UpdateDispatcher:
+    """
+    Processes webhook updates on one long-lived event loop.
+
+    The loop runs in a background thread for the life of the process, so
+    background tasks (ledger stream, wallet pool, transaction tracking) keep
+    running between updates. The web framework's request threads only call
+    `submit`, which queues the update and returns straight away.
+
+    Updates are sharded by sender into FIFO lanes. Each user's updates run
+    one at a time and in arrival order, since confirmation state lives in
+    their user_data, while different users' lanes run concurrently, at most
+    `workers` updates at once. A lane only exists while its user has updates
+    queued or running. When `queue_size` updates are waiting `submit`
+    refuses new ones so the webhook can ask Telegram to redeliver them
+    later, instead of piling up work. Updates whose id the deduplicator has
+    already seen are acknowledged without being queued again.
+    """
+
+    def __init__(self, handler, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, key=update_user_key,
+                 deduplicator=None):
+        self.handler = handler
+        self.deduplicator = deduplicator if deduplicator is not None else create_update_deduplicator()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.key = key
+        self.loop = None
+        self.accepting = False
+        self._thread = None
+        self._slots = None
+        self._idle = None
+        # user key -> deque of (payload, queued_at)
+        self._lanes = {}
+        self._lane_tasks = {}
+        self._queued = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0, "duplicates": 0, "lanes_opened": 0}
+
+    def start(self):
+        """
+        Starts the event loop thread.
+        """
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="update-dispatcher", daemon=True)
+        self._thread.start()
+        self.run(self._setup())
+        self.accepting = True
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _setup(self):
+        self._slots = asyncio.Semaphore(self.workers)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def run(self, coro, timeout=None):
+        """
+        Runs a coroutine on the dispatcher loop from another thread and
+        returns its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, payload):
+        """
+        Queues an update in its user's lane. Safe to call from any thread.
+
+        Returns:
+        bool: False if the update was refused because the dispatcher is
+              full or shutting down. Duplicates count as accepted.
+        """
+        if not self.accepting:
+            self.stats["rejected"] += 1
+            return False
+        accepted = self.run(self._enqueue(payload))
+        self.stats["accepted" if accepted else "rejected"] += 1
+        return accepted
+
+    async def _enqueue(self, payload):
+        if self._queued >= self.queue_size:
+            return False
+        # Checked after the capacity check, so a refused update isn't remembered as seen
+        if self.deduplicator.is_duplicate(payload.get("update_id")):
+            self.stats["duplicates"] += 1
+            return True
+        key = self.key(payload)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+        lane.append((payload, time.monotonic()))
+        self._queued += 1
+
+        if key not in self._lane_tasks:
+            self.stats["lanes_opened"] += 1
+            self._idle.clear()
+            self._lane_tasks[key] = asyncio.ensure_future(self._run_lane(key, lane))
+        return True
+
+    async def _run_lane(self, key, lane):
+        try:
+            while lane:
+                # A slot is taken per update, so a busy user can't hold one while others wait
+                async with self._slots:
+                    payload, queued_at = lane.popleft()
+                    self._queued -= 1
+                    self._waits.append(time.monotonic() - queued_at)
+                    try:
+                        await self.handler(payload)
+                        self.stats["processed"] += 1
+                    except Exception as e:
+                        self.stats["failed"] += 1
+                        print(f"Error while processing update: {e}")
+        finally:
+            # Idle lanes are closed; the next update from this user opens a new one
+            del self._lanes[key]
+            del self._lane_tasks[key]
+            if not self._lane_tasks:
+                self._idle.set()
+
+    @property
+    def queue_depth(self):
+        """
+        Updates waiting for a slot, across all lanes.
+        """
+        return self._queued
+
+    def metrics(self):
+        """
+        Returns a snapshot of queue depth, open lanes and queue wait times
+        (in seconds, over the last WAIT_SAMPLES updates).
+        """
+        waits = sorted(self._waits)
+
+        def percentile(share):
+            return waits[min(len(waits) - 1, int(share * len(waits)))] if waits else 0.0
+
+        return dict(
+            self.stats,
+            queue_depth=self._queued,
+            open_lanes=len(self._lane_tasks),
+            deepest_lane=max((len(lane) for lane in list(self._lanes.values())), default=0),
+            wait_p50=percentile(0.5),
+            wait_p95=percentile(0.95),
+            wait_max=waits[-1] if waits else 0.0,
+        )
+
+    def drain(self, timeout=WEBHOOK_DRAIN_SECONDS):
+        """
+        Stops accepting updates and waits up to `timeout` seconds for the
+        queued and in-progress ones to finish, then cancels the rest.
+        """
+        if self.loop is None:
+            return
+        self.accepting = False
+        try:
+            self.run(asyncio.wait_for(self._idle.wait(), timeout))
+        except asyncio.TimeoutError:
+            print(f"Dropping {self.queue_depth} queued update(s) after {timeout}s drain")
+        self.run(self._cancel_lanes())
+
+    async def _cancel_lanes(self):
+        tasks = list(self._lane_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        """
+        Stops the event loop thread. Call `drain` and any other shutdown
+        coroutines first.
+        """
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
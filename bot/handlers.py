@@ -1,82 +1,238 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from .database import save_user_wallet, get_user_wallet
-from .wallet import generate_faucet_wallet_sync, send_xrp, client
-from assistant.audio_processing import convert_audio_to_text
-from xrpl.wallet import Wallet  # Import Wallet class
+from .database import save_user_wallet, get_user_wallet, get_user_wallets, ensure_wallet_address
+from .wallet import generate_faucet_wallet_sync, get_wallet, client
+from .submission import submission_engine
+from .ledger_stream import ledger_stream
+from .wallet_pool import wallet_pool
+from .outbox import outbox
+from .metrics import span
+from .idempotency import idempotent_payments
+from assistant.batching import transcribe_voice
+from assistant.intent_parser import amount_error
 from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 import asyncio
 import os
+import time
+import uuid
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="Hello! I'm your bot.")
+    await outbox.send(update.effective_chat.id, "Hello! I'm your bot.")
 
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=update.message.text)
+    await outbox.send(update.effective_chat.id, update.message.text)
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username
 
-    # Check if the user already has a wallet in the database
-    user_data = get_user_wallet(user_id)
+    # Check if the user already has a wallet in the database; its address is stored with it
+    user_data = await get_user_wallet(user_id, need_secret=False)
     if user_data:
-        test_wallet = Wallet.from_seed(user_data['private_key'])  # Load wallet using the stored private key
+        # Older records without an address get it derived from their seed; an existing key is never replaced
+        test_account = await ensure_wallet_address(user_data)
+        if not test_account:
+            await outbox.send(update.effective_chat.id, "Sorry, I couldn't read your existing wallet's address, so I've left it as it is.")
+            return
     else:
-        # Use ThreadPoolExecutor to run the sync function in a separate thread
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as pool:
-            test_wallet = await loop.run_in_executor(pool, generate_faucet_wallet_sync, client, True)
-        # Save the new wallet to the database
-        save_user_wallet(user_id, username, test_wallet.seed)
-
-    # Extract the wallet address
-    test_account = test_wallet.address
+        # Claim a wallet funded in advance; only fall back to the faucet when the pool is empty
+        pooled = await wallet_pool.claim()
+        if pooled:
+            seed, test_account = pooled['private_key'], pooled['address']
+        else:
+            # Use ThreadPoolExecutor to run the sync function in a separate thread
+            loop = asyncio.get_event_loop()
+            with ThreadPoolExecutor() as pool:
+                test_wallet = await loop.run_in_executor(pool, generate_faucet_wallet_sync, client, True)
+            seed, test_account = test_wallet.seed, test_wallet.address
+            # Pooled like a pre-funded wallet if it can't be saved, so the faucet funds aren't lost
+            pooled = {"private_key": seed, "address": test_account, "created_at": time.time()}
+        # Save the new wallet to the database; the funded wallet goes back to the pool if that fails
+        try:
+            saved = await save_user_wallet(user_id, username, seed, test_account)
+        except asyncio.CancelledError:
+            # Save errors are reported in `saved`; a cancelled update still mustn't lose the wallet
+            await asyncio.shield(wallet_pool.release(pooled))
+            raise
+        if not saved:
+            await wallet_pool.release(pooled)
+            await outbox.send(update.effective_chat.id, "Sorry, I couldn't save your wallet. Please try /register again.")
+            return
+        ledger_stream.watch(test_account, user_id, username)
 
     # Send the wallet address to the user
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Your wallet address is: {test_account}")
+    await outbox.send(update.effective_chat.id, f"Your wallet address is: {test_account}")
 
 async def send(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     # Retrieve the user's wallet from the database
-    user_data = get_user_wallet(user_id)
+    user_data = await get_user_wallet(user_id)
     if not user_data:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="No wallet found for your user ID.")
+        await outbox.send(update.effective_chat.id, "No wallet found for your user ID.")
         return
 
-    test_wallet = Wallet.from_seed(user_data['private_key'])  # Load wallet using the stored private key
+    test_wallet = get_wallet(user_data['private_key'])  # Derived once per seed and cached
 
-    # Use ThreadPoolExecutor to run the sync function in a separate thread
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as pool:
-        response = await loop.run_in_executor(
-            pool, send_xrp, test_wallet.seed, 1, "raKQpxX2HC9RrVTX2gpyfun2f4QWnk5kez"
-        )
+    # Submitted asynchronously; no thread is tied up while the payment validates
+    response = await submission_engine.send_payment(test_wallet, 1, "raKQpxX2HC9RrVTX2gpyfun2f4QWnk5kez")
 
     # Check if the response is an error message or a successful transaction result
     if isinstance(response, str) and response.startswith("Submit failed:"):
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+        await outbox.send(update.effective_chat.id, response)
     else:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="XRP sent successfully!")
+        await outbox.send(update.effective_chat.id, "XRP sent successfully!")
         
         # Send a message to another user as well
         other_user_id = 123456789  # Replace with the actual Telegram user ID of the other user
-        await context.bot.send_message(chat_id=other_user_id, text="XRP sent successfully to another account!")
+        outbox.post(other_user_id, "XRP sent successfully to another account!")
+
+async def pay_many(context, chat_id, user_id, amounts, idempotency_key=None):
+    """
+    Sends XRP from a user to several recipients as one batch and replies
+    with a single summary.
+
+    Parameters:
+    context (ContextTypes.DEFAULT_TYPE): The handler context.
+    chat_id (int): Where to send the summary.
+    user_id (int): The sender's Telegram user id.
+    amounts (dict): XRP amount per recipient username (without '@').
+    idempotency_key (str): Key of the confirmation being carried out.
+        Recipients already paid under it are reported, not paid again.
+    """
+    # Sender and every recipient are resolved in one round-trip
+    user_data, recipients = await get_user_wallets(user_id, list(amounts))
+    if not user_data:
+        await outbox.send(chat_id, "No wallet found for your user ID.")
+        return
+
+    # A recipient whose address can't be worked out is reported as not registered
+    addresses = await asyncio.gather(*(ensure_wallet_address(record) for record in recipients.values()))
+    recipients = {username: record for (username, record), address in zip(recipients.items(), addresses) if address}
+    registered = [username for username in amounts if username in recipients]
+
+    # Each recipient has its own key, so repeating a confirmation only retries what didn't go through
+    keys = {username: f"{idempotency_key}:{username}" for username in registered} if idempotency_key else {}
+    claims = await asyncio.gather(*(idempotent_payments.claim(keys[username]) for username in keys))
+    replayed = {username: previous for username, (claimed, previous) in zip(keys, claims) if not claimed}
+    to_send = [username for username in registered if username not in replayed]
+
+    with span("batch_payment", payments=len(to_send)):
+        results = await submission_engine.send_batch(
+            get_wallet(user_data['private_key']),
+            [(recipients[username]['address'], amounts[username]) for username in to_send],
+        )
+    outcomes = dict(zip(to_send, results))
+    await asyncio.gather(*(idempotent_payments.complete(keys[username], outcomes[username]) for username in to_send if username in keys))
+    outcomes.update(replayed)
+
+    lines = []
+    for username, amount in amounts.items():
+        result = outcomes.get(username)
+        if result is None:
+            lines.append(f"@{username}: not registered yet")
+        elif isinstance(result, str) and result.startswith("Submit failed:"):
+            lines.append(f"@{username}: {result}")
+        elif username in replayed:
+            lines.append(f"@{username}: sent {amount} XRP (already sent earlier)")
+        else:
+            lines.append(f"@{username}: sent {amount} XRP")
+            # The ledger stream tells the recipient when it's live; otherwise tell them here
+            if not ledger_stream.connected:
+                outbox.post(recipients[username]['user_id'], "XRP received successfully!")
+
+    sent = sum(1 for line in lines if ": sent " in line)
+    summary = f"Sent {sent} of {len(amounts)} payments:\n" + "\n".join(lines)
+    await outbox.send(chat_id, summary)
+
+async def send_confirmation_message(context, chat_id, payment_info):
+    """
+    Shows the user a payment and waits for their 'Yes' or 'No'.
+
+    Parameters:
+    context (ContextTypes.DEFAULT_TYPE): The handler context.
+    chat_id (int): Where to ask.
+    payment_info (dict): The payment, with 'recipient', 'recipients' (one
+        amount each) or 'amounts' (an amount per username).
+    """
+    # The assistant's amounts are checked too, so a bad one is explained now rather than failing after 'Yes'
+    for amount in (payment_info.get('amounts') or {None: payment_info.get('amount')}).values():
+        error = amount_error(amount)
+        if error:
+            await outbox.send(chat_id, error)
+            return
+
+    if payment_info.get('amounts'):
+        recipient_line = "".join(
+            f"@{username}: {amount} {payment_info['currency']}\n" for username, amount in payment_info['amounts'].items()
+        )
+        total = sum(Decimal(str(amount)) for amount in payment_info['amounts'].values())
+        amount_line = f"Total: {total} {payment_info['currency']}\n"
+    elif payment_info.get('recipients'):
+        recipient_line = f"Recipients: {', '.join(payment_info['recipients'])}\n"
+        amount_line = f"Amount: {payment_info['amount']} {payment_info['currency']} each\n"
+    else:
+        recipient_line = f"Recipient: {payment_info['recipient']}\n"
+        amount_line = f"Amount: {payment_info['amount']} {payment_info['currency']}\n"
+    confirmation_message = (
+        f"I understood the following payment information:\n"
+        f"Action: {payment_info['action']}\n"
+        f"{amount_line}"
+        f"{recipient_line}"
+        f"Is this correct? Please reply with 'Yes' or 'No'."
+    )
+    await outbox.send(chat_id, confirmation_message)
+    
+    # Set the conversation state to wait for confirmation
+    context.user_data['awaiting_confirmation'] = True
+    context.user_data['payment_info'] = payment_info
+    # Identifies this prompt; payments confirming it share one idempotency key
+    context.user_data['confirmation_id'] = uuid.uuid4().hex
+
+def clear_confirmation(context):
+    """
+    Ends the wait for a confirmation.
+
+    Returns:
+    tuple: The pending payment information and the prompt's confirmation id.
+    """
+    context.user_data.pop('awaiting_confirmation', None)
+    return context.user_data.pop('payment_info', None), context.user_data.pop('confirmation_id', None)
+
+async def payout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /payout @alice 5 @bob 12.5 ... sends a different amount to each
+    recipient once the user confirms it.
+    """
+    args = context.args or []
+    amounts = {}
+    if not args or len(args) % 2:
+        await outbox.send(update.effective_chat.id, "Usage: /payout @user amount [@user amount ...]")
+        return
+    for username, amount in zip(args[::2], args[1::2]):
+        error = amount_error(amount)
+        if error:
+            await outbox.send(update.effective_chat.id, f"{username}: {error}\nUsage: /payout @user amount [@user amount ...]")
+            return
+        amount = float(amount)
+        amounts[username.lstrip('@')] = int(amount) if amount.is_integer() else amount
+
+    # Paid like any other payment, once the user answers 'Yes'
+    await send_confirmation_message(
+        context, update.effective_chat.id, {"action": "send", "amounts": amounts, "currency": "XRP"}
+    )
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle voice messages."""
     # Get the voice message file ID
     voice_file_id = update.message.voice.file_id
     voice_file = await context.bot.get_file(voice_file_id)
-    # Specify the path in the current directory with the appropriate extension
-    voice_file_path = os.path.join(".", f"{voice_file_id}.ogg")
-    
-    # Download the file to the current directory
-    await voice_file.download_to_drive(voice_file_path)
 
-    transcribed_text = convert_audio_to_text(voice_file_path)
+    # Download the voice note into memory; it is decoded without a temp file
+    audio = await voice_file.download_as_bytearray()
+    transcribed_text = await transcribe_voice(bytes(audio))
     print(transcribed_text)
     # Send a response to the user
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="I received your voice message!")
+    await outbox.send(update.effective_chat.id, "I received your voice message!")
 
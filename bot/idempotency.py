@@ -0,0 +1,158 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from pymongo import ASCENDING, errors
+from .database import wallet_repository
+from .submission import FailedSubmission, submission_engine
+from .config import PAYMENT_IDEMPOTENCY_TTL_SECONDS
+
+
+def payment_idempotency_key(user_id, confirmation_id, payment_info):
+    """
+    Derives a payment's idempotency key from the confirmation it answers, so
+    confirming the same prompt twice maps to the same key while a new prompt
+    for an identical payment gets a new one.
+    """
+    material = json.dumps(
+        {"user_id": user_id, "confirmation_id": confirmation_id, "payment": payment_info},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class IdempotentPayments:
+    """
+    Records payment results under idempotency keys in a `payments`
+    collection next to the wallets.
+
+    A key is claimed with a single insert before anything is submitted. If
+    the key already exists the earlier result is returned instead, or, if
+    that payment is still running, a failure saying so. Successful results
+    are kept. A failure releases the key for a retry only when it is
+    definite, i.e. the payment was rejected before reaching a ledger or
+    failed in one. A payment whose outcome is unknown (a lost submit
+    response, an expiry without a final lookup, an exception) stays marked
+    "unknown" with its transaction hash; the next claim of the key looks
+    the transaction up and settles it before anything is paid again.
+    Records expire after PAYMENT_IDEMPOTENCY_TTL_SECONDS.
+    """
+
+    def __init__(self, repository=wallet_repository, collection_name="payments", ttl=PAYMENT_IDEMPOTENCY_TTL_SECONDS,
+                 engine=submission_engine):
+        self.repository = repository
+        self.collection_name = collection_name
+        self.ttl = ttl
+        self.engine = engine
+        self.stats = {"claimed": 0, "replayed": 0, "in_progress": 0, "unknown": 0, "settled": 0}
+
+    @property
+    def collection(self):
+        return self.repository.database[self.collection_name]
+
+    async def ensure_indexes(self):
+        try:
+            await self.collection.create_index(
+                [("created_at", ASCENDING)], expireAfterSeconds=self.ttl, name="created_at_ttl"
+            )
+        except errors.PyMongoError as e:
+            print(f"Could not create payment indexes: {e}")
+
+    async def claim(self, key):
+        """
+        Returns:
+        tuple: (True, None) if the key was free and is now claimed, or
+               (False, result) with the earlier result for a repeated key.
+        """
+        try:
+            await self.collection.insert_one({"_id": key, "status": "pending", "created_at": datetime.now(timezone.utc)})
+            self.stats["claimed"] += 1
+            return True, None
+        except errors.DuplicateKeyError:
+            pass
+
+        record = await self.collection.find_one({"_id": key})
+        if record and record.get("status") == "unknown":
+            record = await self._settle(key, record)
+            if record is None:
+                # The earlier attempt definitely failed, so this one may pay
+                return await self.claim(key)
+        if record and record.get("status") == "done":
+            self.stats["replayed"] += 1
+            return False, record["result"]
+        if record and record.get("status") == "unknown":
+            self.stats["unknown"] += 1
+            return False, FailedSubmission(
+                "an earlier attempt at this payment hasn't been confirmed yet; "
+                "check your balance before sending it again", definite=False,
+            )
+        self.stats["in_progress"] += 1
+        return False, "Submit failed: this payment is already being processed"
+
+    async def _settle(self, key, record):
+        """
+        Looks up the transaction behind an "unknown" record.
+
+        Returns:
+        dict: The record, updated if the payment turned out to succeed.
+        None: If the payment definitely failed; the key is released.
+        """
+        if not record.get("tx_hash"):
+            return record
+        outcome = await self.engine.lookup(record["tx_hash"], record.get("last_ledger_sequence"))
+        if outcome is None:
+            return record
+        self.stats["settled"] += 1
+        if isinstance(outcome, FailedSubmission):
+            await self.collection.delete_one({"_id": key, "status": "unknown"})
+            return None
+        await self.collection.update_one({"_id": key}, {"$set": {"status": "done", "result": outcome}})
+        return dict(record, status="done", result=outcome)
+
+    async def complete(self, key, result):
+        """
+        Stores a successful result, releases the key after a definite
+        failure and marks it "unknown" otherwise.
+        """
+        try:
+            if isinstance(result, str) and result.startswith("Submit failed:"):
+                if getattr(result, "definite", True):
+                    await self.collection.delete_one({"_id": key})
+                else:
+                    await self._mark_unknown(key, result)
+            else:
+                await self.collection.update_one({"_id": key}, {"$set": {"status": "done", "result": result}})
+        except Exception as e:
+            print(f"Error while recording payment {key}: {e}")
+
+    async def _mark_unknown(self, key, result=None):
+        await self.collection.update_one({"_id": key}, {"$set": {
+            "status": "unknown",
+            "error": str(result) if result is not None else None,
+            "tx_hash": getattr(result, "tx_hash", None),
+            "last_ledger_sequence": getattr(result, "last_ledger_sequence", None),
+        }})
+
+    async def run(self, key, operation):
+        """
+        Runs `operation` (a coroutine function returning a send_payment
+        result) at most once per key.
+        """
+        if key is None:
+            return await operation()
+        claimed, result = await self.claim(key)
+        if not claimed:
+            return result
+        try:
+            result = await operation()
+        except Exception:
+            # Can't tell how far the payment got, so it is not released for a retry
+            try:
+                await self._mark_unknown(key)
+            except Exception as mark_error:
+                print(f"Error while recording payment {key}: {mark_error}")
+            raise
+        await self.complete(key, result)
+        return result
+
+
+idempotent_payments = IdempotentPayments()
@@ -0,0 +1,244 @@
+import asyncio
+from collections import deque
+from xrpl.asyncio.clients import AsyncWebsocketClient
+from xrpl.models.requests import AccountTx, StreamParameter, Subscribe
+from xrpl.utils import drops_to_xrp
+from .database import wallet_repository
+from .submission import submission_engine
+from .config import (
+    XRPL_WS_URL,
+    XRPL_STREAM_IDLE_SECONDS,
+    XRPL_STREAM_RECONNECT_MAX_SECONDS,
+    XRPL_STREAM_SUBSCRIBE_BATCH,
+)
+
+BACKFILL_CONCURRENCY = 8
+SEEN_HASHES = 10000
+
+
+def format_amount(amount):
+    if isinstance(amount, str):
+        return f"{drops_to_xrp(amount).normalize():f} XRP"
+    return f"{amount['value']} {amount['currency']}"
+
+
+class LedgerStream:
+    """
+    One WebSocket subscription to every account the bot manages.
+
+    Validated transactions are matched by hash to the submission engine's
+    pending transactions, and incoming payments (including ones sent from
+    outside the bot) are passed to `notify`. The ledger stream drives
+    LastLedgerSequence expiry, so pending payments need no polling while
+    the subscription is live.
+
+    On every ledger close the stream records the index it has fully seen;
+    after a reconnect or restart it replays each account's transactions
+    from that ledger with account_tx before relying on the stream again.
+    """
+
+    def __init__(self, url=XRPL_WS_URL, engine=submission_engine, repository=wallet_repository, notify=None):
+        self.url = url
+        self.engine = engine
+        self.repository = repository
+        self.notify = notify
+        # address -> {'user_id', 'username'}
+        self._accounts = {}
+        self._client = None
+        self._task = None
+        self._seen = set()
+        self._seen_order = deque()
+        # Notifications being sent, kept so the tasks aren't garbage collected
+        self._notifications = set()
+        self.resume_ledger = None
+        self.connected = False
+        self.stats = {"transactions": 0, "matched": 0, "notifications": 0, "backfilled": 0, "reconnects": 0}
+
+    @property
+    def state(self):
+        return self.repository.database["ledger_stream"]
+
+    def is_watching(self, address):
+        return address in self._accounts
+
+    def watch(self, address, user_id, username=None):
+        """
+        Adds an account to the subscription, e.g. right after registration.
+        """
+        new = address not in self._accounts
+        self._accounts[address] = {"user_id": user_id, "username": username}
+        if new and self.connected:
+            asyncio.ensure_future(self._subscribe([address]))
+
+    async def start(self, notify=None):
+        """
+        Loads the watched accounts and the resume point, then keeps the
+        subscription running in the background.
+        """
+        if notify is not None:
+            self.notify = notify
+        if not self.url:
+            print("Ledger stream disabled; payments are tracked by polling")
+            return
+
+        for record in await self.repository.get_wallet_addresses():
+            self._accounts[record["address"]] = {"user_id": record["user_id"], "username": record.get("username")}
+        try:
+            cursor = await self.state.find_one({"_id": "cursor"})
+        except Exception as e:
+            print(f"Error while loading ledger stream cursor: {e}")
+            cursor = None
+        if cursor:
+            self.resume_ledger = cursor["ledger_index"]
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """
+        Connects, subscribes and processes messages, reconnecting with
+        exponential backoff whenever the connection drops or goes quiet.
+        """
+        delay = 1
+        while True:
+            try:
+                async with AsyncWebsocketClient(self.url) as client:
+                    self._client = client
+                    await self._on_connect()
+                    delay = 1
+                    await self._consume(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ledger stream disconnected: {e}")
+            finally:
+                self._client = None
+                self.connected = False
+                self.engine.stream = None
+
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, XRPL_STREAM_RECONNECT_MAX_SECONDS)
+
+    async def _on_connect(self):
+        response = await self._client.request(Subscribe(streams=[StreamParameter.LEDGER]))
+        if not response.is_successful():
+            raise ConnectionError(f"ledger subscription failed: {response.result}")
+        await self._subscribe(list(self._accounts))
+
+        # Subscribed before backfilling, so nothing falls between the two
+        if self.resume_ledger is not None:
+            await self._backfill(self.resume_ledger)
+        if response.result.get("ledger_index"):
+            # That ledger closed before we subscribed; backfill covered it
+            await self._on_ledger_closed(response.result["ledger_index"] + 1)
+
+        self.connected = True
+        self.engine.stream = self
+
+    async def _subscribe(self, addresses):
+        for start in range(0, len(addresses), XRPL_STREAM_SUBSCRIBE_BATCH):
+            batch = addresses[start:start + XRPL_STREAM_SUBSCRIBE_BATCH]
+            response = await self._client.request(Subscribe(accounts=batch))
+            if not response.is_successful():
+                raise ConnectionError(f"account subscription failed: {response.result}")
+
+    async def _consume(self, client):
+        messages = client.__aiter__()
+        while True:
+            # Ledgers close every few seconds, so a quiet socket is a dead one
+            message = await asyncio.wait_for(messages.__anext__(), XRPL_STREAM_IDLE_SECONDS)
+            message_type = message.get("type")
+            if message_type == "ledgerClosed":
+                await self._on_ledger_closed(message["ledger_index"])
+            elif message_type == "transaction" and message.get("validated"):
+                await self._on_transaction(message["transaction"], message.get("meta", {}), message.get("ledger_index"))
+
+    async def _on_ledger_closed(self, ledger_index):
+        # The close of ledger N arrives before N's transactions, so every
+        # ledger before N has been fully seen
+        self.resume_ledger = ledger_index
+        self.engine.on_ledger_closed(ledger_index - 1)
+        try:
+            await self.state.update_one({"_id": "cursor"}, {"$set": {"ledger_index": ledger_index}}, upsert=True)
+        except Exception as e:
+            print(f"Error while saving ledger stream cursor: {e}")
+
+    async def _backfill(self, from_ledger):
+        semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+
+        async def replay(address):
+            async with semaphore:
+                marker = None
+                while True:
+                    response = await self._client.request(AccountTx(
+                        account=address, ledger_index_min=from_ledger, ledger_index_max=-1,
+                        forward=True, marker=marker,
+                    ))
+                    if not response.is_successful():
+                        print(f"Could not backfill {address}: {response.result}")
+                        return
+                    for entry in response.result.get("transactions", []):
+                        if entry.get("validated"):
+                            self.stats["backfilled"] += 1
+                            tx = entry["tx"]
+                            await self._on_transaction(tx, entry.get("meta", {}), tx.get("ledger_index"))
+                    marker = response.result.get("marker")
+                    if marker is None:
+                        return
+
+        await asyncio.gather(*(replay(address) for address in list(self._accounts)))
+
+    def _first_sighting(self, tx_hash):
+        if tx_hash in self._seen:
+            return False
+        self._seen.add(tx_hash)
+        self._seen_order.append(tx_hash)
+        if len(self._seen_order) > SEEN_HASHES:
+            self._seen.discard(self._seen_order.popleft())
+        return True
+
+    async def _on_transaction(self, tx, meta, ledger_index):
+        tx_hash = tx.get("hash")
+        if not tx_hash or not self._first_sighting(tx_hash):
+            return
+        self.stats["transactions"] += 1
+        result = meta.get("TransactionResult")
+        if self.engine.on_validated_transaction(tx_hash, result, ledger_index):
+            self.stats["matched"] += 1
+
+        recipient = self._accounts.get(tx.get("Destination"))
+        if tx.get("TransactionType") != "Payment" or result != "tesSUCCESS" or recipient is None:
+            return
+        sender = self._accounts.get(tx.get("Account"))
+        sender_name = f"@{sender['username']}" if sender and sender.get("username") else tx.get("Account")
+        amount = format_amount(meta.get("delivered_amount", tx.get("Amount")))
+        self._notify(recipient["user_id"], f"You received {amount} from {sender_name}!")
+
+    def _notify(self, user_id, text):
+        self.stats["notifications"] += 1
+        if self.notify is None:
+            print(f"Notification for {user_id}: {text}")
+            return
+        # Sent in the background, so a slow send never holds up the stream
+        task = asyncio.ensure_future(self._deliver(user_id, text))
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    async def _deliver(self, user_id, text):
+        try:
+            await self.notify(user_id, text)
+        except Exception as e:
+            print(f"Error while sending notification: {e}")
+
+
+ledger_stream = LedgerStream()
@@ -0,0 +1,226 @@
+import copy
+import itertools
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+_ids = itertools.count(1)
+
+
+def _get(doc, key):
+    for part in key.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def _match_value(value, present, condition):
+    if not isinstance(condition, dict) or not any(k.startswith("$") for k in condition):
+        return present and value == condition
+
+    for op, arg in condition.items():
+        if op == "$eq" and not (present and value == arg):
+            return False
+        if op == "$ne" and present and value == arg:
+            return False
+        if op == "$in" and not (present and value in arg):
+            return False
+        if op == "$nin" and present and value in arg:
+            return False
+        if op == "$exists" and present != bool(arg):
+            return False
+        if op == "$type" and not (present and arg == "string" and isinstance(value, str)):
+            return False
+        if op in ("$lt", "$lte", "$gt", "$gte"):
+            if not present or value is None:
+                return False
+            if op == "$lt" and not value < arg:
+                return False
+            if op == "$lte" and not value <= arg:
+                return False
+            if op == "$gt" and not value > arg:
+                return False
+            if op == "$gte" and not value >= arg:
+                return False
+    return True
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        else:
+            value, present = _get(doc, key)
+            if not _match_value(value, present, condition):
+                return False
+    return True
+
+
+def _apply_update(doc, update, inserting=False):
+    for key, value in update.get("$set", {}).items():
+        doc[key] = copy.deepcopy(value)
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+    for key, value in update.get("$inc", {}).items():
+        doc[key] = doc.get(key, 0) + value
+    if inserting:
+        for key, value in update.get("$setOnInsert", {}).items():
+            doc[key] = copy.deepcopy(value)
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    if any(projection.values()):
+        keep = {k for k, v in projection.items() if v}
+        if projection.get("_id", 1):
+            keep.add("_id")
+        return {k: copy.deepcopy(v) for k, v in doc.items() if k in keep}
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k not in projection}
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class InMemoryCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return self._docs if length is None else self._docs[:length]
+
+
+class InMemoryCollection:
+    """
+    In-process stand-in for the subset of the Motor collection API the bot
+    uses. Enforces unique indexes so code paths that rely on them behave the
+    same as against mongod. Meant for local runs, tests and benchmarks
+    (MONGO_URI=memory://).
+    """
+
+    def __init__(self, name="user_wallets"):
+        self.name = name
+        self._docs = []
+        self._unique = []
+
+    async def create_index(self, keys, unique=False, partialFilterExpression=None, **kwargs):
+        fields = [keys] if isinstance(keys, str) else [key for key, _ in keys]
+        if unique:
+            self._unique.append((fields, partialFilterExpression or {}))
+        return "_".join(fields)
+
+    def _check_unique(self, candidate, ignore=None):
+        for fields, partial in self._unique:
+            if not matches(candidate, partial):
+                continue
+            key = [_get(candidate, field)[0] for field in fields]
+            for doc in self._docs:
+                if doc is ignore or not matches(doc, partial):
+                    continue
+                if [_get(doc, field)[0] for field in fields] == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error: {dict(zip(fields, key))}")
+
+    async def find_one(self, query=None, projection=None):
+        for doc in self._docs:
+            if matches(doc, query or {}):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        return InMemoryCursor([_project(doc, projection) for doc in self._docs if matches(doc, query or {})])
+
+    async def count_documents(self, query):
+        return sum(1 for doc in self._docs if matches(doc, query))
+
+    async def insert_one(self, document):
+        doc = copy.deepcopy(document)
+        doc.setdefault("_id", next(_ids))
+        if any(existing["_id"] == doc["_id"] for existing in self._docs):
+            raise DuplicateKeyError(f"E11000 duplicate key error: {{'_id': {doc['_id']!r}}}")
+        self._check_unique(doc)
+        self._docs.append(doc)
+        document.setdefault("_id", doc["_id"])
+        return _Result(inserted_id=doc["_id"])
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self._docs:
+            if matches(doc, query):
+                updated = copy.deepcopy(doc)
+                _apply_update(updated, update)
+                self._check_unique(updated, ignore=doc)
+                doc.clear()
+                doc.update(updated)
+                return _Result(matched_count=1, modified_count=1, upserted_id=None)
+        if not upsert:
+            return _Result(matched_count=0, modified_count=0, upserted_id=None)
+
+        doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        _apply_update(doc, update, inserting=True)
+        result = await self.insert_one(doc)
+        return _Result(matched_count=0, modified_count=0, upserted_id=result.inserted_id)
+
+    async def update_many(self, query, update):
+        matched = [doc for doc in self._docs if matches(doc, query)]
+        for doc in matched:
+            await self.update_one({"_id": doc["_id"]}, update)
+        return _Result(matched_count=len(matched), modified_count=len(matched), upserted_id=None)
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=ReturnDocument.BEFORE,
+                                  projection=None):
+        for doc in self._docs:
+            if matches(doc, query):
+                before = _project(doc, projection)
+                await self.update_one({"_id": doc["_id"]}, update)
+                return _project(doc, projection) if return_document == ReturnDocument.AFTER else before
+        if upsert:
+            result = await self.update_one(query, update, upsert=True)
+            if return_document == ReturnDocument.AFTER:
+                return await self.find_one({"_id": result.upserted_id}, projection)
+        return None
+
+    async def find_one_and_delete(self, query, projection=None, sort=None):
+        candidates = [doc for doc in self._docs if matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            candidates.sort(key=lambda doc: _get(doc, key)[0], reverse=direction < 0)
+        if not candidates:
+            return None
+        self._docs.remove(candidates[0])
+        return _project(candidates[0], projection)
+
+    async def delete_one(self, query):
+        for i, doc in enumerate(self._docs):
+            if matches(doc, query):
+                del self._docs[i]
+                return _Result(deleted_count=1)
+        return _Result(deleted_count=0)
+
+    async def delete_many(self, query):
+        before = len(self._docs)
+        self._docs = [doc for doc in self._docs if not matches(doc, query)]
+        return _Result(deleted_count=before - len(self._docs))
+
+
+class InMemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = InMemoryCollection(name)
+        return self._collections[name]
@@ -0,0 +1,283 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from .config import METRICS_ENABLED, TRACE_SPANS
+
+# Latency buckets in seconds, from a cache hit up to a slow assistant run
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+trace_logger = logging.getLogger("paypaladin.trace")
+
+# Correlation id of the update being handled and the innermost open span
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    A value that goes up and down, either set directly or read from
+    `callback` at scrape time.
+    """
+
+    def __init__(self, name, help, callback=None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def render(self):
+        try:
+            value = self.callback() if self.callback is not None else self.value
+        except Exception as e:
+            print(f"Error while reading gauge {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_number(value)}"]
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> per-bucket counts (the last one is +Inf) and the sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Components that already keep a `stats` dict of running counts register
+    it with `track_stats` instead of being changed to update counters; the
+    dicts are only read when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._stats = {}
+
+    def _add(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, callback=None):
+        return self._add(Gauge(name, help, callback))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def track_stats(self, component, stats):
+        """
+        Exposes a component's stats dict (or a function returning one) as
+        paypaladin_component_events_total{component, event}.
+        """
+        self._stats[component] = stats
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+
+        name = "paypaladin_component_events_total"
+        lines += [f"# HELP {name} Running counts kept by each component", f"# TYPE {name} counter"]
+        for component, stats in list(self._stats.items()):
+            values = stats() if callable(stats) else stats
+            for event, value in list(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"{name}{_labels(('component', 'event'), (component, event))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "paypaladin_stage_duration_seconds", "Time spent in each stage of handling an update", ("stage",)
+)
+stage_errors = metrics.counter(
+    "paypaladin_stage_errors_total", "Stages that ended with an exception", ("stage",)
+)
+
+
+@contextlib.contextmanager
+def correlation(correlation_id):
+    """
+    Tags everything done inside the block, including tasks it starts, with
+    `correlation_id` (e.g. the update id) in span logs.
+    """
+    token = _correlation_id.set(correlation_id)
+    try:
+        yield correlation_id
+    finally:
+        _correlation_id.reset(token)
+
+
+def current_correlation_id():
+    return _correlation_id.get()
+
+
+class _Span:
+    __slots__ = ("stage", "attributes", "span_id", "_started", "_token")
+
+    def __init__(self, stage, attributes):
+        self.stage = stage
+        self.attributes = attributes
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        if TRACE_SPANS:
+            self.span_id = next(_span_ids)
+            self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        stage_seconds.observe(elapsed, self.stage)
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            stage_errors.inc(self.stage)
+        if TRACE_SPANS:
+            _current_span.reset(self._token)
+            parent = _current_span.get()
+            record = {
+                "correlation_id": _correlation_id.get(),
+                "span": self.stage,
+                "span_id": self.span_id,
+                "parent_id": parent.span_id if parent is not None else None,
+                "ms": round(elapsed * 1000, 3),
+            }
+            if exc_type is not None:
+                record["error"] = exc_type.__name__
+            record.update(self.attributes)
+            trace_logger.info(json.dumps(record, default=str))
+        return False
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage, **attributes):
+    """
+    Times a stage of handling an update:
+
+        with span("assistant"):
+            reply = await assistant_session.send(...)
+
+    The duration goes to the paypaladin_stage_duration_seconds histogram
+    and, with TRACE_SPANS, a JSON log line carrying the correlation id and
+    parent span. With METRICS_ENABLED off this returns a shared no-op.
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage, attributes)
+
+
+def traced(stage):
+    """
+    Decorator that runs a function, sync or async, inside `span(stage)`.
+    With METRICS_ENABLED off the function is returned unchanged.
+    """
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _Span(stage, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(stage, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,40 @@
+import asyncio
+from .database import wallet_repository
+from .wallet import derive_address
+
+
+async def backfill_wallet_addresses(repository=wallet_repository):
+    """
+    Stores the classic address on wallet records saved before addresses were
+    kept, deriving each one from its seed once. Safe to run repeatedly: only
+    records without an address are touched.
+
+    Returns:
+    int: The number of records updated.
+    """
+    collection = repository.collection
+    updated = 0
+    try:
+        cursor = collection.find(
+            {"address": {"$exists": False}, "private_key": {"$exists": True}},
+            {"private_key": 1},
+        )
+        async for record in cursor:
+            try:
+                address = derive_address(record["private_key"])
+            except Exception as e:
+                print(f"Skipping wallet {record['_id']}: {e}")
+                continue
+            await collection.update_one({"_id": record["_id"]}, {"$set": {"address": address}})
+            updated += 1
+    except Exception as e:
+        print(f"Error while backfilling wallet addresses: {e}")
+
+    if updated and hasattr(repository, "cache"):
+        repository.cache.clear()
+    print(f"Backfilled addresses for {updated} wallet(s)")
+    return updated
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_wallet_addresses())
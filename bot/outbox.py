@@ -0,0 +1,308 @@
+import asyncio
+import itertools
+import time
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from .config import (
+    OUTBOX_GLOBAL_PER_SECOND,
+    OUTBOX_CHAT_PER_SECOND,
+    OUTBOX_CHAT_BURST,
+    OUTBOX_WORKERS,
+    OUTBOX_MAX_RETRIES,
+    OUTBOX_DRAIN_SECONDS,
+)
+
+# Replies to the user's own action go ahead of notifications about others' actions
+TRANSACTIONAL = 0
+NOTIFICATION = 1
+
+# Telegram's limit for one text message; coalesced batches stay under it
+MAX_MESSAGE_LENGTH = 4096
+
+# How often buckets of chats that have gone quiet are dropped
+BUCKET_SWEEP_SECONDS = 60
+
+
+class TokenBucket:
+    """
+    Allows `rate` sends per second on average and bursts of up to
+    `capacity`. `block` closes the bucket for a while, e.g. after Telegram
+    answered with RetryAfter.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def delay(self):
+        """
+        Returns:
+        float: Seconds until a send is allowed, 0 if it is allowed now.
+        """
+        now = self._refill()
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+    @property
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity and self.blocked_until <= self.updated
+
+
+class _Outgoing:
+    __slots__ = ("text", "priority", "future", "attempts")
+
+    def __init__(self, text, priority, future):
+        self.text = text
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+
+class MessageOutbox:
+    """
+    Sends bot messages within Telegram's rate limits.
+
+    Messages are queued per chat and sent by a few workers, each send taking
+    a token from the global bucket and from the chat's own bucket. Chats
+    with a transactional message waiting are served before chats with only
+    notifications. A chat whose bucket is empty is put aside until it
+    refills rather than holding up a worker, and whatever piles up for it
+    in the meantime goes out as one message, joined in arrival order. A
+    RetryAfter from Telegram closes the chat's bucket for the time it asks
+    and puts the messages back at the front; network errors are retried
+    with backoff, up to `max_retries` attempts. A timed-out send is not
+    retried, since Telegram may have delivered it and a payment
+    confirmation or notice must not arrive twice; it counts as sent,
+    unconfirmed.
+
+    `send` waits until the message is delivered; `post` queues it and
+    returns straight away, for notifications the handler shouldn't wait on.
+    """
+
+    def __init__(self, global_rate=OUTBOX_GLOBAL_PER_SECOND, chat_rate=OUTBOX_CHAT_PER_SECOND,
+                 chat_burst=OUTBOX_CHAT_BURST, workers=OUTBOX_WORKERS, max_retries=OUTBOX_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.bot = None
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._swept_at = time.monotonic()
+        # chat_id -> list of _Outgoing, oldest first
+        self._pending = {}
+        # Chats queued for a worker or waiting for their bucket; chats being sent to are in _sending
+        self._scheduled = set()
+        self._sending = set()
+        self._ready = None
+        self._idle = None
+        self._tasks = []
+        self._seq = itertools.count()
+        self.stats = {"queued": 0, "sent": 0, "coalesced": 0, "retries": 0, "failed": 0, "unconfirmed": 0}
+
+    async def start(self, bot):
+        """
+        Starts the send workers on the running loop.
+        """
+        self.bot = bot
+        self._ready = asyncio.PriorityQueue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=OUTBOX_DRAIN_SECONDS):
+        """
+        Waits up to `timeout` seconds for queued messages to go out, then
+        stops the workers.
+        """
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Dropping {self.queue_depth} queued message(s) after {timeout}s drain")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def queue_depth(self):
+        return sum(len(messages) for messages in self._pending.values())
+
+    async def send(self, chat_id, text, priority=TRANSACTIONAL):
+        """
+        Queues a message and waits until it is delivered.
+
+        Returns:
+        telegram.Message: The message as sent, which may include other
+                          messages to the same chat coalesced with it.
+        None: If the send timed out and may or may not have been delivered.
+        """
+        return await self._enqueue(chat_id, text, priority)
+
+    def post(self, chat_id, text, priority=NOTIFICATION):
+        """
+        Queues a message without waiting for it. Delivery failures are
+        logged.
+        """
+        future = self._enqueue(chat_id, text, priority)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Error while sending notification: {future.exception()}")
+
+    def _enqueue(self, chat_id, text, priority):
+        if self._ready is None:
+            raise RuntimeError("MessageOutbox.start() has not been called")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(chat_id, []).append(_Outgoing(text, priority, future))
+        self.stats["queued"] += 1
+        self._idle.clear()
+        if chat_id not in self._sending:
+            # Re-queued at a better priority if a transactional message joins queued notifications
+            if chat_id not in self._scheduled or priority == TRANSACTIONAL:
+                self._schedule(chat_id)
+        return future
+
+    def _schedule(self, chat_id, delay=0.0):
+        self._scheduled.add(chat_id)
+        priority = min(message.priority for message in self._pending[chat_id])
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._push, chat_id, priority)
+        else:
+            self._push(chat_id, priority)
+
+    def _push(self, chat_id, priority):
+        self._ready.put_nowait((priority, next(self._seq), chat_id))
+
+    def _bucket(self, chat_id):
+        if time.monotonic() - self._swept_at > BUCKET_SWEEP_SECONDS:
+            self._sweep_buckets()
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _sweep_buckets(self):
+        # A full, unblocked bucket behaves like a new one, so it can go once its chat is quiet
+        busy = self._scheduled | self._sending
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in busy and not self._pending.get(chat_id) and bucket.idle:
+                del self._chat_buckets[chat_id]
+        self._swept_at = time.monotonic()
+
+    async def _worker(self):
+        while True:
+            _, _, chat_id = await self._ready.get()
+            # A chat can be queued more than once; only the first entry is acted on
+            if chat_id not in self._scheduled:
+                continue
+            bucket = self._bucket(chat_id)
+            delay = bucket.delay()
+            if delay > 0:
+                self._schedule(chat_id, delay)
+                continue
+
+            self._scheduled.discard(chat_id)
+            self._sending.add(chat_id)
+            try:
+                while (delay := self._global.delay()) > 0:
+                    await asyncio.sleep(delay)
+                self._global.take()
+                bucket.take()
+                await self._send_batch(chat_id, bucket)
+            finally:
+                self._sending.discard(chat_id)
+                if self._pending.get(chat_id):
+                    self._schedule(chat_id)
+                else:
+                    self._pending.pop(chat_id, None)
+                    if not self._pending:
+                        self._idle.set()
+
+    def _take_batch(self, chat_id):
+        pending = self._pending[chat_id]
+        batch = [pending.pop(0)]
+        length = len(batch[0].text)
+        while pending and length + 2 + len(pending[0].text) <= MAX_MESSAGE_LENGTH:
+            length += 2 + len(pending[0].text)
+            batch.append(pending.pop(0))
+        return batch
+
+    async def _send_batch(self, chat_id, bucket):
+        batch = self._take_batch(chat_id)
+        try:
+            message = await self.bot.send_message(chat_id=chat_id, text="\n\n".join(m.text for m in batch))
+        except RetryAfter as e:
+            bucket.block(e.retry_after)
+            self._retry(chat_id, batch, e)
+            return
+        except BadRequest as e:
+            self._fail(batch, e)
+            return
+        except TimedOut as e:
+            # The request may have reached Telegram, so a retry could deliver it twice
+            print(f"Sending to chat {chat_id} timed out; not retried: {e}")
+            self.stats["unconfirmed"] += len(batch)
+            for outgoing in batch:
+                if not outgoing.future.done():
+                    outgoing.future.set_result(None)
+            return
+        except NetworkError as e:
+            # Connection errors before the request went out; back off before this chat is tried again
+            bucket.block(min(2 ** batch[0].attempts, 30))
+            self._retry(chat_id, batch, e)
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        self.stats["sent"] += 1
+        self.stats["coalesced"] += len(batch) - 1
+        for outgoing in batch:
+            if not outgoing.future.done():
+                outgoing.future.set_result(message)
+
+    def _retry(self, chat_id, batch, error):
+        retry = []
+        for outgoing in batch:
+            outgoing.attempts += 1
+            if outgoing.attempts >= self.max_retries:
+                self._fail([outgoing], error)
+            else:
+                retry.append(outgoing)
+        self.stats["retries"] += len(retry)
+        # Back at the front, so the chat's messages keep their order
+        self._pending[chat_id][:0] = retry
+
+    def _fail(self, batch, error):
+        self.stats["failed"] += len(batch)
+        for outgoing in batch:
+            if not outgoing.future.done():
+                outgoing.future.set_exception(error)
+
+
+outbox = MessageOutbox()
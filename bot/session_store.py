@@ -0,0 +1,310 @@
+import asyncio
+import copy
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, errors
+from telegram.ext import BasePersistence, PersistenceInput
+from .database import wallet_repository
+from .config import SESSION_STORE_BACKEND, SESSION_STORE_PATH, SESSION_TTL_SECONDS
+
+
+class SessionStore:
+    """
+    Versioned key/value store for conversation state shared by every server
+    process.
+
+    Each entry carries a version that is bumped on every write, and writes
+    are compare-and-set against the version the writer read, so a process
+    holding stale state can't overwrite a newer one. Entries expire `ttl`
+    seconds after their last write. Subclasses implement `get`,
+    `compare_and_set` and `delete`.
+    """
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self.stats = {"reads": 0, "writes": 0, "conflicts": 0}
+
+    async def get(self, key):
+        """
+        Returns:
+        tuple: (data, version). Missing or expired entries read as empty
+               data; write them back with the version returned here.
+        """
+        raise NotImplementedError
+
+    async def compare_and_set(self, key, data, expected_version):
+        """
+        Writes `data` if the entry is still at `expected_version`.
+
+        Returns:
+        bool: False if another writer got there first.
+        """
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store in a SQLite file, for several server processes on one
+    machine. Queries run on a worker thread so the event loop isn't blocked
+    by disk I/O.
+    """
+
+    def __init__(self, path=SESSION_STORE_PATH, ttl=SESSION_TTL_SECONDS):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._writes = 0
+
+    async def get(self, key):
+        self.stats["reads"] += 1
+        return await asyncio.to_thread(self._get, key)
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, version, expires_at FROM sessions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return {}, 0
+        data = json.loads(row[0]) if row[2] > time.time() else {}
+        return data, row[1]
+
+    async def compare_and_set(self, key, data, expected_version):
+        stored = await asyncio.to_thread(self._compare_and_set, key, json.dumps(data), expected_version)
+        self.stats["writes" if stored else "conflicts"] += 1
+        return stored
+
+    def _compare_and_set(self, key, data, expected_version):
+        now = time.time()
+        with self._lock, self._conn:
+            if expected_version == 0:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (key, data, version, expires_at) VALUES (?, ?, 1, ?)",
+                    (key, data, now + self.ttl),
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET data = ?, version = version + 1, expires_at = ? "
+                    "WHERE key = ? AND version = ?",
+                    (data, now + self.ttl, key, expected_version),
+                )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            return cursor.rowcount == 1
+
+    async def delete(self, key):
+        def delete():
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+        await asyncio.to_thread(delete)
+
+
+class MongoSessionStore(SessionStore):
+    """
+    Session store in a `sessions` collection of the wallet database, for
+    server processes on several machines. A TTL index removes expired
+    entries.
+    """
+
+    def __init__(self, repository=wallet_repository, collection_name="sessions", ttl=SESSION_TTL_SECONDS):
+        super().__init__(ttl)
+        self.repository = repository
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        return self.repository.database[self.collection_name]
+
+    async def ensure_indexes(self):
+        try:
+            await self.collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+        except errors.PyMongoError as e:
+            print(f"Could not create session indexes: {e}")
+
+    async def get(self, key):
+        self.stats["reads"] += 1
+        record = await self.collection.find_one({"_id": key})
+        if record is None:
+            return {}, 0
+        # The TTL monitor only runs every minute, so expiry is also checked here
+        expires_at = record["expires_at"].replace(tzinfo=timezone.utc)
+        data = record["data"] if expires_at > datetime.now(timezone.utc) else {}
+        return data, record["version"]
+
+    async def compare_and_set(self, key, data, expected_version):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        if expected_version == 0:
+            try:
+                await self.collection.insert_one({"_id": key, "data": data, "version": 1, "expires_at": expires_at})
+                stored = True
+            except errors.DuplicateKeyError:
+                stored = False
+        else:
+            result = await self.collection.update_one(
+                {"_id": key, "version": expected_version},
+                {"$set": {"data": data, "expires_at": expires_at}, "$inc": {"version": 1}},
+            )
+            stored = result.matched_count == 1
+        self.stats["writes" if stored else "conflicts"] += 1
+        return stored
+
+    async def delete(self, key):
+        await self.collection.delete_one({"_id": key})
+
+
+class SessionPersistence(BasePersistence):
+    """
+    python-telegram-bot persistence that keeps user_data in a SessionStore.
+
+    user_data is read from the store when an update for the user arrives,
+    rather than all at startup, and written back with compare-and-set
+    against the version that was read. If another process changed the entry
+    in between, the newer state is read back and this update's changes,
+    the keys it set or removed, are applied on top of it, so neither side's
+    changes are lost; keys in one of `linked_keys` are taken together.
+    Chat, bot and callback data are not persisted.
+    """
+
+    # A pending confirmation is only meaningful as a whole
+    LINKED_KEYS = (("awaiting_confirmation", "payment_info", "confirmation_id"),)
+    MERGE_ATTEMPTS = 3
+
+    def __init__(self, store, update_interval=60, linked_keys=LINKED_KEYS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.linked_keys = linked_keys
+        self._versions = {}
+        # user_id -> user_data as read, to tell which keys an update changed
+        self._read = {}
+
+    @staticmethod
+    def _key(user_id):
+        return f"user:{user_id}"
+
+    async def get_user_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        data, version = await self.store.get(self._key(user_id))
+        self._versions[user_id] = version
+        self._read[user_id] = copy.deepcopy(data)
+        user_data.clear()
+        user_data.update(data)
+
+    async def update_user_data(self, user_id, data):
+        key = self._key(user_id)
+        version = self._versions.get(user_id, 0)
+        base = self._read.get(user_id, {})
+        merged = data
+        for _ in range(self.MERGE_ATTEMPTS):
+            if await self.store.compare_and_set(key, merged, version):
+                self._versions[user_id] = version + 1
+                self._read[user_id] = copy.deepcopy(merged)
+                return
+            # Another process wrote first: apply this update's changes to what it wrote
+            newer, version = await self.store.get(key)
+            merged = self.merge(base, data, newer)
+        print(f"Session for user {user_id} kept changing in other processes; this update's changes were not saved")
+        self._versions.pop(user_id, None)
+        self._read.pop(user_id, None)
+
+    def merge(self, base, ours, theirs):
+        """
+        Applies the keys `ours` set or removed relative to `base` to
+        `theirs`.
+
+        Returns:
+        dict: The merged user_data.
+        """
+        missing = object()
+        changed = {key for key in set(base) | set(ours) if base.get(key, missing) != ours.get(key, missing)}
+        for group in self.linked_keys:
+            if changed.intersection(group):
+                changed.update(group)
+        merged = dict(theirs)
+        for key in changed:
+            if key in ours:
+                merged[key] = ours[key]
+            else:
+                merged.pop(key, None)
+        return merged
+
+    async def drop_user_data(self, user_id):
+        self._versions.pop(user_id, None)
+        self._read.pop(user_id, None)
+        await self.store.delete(self._key(user_id))
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+def create_session_store(backend=SESSION_STORE_BACKEND, path=SESSION_STORE_PATH):
+    if backend == "sqlite":
+        return SQLiteSessionStore(path)
+    if backend == "mongo":
+        return MongoSessionStore()
+    if backend == "memory":
+        return None
+    raise ValueError(f"Unknown session store backend '{backend}', expected 'sqlite', 'mongo' or 'memory'")
+
+
+def create_persistence(backend=SESSION_STORE_BACKEND):
+    """
+    Returns the Application persistence for the configured session store,
+    or None to keep conversation state in-process.
+    """
+    store = create_session_store(backend)
+    return SessionPersistence(store) if store is not None else None
@@ -0,0 +1,516 @@
+import asyncio
+import time
+from decimal import Decimal, InvalidOperation
+from xrpl.asyncio.account import get_next_valid_seq_number
+from xrpl.asyncio.clients import AsyncJsonRpcClient
+from xrpl.asyncio.ledger import get_fee, get_latest_validated_ledger_sequence
+from xrpl.asyncio.transaction import submit
+from xrpl.models.requests import AccountObjects, AccountObjectType, Tx
+from xrpl.models.transactions import Payment, TicketCreate
+from xrpl.transaction import sign
+from xrpl.utils import xrp_to_drops, XRPRangeException
+from .metrics import span, traced
+from .config import (
+    JSON_RPC_URL,
+    XRPL_MAX_TICKETS,
+    XRPL_LEDGER_OFFSET,
+    XRPL_VALIDATION_POLL_SECONDS,
+    XRPL_FEE_REFRESH_SECONDS,
+)
+
+
+class SubmissionError(Exception):
+    """
+    Raised when a transaction is rejected, fails or expires.
+
+    `definite` is False when the transaction may still be, or get, into a
+    validated ledger: the submit response was lost, or it expired without
+    a final lookup. `tx_hash` and `last_ledger_sequence` identify it so a
+    later Tx lookup can settle it.
+    """
+
+    def __init__(self, message, definite=True, tx_hash=None, last_ledger_sequence=None):
+        super().__init__(message)
+        self.definite = definite
+        self.tx_hash = tx_hash
+        self.last_ledger_sequence = last_ledger_sequence
+
+
+class FailedSubmission(str):
+    """
+    A "Submit failed: ..." payment result, carrying whether the failure is
+    definite and, if not, the transaction to look up later.
+    """
+
+    def __new__(cls, error, definite=True, tx_hash=None, last_ledger_sequence=None):
+        result = super().__new__(cls, f"Submit failed: {error}")
+        result.definite = definite
+        result.tx_hash = tx_hash
+        result.last_ledger_sequence = last_ledger_sequence
+        return result
+
+    @classmethod
+    def from_error(cls, error):
+        if isinstance(error, SubmissionError):
+            return cls(error, error.definite, error.tx_hash, error.last_ledger_sequence)
+        return cls(error)
+
+
+class PendingTransaction:
+    def __init__(self, tx_hash, account, sequence, last_ledger_sequence, future, ticket=None):
+        self.hash = tx_hash
+        self.account = account
+        self.sequence = sequence
+        self.ticket = ticket
+        self.last_ledger_sequence = last_ledger_sequence
+        self.future = future
+        self.submitted_at = time.monotonic()
+
+
+class SubmissionEngine:
+    """
+    Asynchronous XRPL transaction submission.
+
+    The next Sequence of each sending account is tracked locally, so
+    transactions are signed and submitted without re-fetching account info,
+    and several transactions from the same account can be in flight at once.
+    Batches are signed against XRPL Tickets instead, so they don't depend on
+    each other's sequence and can all be submitted in parallel.
+    Submission returns as soon as the server has accepted the transaction; a
+    background task tracks validation and resolves each transaction's future
+    once it is in a validated ledger or its LastLedgerSequence has passed.
+    """
+
+    def __init__(self, url=JSON_RPC_URL, client=None, poll_interval=XRPL_VALIDATION_POLL_SECONDS):
+        self.client = client or AsyncJsonRpcClient(url)
+        self.poll_interval = poll_interval
+        self._next_sequence = {}
+        self._account_locks = {}
+        # account -> tickets handed out and not known to be free again; the
+        # account's owned tickets are read from the ledger on every reservation
+        self._held_tickets = {}
+        self._pending = {}
+        self._fee = None
+        self._fee_fetched_at = 0.0
+        self._validated_ledger = None
+        self._validated_ledger_at = 0.0
+        self._tracker = None
+        # Set by LedgerStream while its subscription is live
+        self.stream = None
+        self.stats = {"submitted": 0, "validated": 0, "failed": 0, "expired": 0, "resyncs": 0}
+
+    def _lock(self, account):
+        if account not in self._account_locks:
+            self._account_locks[account] = asyncio.Lock()
+        return self._account_locks[account]
+
+    async def _allocate_sequence(self, account, count=1):
+        if account not in self._next_sequence:
+            self._next_sequence[account] = await get_next_valid_seq_number(account, self.client)
+        sequence = self._next_sequence[account]
+        self._next_sequence[account] = sequence + count
+        return sequence
+
+    def resync(self, account):
+        """
+        Forgets the locally tracked sequence so the next transaction from the
+        account fetches it from the ledger again.
+        """
+        if self._next_sequence.pop(account, None) is not None:
+            self.stats["resyncs"] += 1
+
+    async def _current_fee(self):
+        if self._fee is None or time.monotonic() - self._fee_fetched_at > XRPL_FEE_REFRESH_SECONDS:
+            self._fee = await get_fee(self.client)
+            self._fee_fetched_at = time.monotonic()
+        return self._fee
+
+    async def _last_ledger_sequence(self):
+        # Ledgers close every 3-4 s; an older reading could put LastLedgerSequence in the past
+        if self._validated_ledger is None or time.monotonic() - self._validated_ledger_at > 4:
+            self._set_validated_ledger(await get_latest_validated_ledger_sequence(self.client))
+        return self._validated_ledger + XRPL_LEDGER_OFFSET
+
+    def _set_validated_ledger(self, ledger_index):
+        if self._validated_ledger is None or ledger_index >= self._validated_ledger:
+            self._validated_ledger = ledger_index
+            self._validated_ledger_at = time.monotonic()
+
+    async def submit(self, transaction_fields, wallet, transaction_type=Payment):
+        """
+        Fills in Sequence, Fee and LastLedgerSequence, signs and submits a
+        transaction without waiting for validation.
+
+        Parameters:
+        transaction_fields (dict): Transaction fields other than account,
+            sequence, fee and last_ledger_sequence.
+        wallet (Wallet): The signing wallet.
+        transaction_type (type): The xrpl-py transaction model.
+
+        Returns:
+        asyncio.Future: Resolves to the validated transaction result.
+
+        Raises:
+        SubmissionError: If the server rejects the transaction outright.
+        """
+        future, _ = await self._submit_sequenced(transaction_fields, wallet, transaction_type)
+        return future
+
+    async def _submit_sequenced(self, transaction_fields, wallet, transaction_type, sequences=1):
+        account = wallet.classic_address
+        fee = await self._current_fee()
+        last_ledger_sequence = await self._last_ledger_sequence()
+
+        # Allocation and submission stay ordered per account so sequences reach the server in order
+        async with self._lock(account):
+            sequence = await self._allocate_sequence(account, sequences)
+            transaction = transaction_type(
+                account=account,
+                sequence=sequence,
+                fee=fee,
+                last_ledger_sequence=last_ledger_sequence,
+                **transaction_fields,
+            )
+            signed = sign(transaction, wallet)
+            try:
+                with span("xrpl_submit"):
+                    response = await submit(signed, self.client)
+            except Exception as e:
+                self.resync(account)
+                # The server may have received it even though the response was lost
+                raise SubmissionError(
+                    f"no response to submit ({e})", False, signed.get_hash(), last_ledger_sequence
+                ) from e
+
+        future = self._track_submission(account, sequence, last_ledger_sequence, signed.get_hash(), response)
+        return future, sequence
+
+    async def submit_with_ticket(self, transaction_fields, wallet, ticket, transaction_type=Payment):
+        """
+        Like `submit`, but consumes a reserved Ticket instead of the next
+        Sequence, so it needs no per-account ordering.
+        """
+        account = wallet.classic_address
+        fee = await self._current_fee()
+        last_ledger_sequence = await self._last_ledger_sequence()
+        transaction = transaction_type(
+            account=account,
+            sequence=0,
+            ticket_sequence=ticket,
+            fee=fee,
+            last_ledger_sequence=last_ledger_sequence,
+            **transaction_fields,
+        )
+        signed = sign(transaction, wallet)
+        try:
+            with span("xrpl_submit"):
+                response = await submit(signed, self.client)
+        except Exception as e:
+            # The ticket stays held: the server may have received the transaction and used it
+            raise SubmissionError(
+                f"no response to submit ({e})", False, signed.get_hash(), last_ledger_sequence
+            ) from e
+        return self._track_submission(account, None, last_ledger_sequence, signed.get_hash(), response, ticket)
+
+    @traced("xrpl_reserve_tickets")
+    async def reserve_tickets(self, wallet, count):
+        """
+        Takes `count` Tickets for an account, reusing ones it already owns
+        on the validated ledger first and creating the rest with a single
+        TicketCreate. Creating tickets waits for that transaction to
+        validate, i.e. one ledger close.
+
+        Returns:
+        list: Ticket sequences, each usable by exactly one transaction.
+        """
+        account = wallet.classic_address
+        held = self._held_tickets.setdefault(account, set())
+        # Held tickets the ledger no longer lists were used; ones held during the lookup may just be newer
+        previously_held = set(held)
+        owned = await self._owned_tickets(account)
+        held.difference_update(previously_held - owned)
+
+        tickets = sorted(owned - held)[:count]
+        held.update(tickets)
+        missing = count - len(tickets)
+        if missing > 0:
+            try:
+                # TicketCreate at Sequence S creates tickets S+1 .. S+missing
+                future, sequence = await self._submit_sequenced(
+                    {"ticket_count": missing}, wallet, TicketCreate, sequences=missing + 1
+                )
+                await future
+            except Exception:
+                self._release_tickets(account, tickets)
+                raise
+            created = range(sequence + 1, sequence + 1 + missing)
+            held.update(created)
+            tickets.extend(created)
+        return tickets
+
+    async def _owned_tickets(self, account):
+        try:
+            response = await self.client.request(AccountObjects(
+                account=account, type=AccountObjectType.TICKET, ledger_index="validated", limit=400
+            ))
+        except Exception as e:
+            print(f"Error while listing tickets of {account}: {e}")
+            return set()
+        if not response.is_successful():
+            # actNotFound for a new account; anything else just means new tickets get created
+            return set()
+        return {entry["TicketSequence"] for entry in response.result.get("account_objects", [])}
+
+    def _release_tickets(self, account, tickets):
+        """
+        Makes tickets available again after their transaction definitely
+        didn't use them.
+        """
+        self._held_tickets.get(account, set()).difference_update(tickets)
+
+    def _track_submission(self, account, sequence, last_ledger_sequence, tx_hash, response, ticket=None):
+        engine_result = response.result.get("engine_result", "") if response.is_successful() else ""
+        if not engine_result.startswith(("tes", "tec", "ter")):
+            # Rejected before reaching a ledger, so the sequence or ticket was not consumed
+            if ticket is None:
+                self.resync(account)
+            elif not engine_result.startswith("tef"):
+                # tef codes such as tefNO_TICKET or tefPAST_SEQ mean the ticket is already gone
+                self._release_tickets(account, [ticket])
+            self.stats["failed"] += 1
+            detail = engine_result or response.result.get("error_message") or response.result.get("error")
+            raise SubmissionError(f"{detail}: {response.result.get('engine_result_message', '')}".strip(": "))
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tx_hash] = PendingTransaction(tx_hash, account, sequence, last_ledger_sequence, future, ticket)
+        self.stats["submitted"] += 1
+        self._ensure_tracker()
+        return future
+
+    @staticmethod
+    def _drops(amount):
+        try:
+            value = Decimal(str(amount))
+            # xrp_to_drops would round a fraction of a drop away instead of refusing it
+            if value.is_finite() and value.normalize().as_tuple().exponent < -6:
+                raise XRPRangeException(f"XRP amount {amount} has more than 6 decimal places.")
+            return xrp_to_drops(value)
+        except (XRPRangeException, InvalidOperation) as e:
+            raise SubmissionError(f"invalid amount {amount}: {e}") from e
+
+    @traced("xrpl_payment")
+    async def send_payment(self, wallet, amount, destination):
+        """
+        Sends XRP and waits for the payment to validate.
+
+        Returns:
+        dict: The validated transaction ('hash', 'ledger_index', 'result').
+        FailedSubmission: "Submit failed: ..." if the payment was rejected
+             or expired, matching what send_xrp returns.
+        """
+        try:
+            future = await self.submit({"amount": self._drops(amount), "destination": destination}, wallet)
+            return await future
+        except Exception as e:
+            # Anything but a SubmissionError happened before the payment was sent
+            return FailedSubmission.from_error(e)
+
+    async def send_batch(self, wallet, payments):
+        """
+        Sends several XRP payments from one wallet in parallel.
+
+        Tickets are reserved up front (one TicketCreate for whatever isn't
+        already reserved), then every payment is signed against its own
+        ticket and submitted at once, so the batch validates in about one
+        ledger close after the tickets instead of one per payment.
+
+        Parameters:
+        wallet (Wallet): The sending wallet.
+        payments (list): (destination address, amount in XRP) pairs.
+
+        Returns:
+        list: One result per payment, in order, each as `send_payment`
+              returns it.
+        """
+        if len(payments) <= 1:
+            return [await self.send_payment(wallet, amount, destination) for destination, amount in payments]
+
+        # Amounts are converted before any ticket is reserved, so a bad one doesn't strand its ticket
+        results = [None] * len(payments)
+        valid = []
+        for index, (destination, amount) in enumerate(payments):
+            try:
+                valid.append((index, destination, self._drops(amount)))
+            except SubmissionError as e:
+                results[index] = FailedSubmission(e)
+
+        for start in range(0, len(valid), XRPL_MAX_TICKETS):
+            chunk = valid[start:start + XRPL_MAX_TICKETS]
+            try:
+                tickets = await self.reserve_tickets(wallet, len(chunk))
+            except SubmissionError as e:
+                # Nothing in the chunk was signed, so none of it can have gone through
+                for index, _, _ in chunk:
+                    results[index] = FailedSubmission(e)
+                continue
+            sent = await asyncio.gather(*(
+                self._send_with_ticket(wallet, drops, destination, ticket)
+                for (_, destination, drops), ticket in zip(chunk, tickets)
+            ))
+            for (index, _, _), result in zip(chunk, sent):
+                results[index] = result
+        return results
+
+    async def _send_with_ticket(self, wallet, drops, destination, ticket):
+        # One failed payment shouldn't lose the results of the rest of the batch
+        try:
+            future = await self.submit_with_ticket({"amount": drops, "destination": destination}, wallet, ticket)
+        except SubmissionError as e:
+            return FailedSubmission.from_error(e)
+        except Exception as e:
+            # Failed before anything was sent, so the ticket is still unused
+            self._release_tickets(wallet.classic_address, [ticket])
+            return FailedSubmission(e)
+        try:
+            return await future
+        except SubmissionError as e:
+            return FailedSubmission.from_error(e)
+
+    def on_validated_transaction(self, tx_hash, result, ledger_index):
+        """
+        Resolves a pending transaction from a validated ledger result.
+        Returns False if the hash isn't one of ours.
+        """
+        pending = self._pending.pop(tx_hash, None)
+        if pending is None:
+            return False
+        if ledger_index:
+            self._set_validated_ledger(ledger_index)
+
+        if pending.future.done():
+            return True
+        if result == "tesSUCCESS":
+            self.stats["validated"] += 1
+            pending.future.set_result({"hash": tx_hash, "ledger_index": ledger_index, "result": result})
+        else:
+            self.stats["failed"] += 1
+            pending.future.set_exception(SubmissionError(result))
+        return True
+
+    def _expire(self, validated_ledger):
+        for tx_hash, pending in list(self._pending.items()):
+            if pending.last_ledger_sequence < validated_ledger:
+                del self._pending[tx_hash]
+                asyncio.ensure_future(self._settle_expired(pending))
+
+    async def _settle_expired(self, pending):
+        # It may have validated in its last ledger after the check that expired it, so look once more
+        outcome = await self.lookup(pending.hash, pending.last_ledger_sequence)
+        if isinstance(outcome, dict):
+            self.stats["validated"] += 1
+            if not pending.future.done():
+                pending.future.set_result(outcome)
+            return
+
+        self.stats["expired"] += 1
+        if pending.ticket is None:
+            self.resync(pending.account)
+        elif outcome is not None:
+            # Settled by the ledger: either unused, or used and no longer listed as owned
+            self._release_tickets(pending.account, [pending.ticket])
+        if not pending.future.done():
+            if outcome is None:
+                error = SubmissionError(
+                    f"not validated by ledger {pending.last_ledger_sequence}",
+                    False, pending.hash, pending.last_ledger_sequence,
+                )
+            else:
+                error = SubmissionError(outcome.removeprefix("Submit failed: "))
+            pending.future.set_exception(error)
+
+    def on_ledger_closed(self, ledger_index):
+        """
+        Advances the validated ledger and expires transactions that can no
+        longer make it in. Called by the ledger stream on every close.
+        """
+        self._set_validated_ledger(ledger_index)
+        self._expire(self._validated_ledger)
+
+    def _stream_covers_pending(self):
+        return self.stream is not None and self.stream.connected and all(
+            self.stream.is_watching(pending.account) for pending in self._pending.values()
+        )
+
+    def _ensure_tracker(self):
+        if self._tracker is None or self._tracker.done():
+            self._tracker = asyncio.ensure_future(self._track_validations())
+
+    async def _track_validations(self):
+        while self._pending:
+            await asyncio.sleep(self.poll_interval)
+            if self._stream_covers_pending():
+                # The subscription resolves and expires these without polling
+                continue
+            try:
+                await self.poll_pending()
+            except Exception as e:
+                print(f"Error while tracking transactions: {e}")
+
+    async def poll_pending(self):
+        """
+        Checks every pending transaction once and expires those whose
+        LastLedgerSequence is behind the latest validated ledger.
+        """
+        # Read before the Tx lookups, so one they don't find can't be in a ledger this index covers
+        validated_ledger = await get_latest_validated_ledger_sequence(self.client)
+        hashes = list(self._pending)
+        responses = await asyncio.gather(
+            *(self.client.request(Tx(transaction=tx_hash)) for tx_hash in hashes),
+            return_exceptions=True,
+        )
+        for tx_hash, response in zip(hashes, responses):
+            if isinstance(response, Exception) or not response.is_successful():
+                continue
+            if response.result.get("validated"):
+                meta = response.result.get("meta", {})
+                self.on_validated_transaction(
+                    tx_hash, meta.get("TransactionResult"), response.result.get("ledger_index")
+                )
+
+        self._set_validated_ledger(validated_ledger)
+        self._expire(validated_ledger)
+
+    async def lookup(self, tx_hash, last_ledger_sequence):
+        """
+        Settles a transaction whose outcome wasn't known when it was sent.
+
+        Returns:
+        dict: The validated transaction if it succeeded.
+        FailedSubmission: A definite failure if it failed in a validated
+            ledger, or wasn't found although LastLedgerSequence has passed.
+        None: If it may still validate, or the lookup failed.
+        """
+        try:
+            # Read before the Tx lookup, so a transaction validating in between is found, not expired
+            validated_ledger = await get_latest_validated_ledger_sequence(self.client)
+            response = await self.client.request(Tx(transaction=tx_hash))
+        except Exception as e:
+            print(f"Error while looking up transaction {tx_hash}: {e}")
+            return None
+
+        if response.is_successful() and response.result.get("validated"):
+            result = response.result.get("meta", {}).get("TransactionResult")
+            if result == "tesSUCCESS":
+                return {"hash": tx_hash, "ledger_index": response.result.get("ledger_index"), "result": result}
+            return FailedSubmission(result)
+        not_found = not response.is_successful() and response.result.get("error") == "txnNotFound"
+        if not_found and last_ledger_sequence is not None and validated_ledger > last_ledger_sequence:
+            return FailedSubmission(f"not validated by ledger {last_ledger_sequence}")
+        return None
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+
+submission_engine = SubmissionEngine()
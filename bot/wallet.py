@@ -1,15 +1,33 @@
+from functools import lru_cache
 from xrpl.clients import JsonRpcClient
 from xrpl.wallet import Wallet, generate_faucet_wallet
 import xrpl
-from .config import JSON_RPC_URL
+from .config import JSON_RPC_URL, WALLET_DERIVATION_CACHE_SIZE
+from .metrics import traced
 
 client = JsonRpcClient(JSON_RPC_URL)
 
+@lru_cache(maxsize=WALLET_DERIVATION_CACHE_SIZE)
+def get_wallet(seed):
+    """
+    Returns the signing wallet for a seed, deriving the keys at most once
+    per seed while it stays in this bounded cache.
+    """
+    return Wallet.from_seed(seed)
+
+def derive_address(seed):
+    """
+    Derives the classic address for a seed without caching the wallet, for
+    one-off uses such as registration and migrations.
+    """
+    return Wallet.from_seed(seed).address
+
 def generate_faucet_wallet_sync(client, debug):
     return generate_faucet_wallet(client, debug=debug)
 
+@traced("send_xrp")
 def send_xrp(seed, amount, destination):
-    sending_wallet = Wallet.from_seed(seed)
+    sending_wallet = seed if isinstance(seed, Wallet) else get_wallet(seed)
     payment = xrpl.models.transactions.Payment(
         account=sending_wallet.address,
         amount=xrpl.utils.xrp_to_drops(int(amount)),
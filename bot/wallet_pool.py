@@ -0,0 +1,143 @@
+import asyncio
+import time
+from xrpl.asyncio.clients import AsyncJsonRpcClient
+from xrpl.asyncio.wallet import generate_faucet_wallet
+from .database import wallet_repository
+from .config import JSON_RPC_URL, WALLET_POOL_SIZE, WALLET_POOL_LOW_WATERMARK, WALLET_POOL_FAUCET_PER_MINUTE
+
+
+class WalletPool:
+    """
+    Wallets generated and funded ahead of time, so registering a user is a
+    single atomic claim instead of several seconds of faucet calls.
+
+    Pool records ({'private_key', 'address', 'created_at'}) live in their
+    own collection next to the user wallets. `claim` removes one with
+    find_one_and_delete, so concurrent registrations never get the same
+    wallet; if the wallet can't be saved to the user, `release` puts it
+    back. A background task refills the pool to `size`, spacing faucet
+    calls to stay under `per_minute`, and warns when fewer than
+    `low_watermark` wallets are left.
+    """
+
+    def __init__(self, repository=wallet_repository, size=WALLET_POOL_SIZE,
+                 low_watermark=WALLET_POOL_LOW_WATERMARK, per_minute=WALLET_POOL_FAUCET_PER_MINUTE,
+                 client=None, collection_name="wallet_pool"):
+        self.repository = repository
+        self.size = size
+        self.low_watermark = low_watermark
+        self.interval = 60 / per_minute if per_minute > 0 else 0
+        self.client = client or AsyncJsonRpcClient(JSON_RPC_URL)
+        self.collection_name = collection_name
+        self._task = None
+        self._wake = None
+        self._last_faucet_call = 0.0
+        self._warned = False
+        self.stats = {"claimed": 0, "released": 0, "empty": 0, "generated": 0, "faucet_errors": 0}
+
+    @property
+    def collection(self):
+        return self.repository.database[self.collection_name]
+
+    async def claim(self):
+        """
+        Takes a funded wallet out of the pool.
+
+        Returns:
+        dict: The pool record ('private_key', 'address'), or None if the
+              pool is empty or disabled and the caller has to use the faucet.
+        """
+        if self.size <= 0:
+            return None
+        try:
+            record = await self.collection.find_one_and_delete({}, sort=[("created_at", 1)])
+        except Exception as e:
+            print(f"Error while claiming a pooled wallet: {e}")
+            record = None
+
+        self.stats["claimed" if record else "empty"] += 1
+        if self._wake is not None:
+            self._wake.set()
+        return record
+
+    async def release(self, record):
+        """
+        Puts a funded wallet into the pool, e.g. when saving it to the user
+        failed, so its funding isn't lost. A claimed wallet goes back at its
+        original place in the claim order.
+
+        Parameters:
+        record (dict): The record returned by `claim`, or one in the same
+            shape for a wallet funded straight from the faucet.
+        """
+        try:
+            await self.collection.insert_one(
+                {key: record[key] for key in ("private_key", "address", "created_at") if key in record}
+            )
+            self.stats["released"] += 1
+        except Exception as e:
+            print(f"Error while returning wallet {record.get('address')} to the pool: {e}")
+
+    async def available(self):
+        return await self.collection.count_documents({})
+
+    async def start(self):
+        if self.size <= 0:
+            print("Wallet pool disabled; /register will use the faucet directly")
+            return
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self.replenish())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def replenish(self):
+        """
+        Keeps the pool at `size`, sleeping until a claim wakes it up.
+        """
+        while True:
+            try:
+                available = await self.available()
+                self._check_watermark(available)
+                if available >= self.size:
+                    self._wake.clear()
+                    await self._wake.wait()
+                    continue
+                await self._add_wallet()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["faucet_errors"] += 1
+                print(f"Error while replenishing the wallet pool: {e}")
+                # Back off so a failing faucet isn't hammered
+                await asyncio.sleep(max(self.interval, 5))
+
+    def _check_watermark(self, available):
+        if available < self.low_watermark:
+            if not self._warned:
+                print(f"Warning: wallet pool is low ({available}/{self.size} funded wallets left)")
+                self._warned = True
+        else:
+            self._warned = False
+
+    async def _add_wallet(self):
+        wait = self._last_faucet_call + self.interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_faucet_call = time.monotonic()
+
+        wallet = await generate_faucet_wallet(self.client)
+        await self.collection.insert_one(
+            {"private_key": wallet.seed, "address": wallet.address, "created_at": time.time()}
+        )
+        self.stats["generated"] += 1
+
+
+wallet_pool = WalletPool()
@@ -1,29 +1,28 @@
 from flask import Flask, request
 from telegram import Update, Bot
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from xrpl.wallet import Wallet
 import asyncio
 import os
+import signal
+import sys
 from dotenv import load_dotenv
-from xrpl.clients import JsonRpcClient
-from bot import create_mongo_connection, get_user_wallet, get_user_wallet_by_username, save_user_wallet, generate_faucet_wallet_sync, send_xrp, start, echo, status, send
-from assistant.audio_processing import convert_audio_to_text
-from assistant.assistant_manager import initialize_client, add_message_to_thread
+from bot import TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL, ensure_indexes, backfill_wallet_addresses, get_user_wallets, ensure_wallet_address, save_user_wallet, generate_faucet_wallet_sync, get_wallet, submission_engine, ledger_stream, wallet_pool, UpdateDispatcher, outbox, idempotent_payments, payment_idempotency_key, create_persistence, metrics, span, correlation, METRICS_CONTENT_TYPE, wallet_repository, start, echo, status, send, pay_many, payout, send_confirmation_message, clear_confirmation
+from assistant.batching import transcribe_voice
+from assistant.transcription import transcription_service
+from assistant.config import VOICE_DISK_FALLBACK_BYTES
+from assistant.thread_registry import thread_registry
+from assistant.intent_parser import parse_payment_command, parse_confirmation, InvalidAmountError, get_hit_rate, intent_parser_stats
+from assistant.assistant_manager import assistant_session, AssistantRunError
 from telegram.error import NetworkError, TelegramError
 from tenacity import retry, stop_after_attempt, wait_exponential
 import logging
-from openai import OpenAI
 import json
-import time
-from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configuration
-JSON_RPC_URL = "https://s.altnet.rippletest.net:51234/"
-client = JsonRpcClient(JSON_RPC_URL)
-TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Configuration; the XRPL endpoints are read by bot.config
+TOKEN = TELEGRAM_BOT_TOKEN
 
 # Set up logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -33,14 +32,16 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 # Initialize the bot with your token
-bot = Bot(token=TOKEN)
+bot = Bot(token=TOKEN, base_url=TELEGRAM_API_URL, base_file_url=TELEGRAM_FILE_URL)
 
-# Create a new event loop
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+# Conversation state lives in the shared session store, so any server process can handle any user
+persistence = create_persistence()
 
 # Initialize the application
-application = Application.builder().token(TOKEN).build()
+builder = Application.builder().token(TOKEN).base_url(TELEGRAM_API_URL).base_file_url(TELEGRAM_FILE_URL)
+if persistence is not None:
+    builder = builder.persistence(persistence)
+application = builder.build()
 
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
@@ -54,160 +55,147 @@ async def download_voice_file(context, voice_file, voice_file_path):
         print(f"Error downloading voice file: {e}")
         raise
 
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+async def download_voice_to_memory(voice_file):
+    try:
+        return await voice_file.download_as_bytearray()
+    except asyncio.CancelledError:
+        # If the task was cancelled, we need to re-raise this specific error
+        raise
+    except Exception as e:
+        print(f"Error downloading voice file: {e}")
+        raise
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle both voice and text messages with improved error handling."""
     try:
 
-        transcribed_text = await process_message(update, context)
+        with span("process_message"):
+            transcribed_text = await process_message(update, context)
         if transcribed_text is None:
             return
+
+        # A pending confirmation is settled by this message whatever it says, so it never pays twice
+        pending_intent = None
+        if context.user_data.get('awaiting_confirmation'):
+            pending_intent, confirmation_id = clear_confirmation(context)
+            answer = parse_confirmation(transcribed_text)
+            if pending_intent and answer:
+                await execute_payment(update, context, pending_intent, confirmation_id)
+                return
+            if answer is False:
+                await outbox.send(update.effective_chat.id, "Okay, I cancelled that payment.")
+                return
+            # Anything else is a new or corrected command and replaces the pending payment
+
+        # Formulaic commands are parsed locally and skip the assistant round-trip
+        try:
+            with span("intent_parse"):
+                payment_info = parse_payment_command(transcribed_text)
+        except InvalidAmountError as e:
+            await outbox.send(update.effective_chat.id, str(e))
+            return
+        if payment_info:
+            print(f"Parsed locally (fast-path hit rate {get_hit_rate():.0%}): {payment_info}")
+            await send_confirmation_message(context, update.effective_chat.id, payment_info)
+            return
     
-        client, assistant_id, _ = initialize_client()
-        thread_file = "thread_id.json"
-
-        if os.path.exists(thread_file):
-            with open(thread_file, "r") as file:
-                user_data = json.load(file)
-            
-            if str(update.effective_user.id) in user_data:
-                thread_id = user_data[str(update.effective_user.id)]["thread_id"]
-                thread = client.beta.threads.retrieve(thread_id=thread_id)
-            else:
-                thread = client.beta.threads.create()
-                user_data[str(update.effective_user.id)] = {
-                    "thread_id": thread.id,
-                    "username": update.effective_user.username
-                }
-        else:
-            thread = client.beta.threads.create()
-            user_data = {
-                str(update.effective_user.id): {
-                    "thread_id": thread.id,
-                    "username": update.effective_user.username
-                }
-            }
-
-        with open(thread_file, "w") as file:
-            json.dump(user_data, file)     
-            
-        # Add user message to thread
-        add_message_to_thread(client, thread, transcribed_text)
-    
-        run = client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=assistant_id
-        )
-         # Poll for the response (this could be improved with async calls)
-        while True:
-            run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-            print(run.status)
-            if run.status == "completed":
-                break
-            time.sleep(1)
-
-        messages = client.beta.threads.messages.list(thread_id=thread.id)
-        assistant_message = messages.dict()["data"][0]["content"][0]["text"]["value"]
-        
+        # One pooled client per process; the user's thread is created only on first contact
+        try:
+            assistant_runs_in_flight.inc()
+            try:
+                with span("assistant"):
+                    assistant_message = await assistant_session.send(
+                        update.effective_user.id, update.effective_user.username, transcribed_text, pending_intent
+                    )
+            finally:
+                assistant_runs_in_flight.dec()
+        except AssistantRunError as e:
+            print(f"Assistant run did not complete: {e}")
+            assistant_message = None
+
         if assistant_message:
-            if context.user_data.get('awaiting_confirmation') and context.user_data.get('payment_info'):
-                # TODO: Send transaction with payment info
-                payment_info = context.user_data.get('payment_info')
-                # Check if is send or request payment
-                if payment_info['action'] == 'send':
-                    # TODO: Send transaction with payment info
-                    # if recipient is not set up reply else send the funds
-                    user_data = get_user_wallet(update.effective_user.id)
-                    recipient_data = get_user_wallet_by_username(payment_info["recipient"][1:])
-                    
-                    if recipient_data:
-                        recipient_wallet = Wallet.from_seed(recipient_data['private_key']) 
-                        user_wallet = Wallet.from_seed(user_data['private_key']) 
-                        loop = asyncio.get_event_loop()
-                        with ThreadPoolExecutor() as pool:
-                            response = await loop.run_in_executor(
-                                pool, send_xrp, user_wallet.seed, payment_info["amount"],recipient_wallet.address
-                            )
-
-                        # Check if the response is an error message or a successful transaction result
-                        if isinstance(response, str) and response.startswith("Submit failed:"):
-                            await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
-                        else:
-                            
-                            await context.bot.send_message(chat_id=update.effective_chat.id, text="XRP sent successfully!")
-                            # Send a message to another user as well
-                            await context.bot.send_message(chat_id=recipient_data['user_id'], text="XRP received successfully!")                        
-                    else:        
-                        await context.bot.send_message(chat_id=update.effective_chat.id, text="Recipient is not registered yet")
-                    pass
-                elif payment_info['action'] == 'request':
-                    user_data = get_user_wallet(update.effective_user.id)
-                    recipient_data = get_user_wallet_by_username(payment_info["recipient"][1:])
-                    if recipient_data:
-                        await context.bot.send_message(chat_id=recipient_data['user_id'], text=f"{user_data["username"]} is requesting Amount: {payment_info['amount']} {payment_info['currency']} from you\n")                        
-                    else:        
-                        await context.bot.send_message(chat_id=update.effective_chat.id, text="Recipient is not registered yet")
-                    pass
+            validation_result = validate_response(assistant_message)
+            payment_info = extract_json_from_response(assistant_message) if validation_result["valid"] else None
+            if payment_info:
+                await send_confirmation_message(context, update.effective_chat.id, payment_info)
             else:
-                validation_result = validate_response(assistant_message)
-                if validation_result["valid"]:
-                    payment_info = extract_json_from_response(assistant_message)
-                    await send_confirmation_message(context, update.effective_chat.id, payment_info)
-                else:
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=assistant_message
-                    )
+                await outbox.send(update.effective_chat.id, assistant_message)
         else:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="I'm sorry, but I couldn't process your request. Can you please try again?"
-            )
+            await outbox.send(update.effective_chat.id, "I'm sorry, but I couldn't process your request. Can you please try again?")
 
     except NetworkError as e:
         print(f"NetworkError occurred: {e}")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="I'm experiencing network issues. Please try sending your message again in a few moments."
-        )
+        await outbox.send(update.effective_chat.id, "I'm experiencing network issues. Please try sending your message again in a few moments.")
     except TelegramError as e:
         print(f"TelegramError occurred: {e}")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="An error occurred while processing your message. Please try again later."
-        )
+        await outbox.send(update.effective_chat.id, "An error occurred while processing your message. Please try again later.")
     except Exception as e:
         print(f"Unexpected error occurred: {e}")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="An unexpected error occurred. Please try again later."
+        await outbox.send(update.effective_chat.id, "An unexpected error occurred. Please try again later.")
+
+async def execute_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, payment_info, confirmation_id):
+    """
+    Carries out a payment the user has just confirmed.
+
+    Parameters:
+    payment_info (dict): The confirmed payment information.
+    confirmation_id (str): Id of the prompt that was confirmed; payments for
+                           it share one idempotency key.
+    """
+    # Check if is send or request payment
+    if payment_info['action'] == 'send' and (payment_info.get('recipients') or payment_info.get('amounts')):
+        # Several recipients go out as one ticketed batch with a single summary
+        amounts = payment_info.get('amounts') or {recipient[1:]: payment_info['amount'] for recipient in payment_info['recipients']}
+        key = payment_idempotency_key(update.effective_user.id, confirmation_id, payment_info)
+        await pay_many(context, update.effective_chat.id, update.effective_user.id, amounts, key)
+    elif payment_info['action'] == 'send':
+        # if recipient is not set up reply else send the funds
+        # Sender and recipient are resolved in one round-trip
+        recipient_username = payment_info["recipient"][1:]
+        user_data, recipients = await get_user_wallets(update.effective_user.id, [recipient_username])
+        recipient_data = recipients.get(recipient_username)
+        
+        # Older records without an address get it derived from their seed
+        if recipient_data and await ensure_wallet_address(recipient_data):
+            # Pay the stored address; the sender's keys are derived at most once per seed
+            user_wallet = get_wallet(user_data['private_key'])
+            # Submitted with a locally tracked sequence; validation resolves in the background.
+            # A redelivered confirmation returns this result instead of paying twice.
+            key = payment_idempotency_key(update.effective_user.id, confirmation_id, payment_info)
+            with span("payment"):
+                response = await idempotent_payments.run(key, lambda: submission_engine.send_payment(
+                    user_wallet, payment_info["amount"], recipient_data['address']
+                ))
+
+            # Check if the response is an error message or a successful transaction result
+            if isinstance(response, str) and response.startswith("Submit failed:"):
+                await outbox.send(update.effective_chat.id, response)
+            else:
+                
+                await outbox.send(update.effective_chat.id, "XRP sent successfully!")
+                # The ledger stream tells the recipient when it's live; otherwise tell them here
+                if not ledger_stream.connected:
+                    outbox.post(recipient_data['user_id'], "XRP received successfully!")                        
+        else:        
+            await outbox.send(update.effective_chat.id, "Recipient is not registered yet")
+    elif payment_info['action'] == 'request':
+        # Only profile fields are needed here, so cached records without keys will do
+        recipient_username = payment_info["recipient"][1:]
+        user_data, recipients = await get_user_wallets(
+            update.effective_user.id, [recipient_username], need_secret=False
         )
+        recipient_data = recipients.get(recipient_username)
+        if recipient_data:
+            outbox.post(recipient_data['user_id'], f"{user_data['username']} is requesting Amount: {payment_info['amount']} {payment_info['currency']} from you\n")                        
+        else:        
+            await outbox.send(update.effective_chat.id, "Recipient is not registered yet")
 
 # In your main application setup
 def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log Errors caused by Updates."""
+    # The dispatcher's loop is shared by every update and background task, so it is never restarted here
     logger.warning('Update "%s" caused error "%s"', update, context.error)
-    if isinstance(context.error, NetworkError):
-        # Attempt to restart the event loop
-        try:
-            asyncio.get_event_loop().close()
-            asyncio.set_event_loop(asyncio.new_event_loop())
-            logger.info("Event loop restarted due to NetworkError")
-        except Exception as e:
-            logger.error(f"Failed to restart event loop: {e}")
-
-async def send_confirmation_message(context, chat_id, payment_info):
-    confirmation_message = (
-        f"I understood the following payment information:\n"
-        f"Action: {payment_info['action']}\n"
-        f"Amount: {payment_info['amount']} {payment_info['currency']}\n"
-        f"Recipient: {payment_info['recipient']}\n"
-        f"Is this correct? Please reply with 'Yes' or 'No'."
-    )
-    await context.bot.send_message(chat_id=chat_id, text=confirmation_message)
-    
-    # Set the conversation state to wait for confirmation
-    context.user_data['awaiting_confirmation'] = True
-    context.user_data['payment_info'] = payment_info
 
 def validate_response(assistant_response):
     """
@@ -248,28 +236,35 @@ def extract_json_from_response(assistant_response):
 async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message.voice:
             # Handle voice message
-            voice_file_id = update.message.voice.file_id
-            voice_file = await context.bot.get_file(voice_file_id)
-            voice_file_path = os.path.join(".", f"{voice_file_id}.ogg")
-            
-            # Download the file to the current directory with retry logic
-            await download_voice_file(context, voice_file, voice_file_path)
-
-            transcribed_text = convert_audio_to_text(voice_file_path)
+            voice = update.message.voice
+            voice_file = await context.bot.get_file(voice.file_id)
 
-            # Clean up the downloaded file
-            if os.path.exists(voice_file_path):
-                os.remove(voice_file_path)
+            if VOICE_DISK_FALLBACK_BYTES and (voice.file_size or 0) > VOICE_DISK_FALLBACK_BYTES:
+                # Opt-in: spool very large clips to disk instead of holding them in memory
+                voice_file_path = os.path.join(".", f"{voice.file_id}.ogg")
+                with span("voice_download"):
+                    await download_voice_file(context, voice_file, voice_file_path)
+                try:
+                    with span("transcribe"):
+                        transcribed_text = await transcribe_voice(voice_file_path)
+                finally:
+                    # Clean up the downloaded file
+                    if os.path.exists(voice_file_path):
+                        os.remove(voice_file_path)
+            else:
+                # Download into memory with retry logic; the bytes are piped to an async ffmpeg subprocess here, not written to disk
+                with span("voice_download"):
+                    audio = await download_voice_to_memory(voice_file)
+                # Trimmed, chunked and batched with concurrent voice notes on the worker pool
+                with span("transcribe"):
+                    transcribed_text = await transcribe_voice(bytes(audio))
 
         elif update.message.text:
             # Handle text message
             transcribed_text = update.message.text
         else:
             # Unsupported message type
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Unsupported message type. Please send either a text or voice message."
-            )
+            await outbox.send(update.effective_chat.id, "Unsupported message type. Please send either a text or voice message.")
             return None
 
         return transcribed_text
@@ -278,28 +273,125 @@ async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 application.add_handler(CommandHandler('start', start))
 application.add_handler(CommandHandler('register', status))
 application.add_handler(CommandHandler('send', send))
+application.add_handler(CommandHandler('payout', payout))
 application.add_handler(MessageHandler(filters.TEXT | filters.VOICE, handle_message))
 application.add_error_handler(error_handler)
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    async def process_update():
+async def process_update(payload):
+    # Spans logged while handling this update carry its id
+    with correlation(payload.get("update_id")), span("update"):
         # Deserialize the incoming update
-        update = Update.de_json(request.get_json(force=True), bot)
-        
+        update = Update.de_json(payload, bot)
+
         # Process the update with the application
         await application.process_update(update)
 
-    loop.run_until_complete(process_update())
+        # Write the user's state back now rather than on a timer, so the next update can go to any process
+        with span("persist_session"):
+            await application.update_persistence()
+
+# Updates run on one long-lived loop with a bounded pool of workers
+dispatcher = UpdateDispatcher(process_update)
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    # Acknowledge at once; processing happens on the dispatcher's workers
+    if not dispatcher.submit(request.get_json(force=True)):
+        # Full or draining: a non-2xx reply makes Telegram redeliver later
+        return "busy", 503
     return "ok", 200
 
-def run_app():
+@app.route('/stats', methods=['GET'])
+def stats():
+    # Queue depth, open lanes and queue wait times of the update dispatcher
+    return dispatcher.metrics(), 200
+
+# Gauges are read when /metrics is scraped; the components' own stats dicts are exported as counts
+assistant_runs_in_flight = metrics.gauge("paypaladin_assistant_runs_in_flight", "Assistant runs in progress")
+metrics.gauge("paypaladin_update_queue_depth", "Updates waiting for a worker", lambda: dispatcher.queue_depth)
+metrics.gauge("paypaladin_update_lanes_open", "Users with updates queued or running", lambda: dispatcher.metrics()["open_lanes"])
+metrics.gauge("paypaladin_outbox_queue_depth", "Bot messages waiting to be sent", lambda: outbox.queue_depth)
+metrics.gauge("paypaladin_xrpl_transactions_in_flight", "Submitted transactions not yet validated", lambda: submission_engine.in_flight)
+metrics.gauge("paypaladin_ledger_stream_connected", "1 while the ledger stream subscription is live", lambda: int(ledger_stream.connected))
+metrics.gauge("paypaladin_intent_parser_hit_ratio", "Share of messages parsed without the assistant", get_hit_rate)
+if hasattr(wallet_repository, "cache"):
+    metrics.gauge("paypaladin_wallet_cache_hit_ratio", "Share of wallet lookups served from the cache", lambda: wallet_repository.cache.hit_rate)
+    metrics.track_stats("wallet_cache", wallet_repository.cache.stats)
+metrics.track_stats("dispatcher", dispatcher.stats)
+metrics.track_stats("update_dedupe", dispatcher.deduplicator.stats)
+metrics.track_stats("outbox", outbox.stats)
+metrics.track_stats("submission", submission_engine.stats)
+metrics.track_stats("ledger_stream", ledger_stream.stats)
+metrics.track_stats("wallet_pool", wallet_pool.stats)
+metrics.track_stats("idempotent_payments", idempotent_payments.stats)
+metrics.track_stats("assistant", assistant_session.stats)
+metrics.track_stats("intent_parser", intent_parser_stats)
+if persistence is not None:
+    metrics.track_stats("session_store", persistence.store.stats)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus text format: stage latency histograms, gauges and component counts
+    return metrics.render(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+def start_services():
+    """
+    Starts everything the webhook needs, in order, on the dispatcher's loop.
+    """
+    # Load the Whisper model in the transcription workers before taking traffic
+    transcription_service.start()
+
+    # Everything async runs on the dispatcher's loop from here on
+    dispatcher.start()
+
+    # Make sure wallet lookups are indexed and every record has its address before taking traffic
+    dispatcher.run(ensure_indexes())
+    dispatcher.run(backfill_wallet_addresses())
+    dispatcher.run(idempotent_payments.ensure_indexes())
+    if persistence is not None:
+        dispatcher.run(persistence.store.ensure_indexes())
+
+    # Bot messages go out through the rate-limited outbox
+    dispatcher.run(outbox.start(bot))
+
+    # Watch every managed account for validations and incoming payments
+    async def notify(user_id, text):
+        outbox.post(user_id, text)
+    dispatcher.run(ledger_stream.start(notify))
+
+    # Keep funded wallets ready so /register doesn't wait on the faucet
+    dispatcher.run(wallet_pool.start())
+
     # Initialize the application
-    loop.run_until_complete(bot.initialize())
-    loop.run_until_complete(application.initialize())
-    
-    # Start the Flask server
-    app.run(port=8443)
+    dispatcher.run(bot.initialize())
+    dispatcher.run(application.initialize())
+
+def stop_services():
+    """
+    Drains queued updates and shuts down what start_services started.
+    """
+    dispatcher.drain()
+    dispatcher.run(outbox.stop())
+    dispatcher.run(wallet_pool.stop())
+    dispatcher.run(ledger_stream.stop())
+    dispatcher.run(assistant_session.close())
+    dispatcher.run(application.shutdown())
+    dispatcher.run(bot.shutdown())
+    thread_registry.flush()
+    dispatcher.stop()
+    transcription_service.shutdown()
+
+def run_app():
+    start_services()
+
+    # Shut down through the same path as Ctrl+C so in-flight updates drain
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Start the Flask server; it only parses and queues updates
+    try:
+        app.run(port=8443, threaded=True)
+    finally:
+        stop_services()
 
 if __name__ == '__main__':
     run_app()
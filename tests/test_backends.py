@@ -0,0 +1,22 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper_model = pytest.importorskip("whisper.model")
+
+from assistant.backends import quantize_linear_layers
+
+
+def test_quantizes_whisper_linear_layers():
+    model = torch.nn.Sequential(
+        whisper_model.Linear(8, 8),
+        torch.nn.GELU(),
+        torch.nn.Sequential(whisper_model.Linear(8, 4, bias=False)),
+    )
+    samples = torch.randn(2, 8)
+    expected = model(samples)
+
+    quantized = quantize_linear_layers(model)
+    dynamic = [module for module in quantized.modules() if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)]
+    assert len(dynamic) == 2
+    assert not any(isinstance(module, whisper_model.Linear) for module in quantized.modules())
+    assert torch.allclose(quantized(samples), expected, atol=0.1)
@@ -0,0 +1,99 @@
+import pytest
+from assistant.intent_parser import (
+    InvalidAmountError,
+    amount_error,
+    normalize_command,
+    parse_confirmation,
+    parse_payment_command,
+)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("send 5 XRP to @bob", {"action": "send", "amount": 5, "currency": "XRP", "recipient": "@bob"}),
+    ("Send five XRP to Bob.", {"action": "send", "amount": 5, "currency": "XRP", "recipient": "@Bob"}),
+    ("Please send twenty-five xrp to @alice_1!", {"action": "send", "amount": 25, "currency": "XRP", "recipient": "@alice_1"}),
+    ("pay @charlie 12 XRP", {"action": "send", "amount": 12, "currency": "XRP", "recipient": "@charlie"}),
+    ("send 0.5 XRP to @dave", {"action": "send", "amount": 0.5, "currency": "XRP", "recipient": "@dave"}),
+    ("send two point five xrp to dave", {"action": "send", "amount": 2.5, "currency": "XRP", "recipient": "@dave"}),
+    ("send two thousand and twenty five xrp to bob", {"action": "send", "amount": 2025, "currency": "XRP", "recipient": "@bob"}),
+    ("send one hundred five xrp to bob", {"action": "send", "amount": 105, "currency": "XRP", "recipient": "@bob"}),
+    ("send one and a half xrp to bob", {"action": "send", "amount": 1.5, "currency": "XRP", "recipient": "@bob"}),
+    ("transfer 1,000 xrp to @grace", {"action": "send", "amount": 1000, "currency": "XRP", "recipient": "@grace"}),
+    ("send 0.000001 xrp to @bob", {"action": "send", "amount": 0.000001, "currency": "XRP", "recipient": "@bob"}),
+    ("request 20 xrp from @alice", {"action": "request", "amount": 20, "currency": "XRP", "recipient": "@alice"}),
+    ("Um, can you request one hundred and fifty XRP from Bennettyong?",
+     {"action": "request", "amount": 150, "currency": "XRP", "recipient": "@Bennettyong"}),
+    ("ask @heidi for 15 XRP", {"action": "request", "amount": 15, "currency": "XRP", "recipient": "@heidi"}),
+])
+def test_parses_formulaic_commands(text, expected):
+    assert parse_payment_command(text) == expected
+
+
+def test_parses_sends_to_several_recipients():
+    assert parse_payment_command("send 5 XRP each to @a, @b and @c") == {
+        "action": "send", "amount": 5, "currency": "XRP", "recipients": ["@a", "@b", "@c"],
+    }
+    assert parse_payment_command("pay @a @b 2 xrp each")["recipients"] == ["@a", "@b"]
+
+
+@pytest.mark.parametrize("text", [
+    "send 5 BTC to @bob",
+    "send 5 xrp to me",
+    "send 5 xrp to bob and alice",
+    "send 5 xrp",
+    "send xrp to bob",
+    "what's my balance?",
+    "yes",
+    "",
+    None,
+    "send one two xrp to bob",
+    "send nineteen ninety xrp to bob",
+    "send twenty thirty xrp to bob",
+    "send five twenty xrp to bob",
+    "send twelve three xrp to bob",
+    "send twenty five six xrp to bob",
+])
+def test_leaves_everything_else_to_the_assistant(text):
+    assert parse_payment_command(text) is None
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("send 0 xrp to @bob", "more than 0"),
+    ("send 0.0000001 xrp to @bob", "at most 6 decimal places"),
+    ("send 1.1234567 xrp to @bob", "at most 6 decimal places"),
+    ("send 0.0000001 xrp each to @a and @b", "at most 6 decimal places"),
+    ("request 5000000 xrp from @alice", "can't be more than"),
+])
+def test_rejects_amounts_that_cant_be_sent(text, reason):
+    with pytest.raises(InvalidAmountError, match=reason):
+        parse_payment_command(text)
+
+
+@pytest.mark.parametrize("amount", [1, 0.5, "12.5", "0.000001", "5.000000000", 1000000])
+def test_amount_error_accepts_valid_amounts(amount):
+    assert amount_error(amount) is None
+
+
+@pytest.mark.parametrize("amount", [0, -3, "abc", "nan", "inf", 1e-7, "1.0000001", None])
+def test_amount_error_rejects_invalid_amounts(amount):
+    assert amount_error(amount)
+
+
+def test_normalize_command_keeps_handle_case():
+    assert normalize_command("Hey, send twenty five XRP to @Bob!") == "send 25 XRP to @Bob"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Yes", True),
+    ("yes please!", True),
+    ("OK", True),
+    ("Yes, that's correct", True),
+    ("No", False),
+    ("cancel", False),
+    ("no thanks", False),
+    ("yes but make it 10 xrp", None),
+    ("send 5 xrp to @bob", None),
+    ("", None),
+])
+def test_parse_confirmation(text, expected):
+    assert parse_confirmation(text) is expected
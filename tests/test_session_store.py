@@ -0,0 +1,108 @@
+import asyncio
+import time
+import pytest
+from bot.database import WalletRepository
+from bot.memory_store import InMemoryDatabase
+from bot.session_store import SQLiteSessionStore, MongoSessionStore, SessionPersistence
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def make_store(request, tmp_path):
+    database = InMemoryDatabase()
+
+    def make(ttl=60):
+        if request.param == "sqlite":
+            return SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=ttl)
+        return MongoSessionStore(WalletRepository(database), ttl=ttl)
+    return make
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_missing_entry_reads_empty(make_store):
+    assert run(make_store().get("user:1")) == ({}, 0)
+
+
+def test_compare_and_set_bumps_the_version(make_store):
+    store = make_store()
+
+    async def scenario():
+        assert await store.compare_and_set("user:1", {"a": 1}, 0)
+        assert await store.get("user:1") == ({"a": 1}, 1)
+        assert await store.compare_and_set("user:1", {"a": 2}, 1)
+        return await store.get("user:1")
+    assert run(scenario()) == ({"a": 2}, 2)
+
+
+def test_compare_and_set_rejects_a_stale_version(make_store):
+    store = make_store()
+
+    async def scenario():
+        await store.compare_and_set("user:1", {"a": 1}, 0)
+        await store.compare_and_set("user:1", {"a": 2}, 1)
+        # Both a first insert and an update against an old version lose
+        assert not await store.compare_and_set("user:1", {"a": 3}, 0)
+        assert not await store.compare_and_set("user:1", {"a": 3}, 1)
+        return await store.get("user:1")
+    assert run(scenario()) == ({"a": 2}, 2)
+    assert store.stats["conflicts"] == 2
+
+
+def test_expired_entry_reads_empty_and_can_be_rewritten(make_store):
+    store = make_store(ttl=0.05)
+
+    async def scenario():
+        await store.compare_and_set("user:1", {"a": 1}, 0)
+        time.sleep(0.1)
+        data, version = await store.get("user:1")
+        assert data == {}
+        assert await store.compare_and_set("user:1", {"b": 2}, version)
+        return await store.get("user:1")
+    assert run(scenario()) == ({"b": 2}, 2)
+
+
+def test_delete(make_store):
+    store = make_store()
+
+    async def scenario():
+        await store.compare_and_set("user:1", {"a": 1}, 0)
+        await store.delete("user:1")
+        return await store.get("user:1")
+    assert run(scenario()) == ({}, 0)
+
+
+def test_persistence_merges_a_conflicting_write(make_store):
+    store = make_store()
+    first, second = SessionPersistence(store), SessionPersistence(store)
+
+    async def scenario():
+        data_first, data_second = {}, {}
+        await first.refresh_user_data(1, data_first)
+        await second.refresh_user_data(1, data_second)
+
+        # Another process saves first; this one's confirmation prompt must survive
+        data_second["language"] = "en"
+        await second.update_user_data(1, dict(data_second))
+        data_first.update(awaiting_confirmation=True, payment_info={"amount": 5}, confirmation_id="c1")
+        await first.update_user_data(1, dict(data_first))
+
+        loaded = {}
+        await second.refresh_user_data(1, loaded)
+        return loaded
+    assert run(scenario()) == {
+        "language": "en", "awaiting_confirmation": True, "payment_info": {"amount": 5}, "confirmation_id": "c1",
+    }
+
+
+def test_merge_takes_linked_keys_together():
+    persistence = SessionPersistence(store=None)
+    base = {"awaiting_confirmation": True, "payment_info": {"amount": 5}, "confirmation_id": "c1"}
+    # This update settled the confirmation while another process replaced the prompt
+    ours = {}
+    theirs = {"awaiting_confirmation": True, "payment_info": {"amount": 9}, "confirmation_id": "c2", "other": 1}
+    assert persistence.merge(base, ours, theirs) == {"other": 1}
+
+    ours = dict(base, confirmation_id="c3")
+    assert persistence.merge(base, ours, theirs) == dict(ours, other=1)
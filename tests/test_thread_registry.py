@@ -0,0 +1,24 @@
+import asyncio
+from assistant.thread_registry import SQLiteThreadRegistry
+
+
+def test_failed_flush_is_retried_without_further_writes(tmp_path):
+    registry = SQLiteThreadRegistry(str(tmp_path / "threads.db"), flush_interval=0.01, cache_ttl=0)
+    registry.max_retry_delay = 0.05
+    write = registry._write
+    failures = []
+
+    def flaky_write(changes):
+        if not failures:
+            failures.append(changes)
+            raise OSError("disk full")
+        write(changes)
+    registry._write = flaky_write
+
+    async def scenario():
+        registry.set(1, "thread_1", "alice")
+        await asyncio.sleep(0.3)
+    asyncio.run(scenario())
+
+    assert failures
+    assert registry._load_entry("1") == {"thread_id": "thread_1", "username": "alice"}
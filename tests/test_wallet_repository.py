@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from bot.cache import WalletCache
+from bot.database import CachedWalletRepository, WalletRepository
+from bot.memory_store import InMemoryDatabase
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def repository():
+    repository = CachedWalletRepository(InMemoryDatabase(), cache=WalletCache(maxsize=10, ttl=60, secret_ttl=60))
+    run(repository.save_user_wallet(1, "alice", "sEdSeed", "rAlice"))
+    return repository
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_private_key_only_when_asked_for(repository, cached):
+    async def scenario():
+        if cached:
+            # Warm the cache with the key so the hit path is the one tested
+            await repository.get_user_wallet(1)
+        by_id = await repository.get_user_wallet(1, need_secret=False)
+        by_username = await repository.get_user_wallet_by_username("alice", need_secret=False)
+        user, _ = await repository.get_user_wallets(1, need_secret=False)
+        return by_id, by_username, user
+    for record in run(scenario()):
+        assert record["address"] == "rAlice"
+        assert "private_key" not in record
+
+
+def test_uncached_repository_strips_the_key_too():
+    repository = WalletRepository(InMemoryDatabase())
+
+    async def scenario():
+        await repository.save_user_wallet(1, "alice", "sEdSeed", "rAlice")
+        by_id = await repository.get_user_wallet(1, need_secret=False)
+        by_username = await repository.get_user_wallet_by_username("alice", need_secret=False)
+        user, _ = await repository.get_user_wallets(1, need_secret=False)
+        with_key = await repository.get_user_wallet(1)
+        return [by_id, by_username, user], with_key
+    records, with_key = run(scenario())
+    for record in records:
+        assert record["address"] == "rAlice"
+        assert "private_key" not in record
+    assert with_key["private_key"] == "sEdSeed"
+
+
+def test_stripping_a_lookup_keeps_the_key_cached(repository):
+    async def scenario():
+        await repository.get_user_wallet(1, need_secret=False)
+        return await repository.get_user_wallet(1)
+    assert run(scenario())["private_key"] == "sEdSeed"
+    assert repository.cache.stats["hits"] == 1
+
+
+def test_ensure_address_derives_and_stores_a_missing_address(repository):
+    from xrpl.wallet import Wallet
+    seed = Wallet.create().seed
+
+    async def scenario():
+        await repository.collection.insert_one({"user_id": 2, "username": "bob", "private_key": seed})
+        _, recipients = await repository.get_user_wallets(usernames=["bob"])
+        address = await repository.ensure_address(recipients["bob"])
+        return address, await repository.collection.find_one({"user_id": 2})
+    address, stored = run(scenario())
+    assert address == Wallet.from_seed(seed).address
+    assert stored["address"] == address and stored["private_key"] == seed
+
+
+def test_ensure_address_leaves_an_underivable_record_alone(repository):
+    async def scenario():
+        await repository.collection.insert_one({"user_id": 2, "username": "bob", "private_key": "not a seed"})
+        address = await repository.ensure_address(await repository.get_user_wallet(2, need_secret=False))
+        return address, await repository.collection.find_one({"user_id": 2})
+    address, stored = run(scenario())
+    assert address is None
+    assert "address" not in stored and stored["private_key"] == "not a seed"
+
+
+def test_save_drops_a_record_cached_during_the_write(repository):
+    update_one = repository.collection.update_one
+
+    async def racing_update(*args, **kwargs):
+        # A read lands after the first invalidation but before the write
+        await repository.get_user_wallet(1)
+        return await update_one(*args, **kwargs)
+
+    async def scenario():
+        repository.collection.update_one = racing_update
+        await repository.save_user_wallet(1, "alice", "sEdOther", "rOther")
+        return await repository.get_user_wallet(1)
+    assert run(scenario())["address"] == "rOther"
+
+
+def test_reassigned_username_moves_to_the_new_owner(repository):
+    async def scenario():
+        await repository.ensure_indexes()
+        # Cached under the old owner before the name changes hands
+        await repository.get_user_wallet_by_username("alice")
+        saved = await repository.save_user_wallet(2, "alice", "sEdNew", "rNew")
+        return saved, await repository.get_user_wallet_by_username("alice"), await repository.get_user_wallet(1)
+    saved, new_owner, old_owner = run(scenario())
+    assert saved
+    assert new_owner["user_id"] == 2
+    assert "username" not in old_owner and old_owner["private_key"] == "sEdSeed"